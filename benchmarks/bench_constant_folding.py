@@ -0,0 +1,56 @@
+import argparse
+from pathlib import Path
+
+from compiler.code_generator import CodeGenerator, command_count
+from compiler.constant_folding import fold_constants
+from compiler.klein_errors import KleinError
+from compiler.parser import Parser
+from compiler.scanner import Scanner
+from compiler.semantic_analyzer import SemanticAnalyzer
+
+PROGRAMS_DIR = Path(__file__).parent.parent / "tests" / "programs"
+
+
+def instruction_count(program: str, *, constant_folding: bool) -> int:
+    ast = Parser(Scanner(program)).parse()
+    semantic_analyzer = SemanticAnalyzer(ast)
+    semantic_analyzer.annotate()
+    if constant_folding:
+        ast = fold_constants(ast)
+    code_generator = CodeGenerator(ast, semantic_analyzer.symbol_table)
+    code_generator.generate()
+    return command_count(code_generator.lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Report how many tm instructions constant folding saves",
+    )
+    parser.add_argument(
+        "programs",
+        nargs="*",
+        type=Path,
+        help="Klein programs to compile (default: the programs in tests/programs)",
+    )
+    args = parser.parse_args()
+
+    print(f"{'program':<32} {'before':>7} {'after':>7} {'saved':>7}")
+    total_before = total_after = 0
+    for path in args.programs or sorted(PROGRAMS_DIR.glob("*.kln")):
+        program = path.read_text()
+        try:
+            before = instruction_count(program, constant_folding=False)
+            after = instruction_count(program, constant_folding=True)
+        except KleinError:
+            continue
+        total_before += before
+        total_after += after
+        print(f"{path.name:<32} {before:>7} {after:>7} {before - after:>7}")
+    print(
+        f"{'total':<32} {total_before:>7} {total_after:>7} "
+        + f"{total_before - total_after:>7}",
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import argparse
+from dataclasses import fields, replace
+from pathlib import Path
+
+from compiler.code_generator import command_count
+from compiler.constant_folding import fold_constants
+from compiler.inliner import inline_functions
+from compiler.ir_backend import CODE_GENERATOR_BACKENDS
+from compiler.memoization import memoized_functions
+from compiler.parser import Parser
+from compiler.programs.compile import Optimizations
+from compiler.scanner import Scanner
+from compiler.semantic_analyzer import SemanticAnalyzer
+from compiler.tm_vm import TMMachine, TMProfile, assemble
+
+PROGRAMS_DIR = Path(__file__).parent.parent / "tests" / "programs"
+
+# Sample programs and the arguments they are run with
+PROGRAM_ARGUMENTS: dict[str, list[int]] = {
+    "circular-prime.kln": [50],
+    "divide.kln": [7, 3, 20],
+    "euclid.kln": [100000, 3],
+    "factors.kln": [360],
+    "farey.kln": [3, 7, 100],
+    "fibonacci.kln": [40],
+    "generate-excellent.kln": [2],
+    "horner-parameters.kln": [1, 2, 3, 4, 5],
+    "is-cantor-number.kln": [100],
+    "is-excellent.kln": [3468],
+    "is-special.kln": [145],
+    "lib.kln": [20],
+    "modulus-by-hand.kln": [10000, 7],
+    "palindrome.kln": [1234321],
+    "russian-peasant.kln": [1234, 5678],
+    "sieve.kln": [100],
+    "sqrt-newton.kln": [1000000, 1],
+    "sum-factors.kln": [496],
+    "two-primes.kln": [100, 1],
+}
+
+
+def compile_and_profile(
+    program: str,
+    arguments: list[int],
+    optimizations: Optimizations,
+    code_generator_backend: str = "direct",
+) -> tuple[int, TMProfile]:
+    ast = Parser(Scanner(program)).parse()
+    semantic_analyzer = SemanticAnalyzer(ast)
+    semantic_analyzer.annotate()
+    if optimizations.inlining:
+        _ = inline_functions(ast, semantic_analyzer.symbol_table)
+    if optimizations.constant_folding:
+        ast = fold_constants(ast)
+    memoized: set[str] = set()
+    if optimizations.memoization:
+        memoized = memoized_functions(ast, semantic_analyzer.symbol_table)
+    code_generator = CODE_GENERATOR_BACKENDS[code_generator_backend](
+        ast,
+        semantic_analyzer.symbol_table,
+        tail_calls=optimizations.tail_calls,
+        live_register_saves=optimizations.live_register_saves,
+        dead_function_elimination=optimizations.dead_function_elimination,
+        condition_jumps=optimizations.condition_jumps,
+        memoized_functions=memoized,
+        cache_size=optimizations.cache_size,
+        peephole=optimizations.peephole,
+    )
+    code_generator.generate()
+    machine = TMMachine(
+        assemble(code_generator.lines),
+        dmem_size=1_000_000,
+        write_output=lambda _: None,
+    )
+    return command_count(code_generator.lines), machine.profile(arguments)
+
+
+def main():
+    names = [field.name for field in fields(Optimizations) if field.type is bool]
+    parser = argparse.ArgumentParser(
+        description="Compare the size of the generated code and the instructions "
+        + "executed and DMEM used when running it, with and without optimizations",
+    )
+    parser.add_argument(
+        "--disable",
+        choices=names,
+        action="append",
+        help="Optimization left out of the baseline (default: all of them)",
+    )
+    parser.add_argument(
+        "--enable",
+        choices=names,
+        action="append",
+        help="Optimization that is off by default to turn on in the optimized build",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=Optimizations.cache_size,
+        help="Results cached per memoized function, when memoization is on",
+    )
+    parser.add_argument(
+        "--code-generator",
+        choices=CODE_GENERATOR_BACKENDS,
+        default="direct",
+        help="Code generator backend used for both builds",
+    )
+    args = parser.parse_args()
+
+    optimized = Optimizations(
+        **dict.fromkeys(args.enable or [], True),
+        cache_size=args.cache_size,
+    )
+    baseline = replace(optimized, **dict.fromkeys(args.disable or names, False))
+    print(f"baseline: {baseline}")
+    print(
+        f"{'program':<24} {'size':>11} {'executed':>21} {'call depth':>15} "
+        + f"{'max dmem':>17}",
+    )
+    totals = [0, 0, 0, 0]
+    for filename, arguments in PROGRAM_ARGUMENTS.items():
+        program = (PROGRAMS_DIR / filename).read_text()
+        before_size, before = compile_and_profile(
+            program,
+            arguments,
+            baseline,
+            args.code_generator,
+        )
+        after_size, after = compile_and_profile(
+            program,
+            arguments,
+            optimized,
+            args.code_generator,
+        )
+        totals[0] += before.instructions_executed
+        totals[1] += after.instructions_executed
+        totals[2] += before_size
+        totals[3] += after_size
+        print(
+            f"{filename:<24} {before_size:>5} {after_size:>5} "
+            + f"{before.instructions_executed:>10} {after.instructions_executed:>10} "
+            + f"{before.max_call_depth:>7} {after.max_call_depth:>7} "
+            + f"{before.max_stored_address:>8} {after.max_stored_address:>8}",
+        )
+    print(
+        f"{'total':<24} {totals[2]:>5} {totals[3]:>5} {totals[0]:>10} {totals[1]:>10} "
+        + f"({1 - totals[1] / totals[0]:.1%} fewer instructions executed)",
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import argparse
+from collections import Counter
+from dataclasses import replace
+
+from bench_generated_code import PROGRAM_ARGUMENTS, PROGRAMS_DIR, compile_and_profile
+
+from compiler.inliner import inline_functions
+from compiler.parser import Parser
+from compiler.programs.compile import Optimizations
+from compiler.scanner import Scanner
+from compiler.semantic_analyzer import SemanticAnalyzer
+
+
+def report_decisions(program: str):
+    ast = Parser(Scanner(program)).parse()
+    semantic_analyzer = SemanticAnalyzer(ast)
+    semantic_analyzer.annotate()
+    decisions = Counter(
+        (decision.caller, decision.callee, decision.reason or "inlined")
+        for decision in inline_functions(ast, semantic_analyzer.symbol_table)
+    )
+    for (caller, callee, reason), count in decisions.items():
+        print(f"    {caller} -> {callee}: {reason}" + (f" (x{count})" * (count > 1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Report which calls the inliner inlines in the sample programs "
+        + "and how many tm instructions running them executes with and without "
+        + "inlining",
+    )
+    parser.add_argument(
+        "--quiet",
+        action="store_true",
+        help="Only print the instruction counts, not every decision",
+    )
+    args = parser.parse_args()
+
+    optimized = Optimizations()
+    baseline = replace(optimized, inlining=False)
+    print(f"{'program':<24} {'size':>11} {'executed':>21}")
+    total_before = total_after = 0
+    for filename, arguments in PROGRAM_ARGUMENTS.items():
+        program = (PROGRAMS_DIR / filename).read_text()
+        before_size, before = compile_and_profile(program, arguments, baseline)
+        after_size, after = compile_and_profile(program, arguments, optimized)
+        total_before += before.instructions_executed
+        total_after += after.instructions_executed
+        print(
+            f"{filename:<24} {before_size:>5} {after_size:>5} "
+            + f"{before.instructions_executed:>10} {after.instructions_executed:>10}",
+        )
+        if not args.quiet:
+            report_decisions(program)
+    print(
+        f"{'total':<24} {'':>11} {total_before:>10} {total_after:>10} "
+        + f"({1 - total_after / total_before:.1%} fewer instructions executed)",
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+from bench_generated_code import PROGRAM_ARGUMENTS, PROGRAMS_DIR, compile_and_profile
+
+from compiler.constant_folding import fold_constants
+from compiler.inliner import inline_functions
+from compiler.ir import instruction_count, lower_function, optimize_function
+from compiler.parser import Parser
+from compiler.programs.compile import Optimizations
+from compiler.scanner import Scanner
+from compiler.semantic_analyzer import SemanticAnalyzer
+
+
+def ir_sizes(program: str) -> tuple[int, int]:
+    # The number of ir instructions of every function before and after
+    # optimizing them
+    ast = Parser(Scanner(program)).parse()
+    semantic_analyzer = SemanticAnalyzer(ast)
+    semantic_analyzer.annotate()
+    _ = inline_functions(ast, semantic_analyzer.symbol_table)
+    ast = fold_constants(ast)
+    lowered = optimized = 0
+    for definition in ast.definition_list:
+        function = lower_function(definition)
+        lowered += instruction_count(function)
+        optimized += instruction_count(optimize_function(function))
+    return lowered, optimized
+
+
+def main():
+    optimizations = Optimizations()
+    print(f"{'program':<24} {'ir':>11} {'size':>11} {'executed':>21}")
+    totals = [0, 0, 0, 0, 0, 0]
+    for filename, arguments in PROGRAM_ARGUMENTS.items():
+        program = (PROGRAMS_DIR / filename).read_text()
+        lowered, optimized = ir_sizes(program)
+        direct_size, direct = compile_and_profile(program, arguments, optimizations)
+        ir_size, ir = compile_and_profile(program, arguments, optimizations, "ir")
+        row = [
+            lowered,
+            optimized,
+            direct_size,
+            ir_size,
+            direct.instructions_executed,
+            ir.instructions_executed,
+        ]
+        totals = [total + value for total, value in zip(totals, row, strict=True)]
+        print(
+            f"{filename:<24} {row[0]:>5} {row[1]:>5} {row[2]:>5} {row[3]:>5} "
+            + f"{row[4]:>10} {row[5]:>10}",
+        )
+    print(
+        f"{'total':<24} {totals[0]:>5} {totals[1]:>5} {totals[2]:>5} {totals[3]:>5} "
+        + f"{totals[4]:>10} {totals[5]:>10}",
+    )
+    print(
+        f"The ir backend emits {1 - totals[3] / totals[2]:.1%} fewer instructions "
+        + f"and executes {1 - totals[5] / totals[4]:.1%} fewer than the direct one",
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import argparse
+import time
+from pathlib import Path
+
+from compiler.klein_errors import KleinError
+from compiler.parser import Parser
+from compiler.recursive_descent import PARSER_BACKENDS
+from compiler.scanner import Scanner
+
+PROGRAMS_DIR = Path(__file__).parent.parent / "tests" / "programs"
+
+
+def parsable_samples() -> list[str]:
+    samples: list[str] = []
+    for path in sorted(PROGRAMS_DIR.glob("*.kln")):
+        sample = path.read_text()
+        try:
+            _ = Parser(Scanner(sample)).parse()
+        except KleinError:
+            continue
+        samples.append(sample)
+    return samples
+
+
+def generate_program(size_in_bytes: int) -> str:
+    # Concatenates the sample programs until the program is large enough. The
+    # parser does not check for duplicate functions, so the result parses even
+    # though it would not pass semantic analysis.
+    samples = parsable_samples()
+    chunks: list[str] = []
+    total = 0
+    while total < size_in_bytes:
+        for sample in samples:
+            chunks.append(sample)
+            total += len(sample)
+    return "\n".join(chunks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure parser throughput")
+    parser.add_argument("--megabytes", type=float, default=2)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--parser",
+        choices=PARSER_BACKENDS,
+        action="append",
+        help="Parser backend to measure (default: all of them)",
+    )
+    args = parser.parse_args()
+
+    program = generate_program(int(args.megabytes * 1024 * 1024))
+    token_count = sum(1 for _ in Scanner(program))
+    scan_time = float("inf")
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        for _ in Scanner(program):
+            pass
+        scan_time = min(scan_time, time.perf_counter() - start)
+
+    print(f"source size: {len(program) / (1024 * 1024):.2f} MB")
+    print(f"tokens:      {token_count}")
+    for backend in args.parser or PARSER_BACKENDS:
+        parse_time = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            _ = PARSER_BACKENDS[backend](Scanner(program)).parse()
+            parse_time = min(parse_time, time.perf_counter() - start)
+
+        print(f"{backend}:")
+        print(f"  best time:  {parse_time:.3f} s")
+        print(f"    excluding scanning: {parse_time - scan_time:.3f} s")
+        print(f"  throughput: {token_count / parse_time:,.0f} tokens/s")
+
+
+if __name__ == "__main__":
+    main()
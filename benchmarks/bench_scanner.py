@@ -0,0 +1,57 @@
+import argparse
+import time
+from pathlib import Path
+
+from compiler.regex_scanner import SCANNER_BACKENDS
+
+PROGRAMS_DIR = Path(__file__).parent.parent / "tests" / "programs"
+
+
+def generate_source(size_in_bytes: int) -> str:
+    # Concatenates the sample programs until the source is large enough. The
+    # result is not a valid program (duplicate functions), but it is lexically
+    # valid, which is all the scanner cares about.
+    samples = [path.read_text() for path in sorted(PROGRAMS_DIR.glob("*.kln"))]
+    chunks: list[str] = []
+    total = 0
+    while total < size_in_bytes:
+        for sample in samples:
+            chunks.append(sample)
+            total += len(sample)
+    return "\n".join(chunks)
+
+
+def count_tokens(program: str, backend: str = "reference") -> int:
+    return sum(1 for _ in SCANNER_BACKENDS[backend](program))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure scanner throughput")
+    parser.add_argument("--megabytes", type=float, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--scanner",
+        choices=SCANNER_BACKENDS,
+        action="append",
+        help="Scanner backend to measure (default: all of them)",
+    )
+    args = parser.parse_args()
+
+    program = generate_source(int(args.megabytes * 1024 * 1024))
+    print(f"source size: {len(program) / (1024 * 1024):.2f} MB")
+    for backend in args.scanner or SCANNER_BACKENDS:
+        best = float("inf")
+        token_count = 0
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            token_count = count_tokens(program, backend)
+            best = min(best, time.perf_counter() - start)
+
+        print(f"{backend}:")
+        print(f"  tokens:     {token_count}")
+        print(f"  best time:  {best:.3f} s")
+        print(f"  throughput: {token_count / best:,.0f} tokens/s")
+
+
+if __name__ == "__main__":
+    main()
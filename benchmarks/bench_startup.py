@@ -0,0 +1,66 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from compiler import parse_table
+from compiler.parser import Parser
+from compiler.scanner import Scanner
+
+SOURCE_DIR = Path(__file__).parent.parent / "src"
+PROGRAMS_DIR = Path(__file__).parent.parent / "tests" / "programs"
+
+
+def clear_parse_table_cache():
+    cache_dir = Path(parse_table.__file__).parent / "__pycache__"
+    for path in cache_dir.glob("*.pickle"):
+        path.unlink()
+
+
+def time_klein_compile(program: str) -> float:
+    # Runs klein_compile in a fresh interpreter, the same way kleinc does
+    environment = os.environ | {"PYTHONPATH": str(SOURCE_DIR)}
+    start = time.perf_counter()
+    _ = subprocess.run(
+        [sys.executable, "-m", "compiler.programs.compile", program],
+        env=environment,
+        stdout=subprocess.DEVNULL,
+        check=True,
+    )
+    return time.perf_counter() - start
+
+
+def time_parser_construction(count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        _ = Parser(Scanner(""))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure klein_compile start up time",
+    )
+    parser.add_argument("--program", type=Path, default=PROGRAMS_DIR / "print-one.kln")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--parsers", type=int, default=10000)
+    args = parser.parse_args()
+    program = args.program.read_text()
+
+    cold = float("inf")
+    for _ in range(args.repeat):
+        clear_parse_table_cache()
+        cold = min(cold, time_klein_compile(program))
+    warm = min(time_klein_compile(program) for _ in range(args.repeat))
+    print("klein_compile (best of fresh processes):")
+    print(f"  without cached parse table: {cold * 1000:.1f} ms")
+    print(f"  with cached parse table:    {warm * 1000:.1f} ms")
+
+    elapsed = time_parser_construction(args.parsers)
+    print(f"Parser construction: {elapsed / args.parsers * 1e6:.2f} us per parser")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import argparse
+import time
+
+from compiler.code_generator import REG_PC, REG_ZERO
+from compiler.tm import (
+    AddCommand,
+    HaltCommand,
+    JgtCommand,
+    LdcCommand,
+    LdCommand,
+    OutCommand,
+    StCommand,
+    SubCommand,
+    TMEmitter,
+)
+from compiler.tm_vm import TMMachine, assemble
+
+
+def loop_program(iterations: int) -> TMEmitter:
+    # Sums the numbers from 1 to iterations, going through data memory on every
+    # iteration so loads and stores are measured as well as arithmetic and jumps
+    emitter = TMEmitter()
+    emitter.extend(
+        [
+            LdcCommand(1, iterations, "Counter"),
+            LdcCommand(2, 1),
+            LdcCommand(3, 0, "Sum"),
+            AddCommand(3, 3, 1),
+            StCommand(3, 1, REG_ZERO),
+            LdCommand(3, 1, REG_ZERO),
+            SubCommand(1, 1, 2),
+            JgtCommand(1, -5, REG_PC, "Loop while the counter is positive"),
+            OutCommand(3),
+            HaltCommand(),
+        ],
+    )
+    return emitter
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure TM virtual machine speed")
+    parser.add_argument("--iterations", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    outputs: list[int] = []
+    machine = TMMachine(
+        assemble(loop_program(args.iterations).lines),
+        write_output=outputs.append,
+    )
+    best = float("inf")
+    executed = 0
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        executed = machine.run()
+        best = min(best, time.perf_counter() - start)
+
+    print(f"instructions: {executed}")
+    print(f"best time:    {best:.3f} s")
+    print(f"throughput:   {executed / best:,.0f} instructions/s")
+
+
+if __name__ == "__main__":
+    main()
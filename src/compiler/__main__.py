@@ -2,6 +2,8 @@ from compiler.programs.ast_lister import ast_to_text
 from compiler.programs.ast_lister_dot import ast_to_dot
 from compiler.programs.compile import compile  # noqa: A004
 from compiler.programs.display_symbol_table import display_symbol_table
+from compiler.programs.ir_lister import list_ir
+from compiler.programs.run_tm import run_tm
 from compiler.programs.token_lister import list_tokens
 from compiler.programs.validator import validate_klein_program
 
@@ -26,5 +28,13 @@ def klein_display_symbol_table():
     return display_symbol_table()
 
 
+def klein_list_ir():
+    return list_ir()
+
+
 def klein_compile():
     return compile()
+
+
+def klein_run_tm():
+    return run_tm()
@@ -0,0 +1,63 @@
+from collections.abc import Iterator
+
+from compiler.ast_nodes import (
+    BinaryExpression,
+    BooleanLiteral,
+    Definition,
+    Expression,
+    FunctionCallExpression,
+    Identifier,
+    IfExpression,
+    IntegerLiteral,
+    Program,
+    UnaryExpression,
+)
+
+
+def is_leaf(expression: Expression) -> bool:
+    return isinstance(expression, (IntegerLiteral, BooleanLiteral, Identifier))
+
+
+def walk(expression: Expression) -> Iterator[Expression]:
+    # The expression and every expression within it
+    yield expression
+    if isinstance(expression, BinaryExpression):
+        yield from walk(expression.left_side)
+        yield from walk(expression.right_side)
+    elif isinstance(expression, UnaryExpression):
+        yield from walk(expression.value)
+    elif isinstance(expression, IfExpression):
+        yield from walk(expression.condition)
+        yield from walk(expression.consequent)
+        yield from walk(expression.alternative)
+    elif isinstance(expression, FunctionCallExpression):
+        for argument in expression.argument_list.arguments:
+            yield from walk(argument.value)
+
+
+def called_functions(definition: Definition) -> set[str]:
+    return {
+        subexpression.function_name.value
+        for expression in (*definition.body.print_expressions, definition.body.body)
+        for subexpression in walk(expression)
+        if isinstance(subexpression, FunctionCallExpression)
+    }
+
+
+def reachable_functions(program: Program) -> set[str]:
+    # The functions main can end up calling (including print), and main itself.
+    # The calls are taken from the ast, since folding constants may have removed
+    # some of the calls the symbol table knows about
+    definitions = {
+        definition.name.value: definition for definition in program.definition_list
+    }
+    reachable = {"main"}
+    pending = ["main"]
+    while pending:
+        definition = definitions.get(pending.pop())
+        if definition is None:
+            continue
+        for called in called_functions(definition) - reachable:
+            reachable.add(called)
+            pending.append(called)
+    return reachable
@@ -1,46 +1,228 @@
+from collections.abc import Callable, Collection
 from dataclasses import dataclass
-from typing import Literal
+from functools import partial
+from typing import Literal, TextIO
 
 from compiler.ast_nodes import (
-    Body,
+    AndExpression,
+    BinaryExpression,
+    BooleanLiteral,
     Definition,
+    DivideExpression,
+    EqualsExpression,
     Expression,
     FunctionAnnotation,
+    FunctionCallExpression,
+    Identifier,
+    IfExpression,
     IntegerLiteral,
+    LessThanExpression,
+    MinusExpression,
+    NotExpression,
+    OrExpression,
+    PlusExpression,
     Program,
+    TimesExpression,
+    UnaryExpression,
+    UnaryMinusExpression,
 )
+from compiler.ast_utils import is_leaf, reachable_functions, walk
+from compiler.constant_folding import is_discardable
 from compiler.klein_errors import CodeGenerationError
+from compiler.peephole import optimize
 from compiler.symbol_table import SymbolTable
 from compiler.tm import (
+    FUNCTION_MARKER,
     AddCommand,
     Comment,
+    DivCommand,
     HaltCommand,
+    JeqCommand,
+    JgeCommand,
+    JltCommand,
+    Label,
+    LabelReference,
     LdaCommand,
     LdcCommand,
     LdCommand,
+    MulCommand,
     OutCommand,
     StCommand,
+    SubCommand,
+    TMCommand,
+    TMEmitter,
     TMLine,
+    resolve_labels,
 )
+from compiler.tm_vm import DMEM_SIZE
 
 REG_ZERO = 0
 REG_RETURN_VALUE = 4
 REG_STATUS = 5
 REG_TOP = 6
 REG_PC = 7
+# Registers used to evaluate expressions. Called functions save and restore them,
+# so values kept in them survive function calls.
+GENERAL_PURPOSE_REGISTERS: tuple[int, ...] = (1, 2, 3)
+# The return value register is only written by returning functions, so it doubles
+# as a scratch register for the second operand of an instruction
+REG_SCRATCH = REG_RETURN_VALUE
+
+# Offsets from the status pointer within a stack frame (the return address is at
+# offset 0 and the saved general purpose registers at offsets 1-3)
+SAVED_STATUS_OFFSET = 4
+SAVED_TOP_OFFSET = 5
+# Temporary values spilled by a function are stored after the frame's header
+TEMPORARIES_OFFSET = 6
+
+# Memoized functions each get a cache of this many entries by default, starting
+# after DMEM[0]. An entry is a cell marking it as used, the arguments and the
+# return value.
+DEFAULT_CACHE_SIZE = 64
+CACHES_START = 1
+HASH_MULTIPLIER = 31
+
+# Commands writing the register in their first operand
+WRITING_COMMANDS = frozenset(("IN", "LDC", "LDA", "LD", "ADD", "SUB", "MUL", "DIV"))
+
+ARITHMETIC_COMMANDS: dict[
+    type[BinaryExpression],
+    Callable[[int, int, int], TMCommand],
+] = {
+    PlusExpression: AddCommand,
+    MinusExpression: SubCommand,
+    TimesExpression: MulCommand,
+    DivideExpression: DivCommand,
+}
 
 
 @dataclass
 class MemoryLocation:
     location: Literal["register", "dmem"]
-    position: int
+    position: int  # The register, or the offset from the status pointer
+
+
+@dataclass
+class GeneratedFunction:
+    # A function's code before the registers it saves are known
+    name: str
+    param_count: int
+    temporary_count: int
+    body: list[TMLine]
+
+
+def command_count(code: list[TMLine]) -> int:
+    return sum(1 for line in code if isinstance(line, TMCommand))
+
+
+def is_zero(expression: Expression) -> bool:
+    return isinstance(expression, IntegerLiteral) and int(expression.value) == 0
+
+
+def is_comparison(expression: Expression) -> bool:
+    return isinstance(expression, (LessThanExpression, EqualsExpression))
+
+
+def is_condition(expression: Expression) -> bool:
+    # Boolean expressions whose value takes more instructions to compute than to
+    # jump on
+    return is_comparison(expression) or isinstance(expression, NotExpression)
+
+
+def contains_call(expression: Expression) -> bool:
+    return any(
+        isinstance(subexpression, FunctionCallExpression)
+        for subexpression in walk(expression)
+    )
+
+
+def reads_parameters(expression: Expression) -> bool:
+    return any(
+        isinstance(subexpression, Identifier) for subexpression in walk(expression)
+    )
+
+
+def written_registers(code: list[TMLine]) -> set[int]:
+    return {
+        line.operands[0]
+        for line in code
+        if isinstance(line, TMCommand)
+        and line.command in WRITING_COMMANDS
+        and line.operands[0] in GENERAL_PURPOSE_REGISTERS
+    }
+
+
+def held_first(
+    arguments: list[Expression],
+    must_hold: Callable[[Expression], bool],
+) -> tuple[list[int], int]:
+    # Orders the arguments so the ones that must be held (evaluated before the
+    # others are stored) come first, and returns the order with the number of
+    # arguments held. Arguments that could print or fail keep their order
+    # relative to each other, so only arguments that can't are moved after the
+    # held ones. The last held argument can be stored straight away, since
+    # nothing evaluated after it needs holding.
+    last = max(
+        (idx for idx, argument in enumerate(arguments) if must_hold(argument)),
+        default=-1,
+    )
+    held = [
+        idx
+        for idx, argument in enumerate(arguments[: last + 1])
+        if must_hold(argument) or not is_discardable(argument)
+    ]
+    rest = [idx for idx in range(len(arguments)) if idx not in held]
+    return held + rest, len(held) - 1
+
+
+def function_label(name: str) -> str:
+    return f"function {name}"
+
+
+def body_label(name: str) -> str:
+    # Where a function's body starts, after the registers have been saved
+    return f"body of {name}"
 
 
 class CodeGenerator:
-    def __init__(self, ast: Program, symbol_table: SymbolTable):
+    def __init__(
+        self,
+        ast: Program,
+        symbol_table: SymbolTable,
+        *,
+        tail_calls: bool = True,
+        live_register_saves: bool = True,
+        dead_function_elimination: bool = True,
+        condition_jumps: bool = True,
+        memoized_functions: Collection[str] = (),
+        cache_size: int = DEFAULT_CACHE_SIZE,
+        peephole: bool = True,
+    ):
         self._ast: Program = ast
         self._symbol_table: SymbolTable = symbol_table
-        self._code: list[TMLine] = []
+        self._tail_calls: bool = tail_calls
+        self._live_register_saves: bool = live_register_saves
+        self._dead_function_elimination: bool = dead_function_elimination
+        self._condition_jumps: bool = condition_jumps
+        self._memoized_functions: frozenset[str] = frozenset(memoized_functions)
+        self._cache_size: int = cache_size
+        # Where the cache of each memoized function starts in DMEM, and where the
+        # caches end
+        self._cache_addresses: dict[str, int] = {}
+        self._caches_end: int = CACHES_START
+        self._peephole: bool = peephole
+        self._emitter: TMEmitter = TMEmitter()
+        # Jumps within a function go to labels numbered in the order they are made
+        self._label_count: int = 0
+        # For each called function, the general purpose registers each of its
+        # callers holds values in while calling it
+        self._held_registers: dict[str, dict[str, set[int]]] = {}
+        # Details of the function currently being generated
+        self._function_name: str = ""
+        self._parameters: dict[str, int] = {}
+        self._temporaries_in_use: int = 0
+        self._temporary_count: int = 0
+        self._register_needs: dict[Expression, int] = {}
 
     def _get_parameter_count(self, name: str) -> int:
         fn = self._symbol_table.scope_lookup(name)
@@ -53,66 +235,101 @@ class CodeGenerator:
             )
         return len(fn_type.source)
 
-    def _select_tmp_register(self) -> int:
-        return 2  # Currently constant, but later can be more complicated logic
+    def _new_label(self, description: str) -> str:
+        self._label_count += 1
+        return f"{description} {self._label_count}"
 
-    # NOTE: Technically, this code is very similar to the "_generate_function_call"
-    # method, with the main difference being the loading of arguments. However,
-    # I think breaking it into smaller function risks obscuring the flow too much
-    # such that repeated code is acceptable in this case.
-    def _generate_setup(self) -> list[TMLine]:
-        param_count: int = self._get_parameter_count("main")
+    def _allocate_temporary(self) -> int:
+        # Temporaries are used like a stack, so they are released in the reverse
+        # order they are allocated
+        offset = TEMPORARIES_OFFSET + self._temporaries_in_use
+        self._temporaries_in_use += 1
+        self._temporary_count = max(self._temporary_count, self._temporaries_in_use)
+        return offset
+
+    def _release_temporary(self):
+        self._temporaries_in_use -= 1
 
-        # In theory, this section would be somehow extracted during the function
-        # generation process, though that seems to be part of the "next steps".
-        main_location_imem = 21 + 2 * param_count
-        # Explanation: Moving each param for main costs 2 lines (load into reg + store to new dmem slot)
+    def _register_need(self, expression: Expression) -> int:
+        # Sethi-Ullman numbering: the number of registers needed to evaluate the
+        # expression without spilling values into the stack frame
+        if expression in self._register_needs:
+            return self._register_needs[expression]
+        if isinstance(expression, (AndExpression, OrExpression)):
+            # Both sides are evaluated into the same register
+            need = max(
+                self._register_need(expression.left_side),
+                self._register_need(expression.right_side),
+            )
+        elif isinstance(expression, BinaryExpression):
+            left = self._register_need(expression.left_side)
+            right = self._register_need(expression.right_side)
+            need = left + 1 if left == right else max(left, right)
+        elif isinstance(expression, UnaryExpression):
+            need = self._register_need(expression.value)
+        elif isinstance(expression, IfExpression):
+            need = max(
+                self._register_need(expression.condition),
+                self._register_need(expression.consequent),
+                self._register_need(expression.alternative),
+            )
+        elif isinstance(expression, FunctionCallExpression):
+            need = max(
+                (
+                    self._register_need(argument.value)
+                    for argument in expression.argument_list.arguments
+                ),
+                default=1,
+            )
+        else:
+            need = 1
+        self._register_needs[expression] = need
+        return need
 
-        top_offset_from_top: int = param_count + REG_TOP
-        return_addr_offset_from_top: int = 1 + param_count
+    def _generate_setup(self) -> list[TMLine]:
+        param_count: int = self._get_parameter_count("main")
+        frame_start = self._caches_end
         code: list[TMLine] = [
-            LdcCommand(REG_TOP, 1),
-            StCommand(REG_TOP, top_offset_from_top, REG_TOP, "Store current top"),
+            Comment("Runtime setup"),
+            LdcCommand(
+                REG_TOP,
+                frame_start,
+                "Main's frame starts after DMEM[0]"
+                + (" and the caches" if frame_start > CACHES_START else ""),
+            ),
         ]
-        # Move all arguments down 1 slot in DMEM
-        for i in range(1, param_count + 1):
-            selected_reg = self._select_tmp_register()
+        # TM puts main's arguments in DMEM[1..n] in order, while frames keep them
+        # in reverse order after the return value
+        if param_count > 1:
+            code.append(Comment("Reverse main's arguments"))
+        for i in range(param_count // 2):
+            first, last = 1 + i, param_count - i
             code.extend(
                 [
-                    LdCommand(
-                        selected_reg,
-                        param_count - i,
-                        REG_TOP,
-                        f"Copy arg #{param_count - i}",
-                    ),
-                    StCommand(
-                        selected_reg,
-                        param_count - i + 1,
-                        REG_TOP,
-                        "Move to next position",
-                    ),
+                    LdCommand(1, first, REG_ZERO),
+                    LdCommand(2, last, REG_ZERO),
+                    StCommand(1, last, REG_ZERO),
+                    StCommand(2, first, REG_ZERO),
                 ],
             )
-        # testing purposes.
+        if param_count > 0:
+            code.append(Comment("Move main's arguments after the return value"))
+        for address in range(param_count, 0, -1):
+            code.extend(
+                [
+                    LdCommand(1, address, REG_ZERO),
+                    StCommand(1, address + frame_start, REG_ZERO),
+                ],
+            )
+        # The caches have to start out empty
+        cleared = range(CACHES_START, min(param_count + 1, frame_start))
+        if cleared:
+            code.append(Comment("Clear the caches where main's arguments were"))
+        code.extend(StCommand(REG_ZERO, address, REG_ZERO) for address in cleared)
         code.extend(
             [
-                LdaCommand(
-                    REG_STATUS,
-                    return_addr_offset_from_top,
-                    REG_TOP,
-                    "Update status",
-                ),
-                Comment(
-                    "Do some math to get correct return addr (uses top reg but restores it)",
-                ),
-                LdcCommand(REG_TOP, 3),
-                AddCommand(REG_TOP, REG_TOP, REG_PC),
-                StCommand(REG_TOP, 0, REG_STATUS, "Store the return address"),
-                LdaCommand(REG_TOP, 6, REG_STATUS, "Set the new top pointer"),
-                LdcCommand(7, main_location_imem, "Jump to main"),
-                # grab return value
+                *self._calling_sequence_calling_fn("main", param_count),
                 OutCommand(REG_RETURN_VALUE, "Printing main return value"),
-                # halt
                 HaltCommand(),
             ],
         )
@@ -121,90 +338,80 @@ class CodeGenerator:
     def _calling_sequence_calling_fn(
         self,
         function_name: str,
-        destination_addr: int,
-        params: list[MemoryLocation],
+        param_count: int,
     ) -> list[TMLine]:
-        param_count = self._get_parameter_count(function_name)
-        status_offset_from_top = param_count + 5
-        top_offset_from_top = status_offset_from_top + 1
+        # The arguments have already been stored after the top pointer, so this
+        # only has to fill in the rest of the new frame and jump to the function
         return_addr_offset_from_top = 1 + param_count
-        code: list[TMLine] = []
-
-        code.extend(
-            [
-                StCommand(
-                    REG_STATUS,
-                    status_offset_from_top,
-                    REG_TOP,
-                    "Store current status",
-                ),
-                StCommand(
-                    REG_TOP,
-                    top_offset_from_top,
-                    REG_TOP,
-                    "Store current top",
-                ),
-            ],
-        )
-
-        has_changed_status = False
-        for i, param in enumerate(reversed(params)):
-            param_offset_in_dmem = i + 1
-            if param.location == "register":
-                code.append(
-                    StCommand(
-                        param.position,
-                        param_offset_in_dmem,
-                        REG_TOP,
-                        "Load value from register into arg slot",
-                    ),
-                )
-            elif param.location == "dmem":
-                code.append(Comment("Load value from memory into arg slot"))
-                if has_changed_status:
-                    code.append(
-                        LdCommand(
-                            REG_STATUS,
-                            status_offset_from_top,
-                            REG_TOP,
-                        ),
-                    )
-                # Use reg status as in between variable, knowing it gets restored if
-                # it has been changed
-                code.append(LdCommand(REG_STATUS, param.position, REG_STATUS))
-                code.append(StCommand(REG_STATUS, param_offset_in_dmem, REG_TOP))
+        return [
+            StCommand(
+                REG_STATUS,
+                return_addr_offset_from_top + SAVED_STATUS_OFFSET,
+                REG_TOP,
+                "Store current status",
+            ),
+            StCommand(
+                REG_TOP,
+                return_addr_offset_from_top + SAVED_TOP_OFFSET,
+                REG_TOP,
+                "Store current top",
+            ),
+            LdaCommand(
+                REG_STATUS,
+                return_addr_offset_from_top,
+                REG_TOP,
+                "Update status",
+            ),
+            # The return address is the instruction after the jump, three
+            # instructions after this one
+            LdaCommand(REG_TOP, 3, REG_PC, "Compute the return address"),
+            StCommand(REG_TOP, 0, REG_STATUS, "Store return address"),
+            LdaCommand(
+                REG_TOP,
+                TEMPORARIES_OFFSET,
+                REG_STATUS,
+                "Set the new top pointer",
+            ),
+            LabelReference(
+                "LDC",
+                REG_PC,
+                function_label(function_name),
+                comment=f"Jump to {function_name}",
+            ),
+        ]
 
-        code.extend(
-            [
+    def _calling_sequence_called_fn(
+        self,
+        temporary_count: int,
+        saved_registers: list[int],
+    ) -> list[TMLine]:
+        code = self._store_gp_registers(saved_registers)
+        if temporary_count > 0:
+            code.append(
                 LdaCommand(
-                    REG_STATUS,
-                    return_addr_offset_from_top,
                     REG_TOP,
-                    "Update status",
-                ),
-                Comment(
-                    "Do some math to get correct return addr (uses top reg but restores it)",
+                    temporary_count,
+                    REG_TOP,
+                    "Make room for temporaries",
                 ),
-                LdcCommand(REG_TOP, 3),
-                AddCommand(REG_TOP, REG_TOP, REG_PC),
-                StCommand(REG_TOP, 0, REG_STATUS, "Store return address"),
-                LdaCommand(REG_TOP, 6, REG_STATUS, "Restore top reg to its real value"),
-                LdcCommand(7, destination_addr),
-            ],
-        )
+            )
         return code
 
-    def _calling_sequence_called_fn(self) -> list[TMLine]:
-        return [
-            *self._store_gp_registers(),
-        ]
-
-    def _return_sequence_called_fn(self, param_count: int) -> list[TMLine]:
+    def _return_sequence_called_fn(
+        self,
+        param_count: int,
+        saved_registers: list[int],
+    ) -> list[TMLine]:
         return_addr_offset_from_top = 1 + param_count
         return [
-            *self._restore_gp_registers(),
-            LdCommand(REG_TOP, 5, REG_STATUS, "Restore top pointer"),
-            LdCommand(REG_STATUS, 4, REG_STATUS, "Restore status pointer"),
+            *self._restore_gp_registers(saved_registers),
+            LdCommand(REG_TOP, SAVED_TOP_OFFSET, REG_STATUS, "Restore top pointer"),
+            LdCommand(
+                REG_STATUS,
+                SAVED_STATUS_OFFSET,
+                REG_STATUS,
+                "Restore status pointer",
+            ),
             LdCommand(
                 REG_PC,
                 return_addr_offset_from_top,
@@ -213,111 +420,808 @@ class CodeGenerator:
             ),
         ]
 
-    def _return_sequence_calling_fn(self) -> list[TMLine]:
-        return []
-
-    def _store_gp_registers(self) -> list[TMLine]:
+    def _store_gp_registers(self, saved_registers: list[int]) -> list[TMLine]:
         commands: list[TMLine] = []
-        for reg_num in range(1, 4):  # Just save the three "general purpose registers"
+        for reg_num in saved_registers:
             commands.append(StCommand(reg_num, reg_num, REG_STATUS))  # noqa: PERF401
         return commands
 
-    def _restore_gp_registers(self) -> list[TMLine]:
+    def _restore_gp_registers(self, saved_registers: list[int]) -> list[TMLine]:
         commands: list[TMLine] = []
-        for reg_num in range(1, 4):  # Just save the three "general purpose registers"
+        for reg_num in saved_registers:
             commands.append(LdCommand(reg_num, reg_num, REG_STATUS))  # noqa: PERF401
         return commands
 
-    def _generate_print_fn(self) -> list[TMLine]:
-        param_count = self._get_parameter_count("print")
-        selected_reg = self._select_tmp_register()
-        commands: list[TMLine] = [
-            Comment(""),
-            Comment("Function: print"),
-            Comment(""),
-            *self._calling_sequence_called_fn(),
-            LdCommand(selected_reg, -1, REG_STATUS, "Load argument"),
-            OutCommand(selected_reg, "Print value"),
-            Comment("Nothing to do with return value"),
-            *self._return_sequence_called_fn(param_count),
-        ]
-        return commands
+    def _generate_print_fn(self) -> GeneratedFunction:
+        selected_reg = GENERAL_PURPOSE_REGISTERS[0]
+        return GeneratedFunction(
+            "print",
+            self._get_parameter_count("print"),
+            0,
+            [
+                LdCommand(selected_reg, -1, REG_STATUS, "Load argument"),
+                OutCommand(selected_reg, "Print value"),
+                Comment("Nothing to do with return value"),
+            ],
+        )
 
     def _generate_function_call(
         self,
         function_name: str,
-        destination_addr: int,
-        params: list[MemoryLocation],
+        arguments: list[Expression],
+        registers: tuple[int, ...],
     ) -> list[TMLine]:
-        return [
+        # Leaves the function's return value in the return value register.
+        #
+        # The arguments are stored straight into the new frame (after the top
+        # pointer), except that evaluating an argument containing a call would
+        # overwrite the arguments stored before it. So arguments with calls are
+        # evaluated (and held) before the others are stored, along with the
+        # arguments before them that could print or fail.
+        param_count = len(arguments)
+        if param_count != self._get_parameter_count(function_name):
+            raise CodeGenerationError(
+                f"Wrong number of arguments passed to {function_name}",
+            )
+        # Registers before the given ones hold values the caller still needs
+        held = set(GENERAL_PURPOSE_REGISTERS) - set(registers)
+        callers = self._held_registers.setdefault(function_name, {})
+        callers.setdefault(self._function_name, set()).update(held)
+
+        order, held_count = held_first(arguments, contains_call)
+        code: list[TMLine] = [
             Comment(f"Calling {function_name}"),
-            *self._calling_sequence_calling_fn(
-                function_name,
-                destination_addr,
-                params,
+            *self._store_arguments(
+                arguments,
+                order,
+                held_count,
+                registers,
+                # The last argument is stored first after the top pointer
+                lambda idx: (param_count - idx, REG_TOP),
             ),
-            *self._return_sequence_calling_fn(),
-            Comment(f"Returning from {function_name}"),
         ]
+        code.extend(self._calling_sequence_calling_fn(function_name, param_count))
+        code.append(Comment(f"Returning from {function_name}"))
+        return code
+
+    def _store_arguments(
+        self,
+        arguments: list[Expression],
+        order: list[int],
+        held_count: int,
+        registers: tuple[int, ...],
+        destination: Callable[[int], tuple[int, int]],
+    ) -> list[TMLine]:
+        # Evaluates the arguments in the given order and stores each one at its
+        # destination (an offset and the register it is relative to). The first
+        # held_count arguments are kept in a register (or a temporary once
+        # registers run out) and only stored once every other argument has been
+        # stored.
+        def store(register: int, idx: int) -> TMCommand:
+            offset, base = destination(idx)
+            return StCommand(register, offset, base, f"Store argument {idx + 1}")
 
-    def _generate_function(self, definition: Definition) -> list[TMLine]:
-        main_param_count = self._get_parameter_count("main")
-        print_location_imem = 10 + 2 * main_param_count
         code: list[TMLine] = []
-        code.append(Comment(""))
-        code.append(Comment(f"Function: {definition.name.value}"))
-        code.append(Comment(""))
-        param_count = len(definition.parameters.parameters)
-        code.extend(self._calling_sequence_called_fn())
-        # This is likely the main section of code that will be re-written for next
-        # module. This only works in limited use case of any number of print calls
-        # with integer literal arguments and a return value
-        body: Body = definition.body
-        for print_expr in body.print_expressions:
-            selected_reg = self._select_tmp_register()
-            argument_code: list[TMLine] = self._generate_expression(
-                print_expr.argument_list.arguments[0].value,
-                selected_reg,
-            )
-            code.extend(argument_code)
+        held: dict[int, MemoryLocation] = {}
+        available = registers
+        for idx in order[: max(held_count, 0)]:
+            code.extend(self._generate_expression(arguments[idx], available))
+            if len(available) > 1:
+                held[idx] = MemoryLocation("register", available[0])
+                available = available[1:]
+            else:
+                temporary = self._allocate_temporary()
+                code.append(
+                    StCommand(
+                        available[0],
+                        temporary,
+                        REG_STATUS,
+                        f"Save argument {idx + 1} in a temporary",
+                    ),
+                )
+                held[idx] = MemoryLocation("dmem", temporary)
+        for idx in order[max(held_count, 0) :]:
+            code.extend(self._generate_expression(arguments[idx], available))
+            code.append(store(available[0], idx))
+        for idx, location in held.items():
+            if location.location == "register":
+                code.append(store(location.position, idx))
+            else:
+                code.extend(
+                    [
+                        LdCommand(REG_SCRATCH, location.position, REG_STATUS),
+                        store(REG_SCRATCH, idx),
+                    ],
+                )
+                self._release_temporary()
+        return code
 
+    def _generate_function(self, definition: Definition) -> GeneratedFunction:
+        function_name = definition.name.value
+        self._function_name = function_name
+        self._parameters = {
+            parameter.name.value: idx
+            for idx, parameter in enumerate(definition.parameters.parameters)
+        }
+        self._temporaries_in_use = 0
+        self._temporary_count = 0
+
+        body: list[TMLine] = [
+            Comment(f"Body of {function_name}"),
+            Label(body_label(function_name)),
+            *self._generate_body(definition),
+        ]
+        if function_name in self._cache_addresses:
+            # Tail calls jump past the lookup, since they return the same value
+            # as the call they replace. The value is cached under the arguments
+            # of the last one.
+            return_label = self._new_label("return from")
+            body = [
+                *self._generate_cache_lookup(return_label),
+                *body,
+                *self._generate_cache_store(),
+                Label(return_label),
+            ]
+        return GeneratedFunction(
+            function_name,
+            len(self._parameters),
+            self._temporary_count,
+            body,
+        )
+
+    def _generate_body(self, definition: Definition) -> list[TMLine]:
+        # The function's prints followed by its return value, left in the return
+        # value register
+        code: list[TMLine] = []
+        for print_expr in definition.body.print_expressions:
             code.extend(
                 self._generate_function_call(
                     "print",
-                    print_location_imem,
-                    [MemoryLocation("register", selected_reg)],
+                    [argument.value for argument in print_expr.argument_list.arguments],
+                    GENERAL_PURPOSE_REGISTERS,
                 ),
             )
-        code.extend(self._generate_expression(body.body, REG_RETURN_VALUE))
+        code.extend(self._generate_return_value(definition.body.body))
+        return code
+
+    def _generate_cache_entry(self) -> list[TMLine]:
+        # Leaves the offset of the entry for the current arguments within the
+        # function's cache in the first register: a hash of the arguments modulo
+        # the cache size, times the size of an entry. The hash is reduced after
+        # every argument so it doesn't overflow.
+        entry, value, quotient = GENERAL_PURPOSE_REGISTERS
+        code: list[TMLine] = [
+            Comment(f"Find the cache entry for the arguments of {self._function_name}"),
+        ]
+        if not self._parameters:
+            return [*code, LdcCommand(entry, 0)]
+        for idx in range(len(self._parameters)):
+            if idx == 0:
+                code.append(LdCommand(entry, -1, REG_STATUS))
+            else:
+                code.extend(
+                    [
+                        LdcCommand(value, HASH_MULTIPLIER),
+                        MulCommand(entry, entry, value),
+                        LdCommand(value, -1 - idx, REG_STATUS),
+                        AddCommand(entry, entry, value),
+                    ],
+                )
+            code.extend(
+                [
+                    LdcCommand(value, self._cache_size),
+                    DivCommand(quotient, entry, value),
+                    MulCommand(quotient, quotient, value),
+                    SubCommand(entry, entry, quotient),
+                ],
+            )
+        code.extend(
+            [
+                JgeCommand(entry, 1, REG_PC, "Skip making the remainder positive"),
+                AddCommand(entry, entry, value),
+                LdcCommand(value, len(self._parameters) + 2),
+                MulCommand(entry, entry, value),
+            ],
+        )
+        return code
+
+    def _generate_cache_lookup(self, return_label: str) -> list[TMLine]:
+        # Returns the cached value when the entry holds the current arguments
+        entry, value, argument = GENERAL_PURPOSE_REGISTERS
+        address = self._cache_addresses[self._function_name]
+        miss_label = self._new_label("cache miss")
+        code = [
+            *self._generate_cache_entry(),
+            LdCommand(value, address, entry, "Load whether the entry is used"),
+            LabelReference("JEQ", value, miss_label, REG_PC, "Unused entry"),
+        ]
+        for idx in range(len(self._parameters)):
+            code.extend(
+                [
+                    LdCommand(value, address + 1 + idx, entry),
+                    LdCommand(argument, -1 - idx, REG_STATUS),
+                    SubCommand(value, value, argument),
+                    LabelReference("JNE", value, miss_label, REG_PC, "Other arguments"),
+                ],
+            )
+        code.extend(
+            [
+                LdCommand(
+                    REG_RETURN_VALUE,
+                    address + 1 + len(self._parameters),
+                    entry,
+                    "Load the cached value",
+                ),
+                LabelReference("LDA", REG_PC, return_label, REG_PC, "Return it"),
+                Label(miss_label),
+            ],
+        )
+        return code
+
+    def _generate_cache_store(self) -> list[TMLine]:
+        # Overwrites the entry for the arguments with the return value, evicting
+        # whatever other arguments were cached in it
+        entry, value, _ = GENERAL_PURPOSE_REGISTERS
+        address = self._cache_addresses[self._function_name]
+        code = [
+            *self._generate_cache_entry(),
+            LdcCommand(value, 1),
+            StCommand(value, address, entry, "Mark the entry used"),
+        ]
+        for idx in range(len(self._parameters)):
+            code.extend(
+                [
+                    LdCommand(value, -1 - idx, REG_STATUS),
+                    StCommand(value, address + 1 + idx, entry),
+                ],
+            )
         code.append(
             StCommand(
                 REG_RETURN_VALUE,
-                -1 - len(definition.parameters.parameters),
-                REG_STATUS,
+                address + 1 + len(self._parameters),
+                entry,
+                "Cache the return value",
             ),
         )
-        code.extend(self._return_sequence_called_fn(param_count))
-
         return code
 
+    def _preserved_registers(self, names: list[str]) -> dict[str, set[int]]:
+        # The general purpose registers each function has to leave as they were:
+        # the ones its callers hold values in during the call, and the ones its
+        # callers have to leave as they were (which they may not save themselves
+        # when they don't write them)
+        preserved: dict[str, set[int]] = {name: set() for name in names}
+        changed = True
+        while changed:
+            changed = False
+            for name, callers in self._held_registers.items():
+                for caller, held in callers.items():
+                    required = held | preserved.get(caller, set())
+                    if not required <= preserved[name]:
+                        preserved[name] |= required
+                        changed = True
+        return preserved
+
+    def _complete_function(
+        self,
+        function: GeneratedFunction,
+        saved_registers: list[int],
+    ) -> list[TMLine]:
+        return [
+            Comment(""),
+            Comment(f"{FUNCTION_MARKER}{function.name}"),
+            Comment(""),
+            Label(function_label(function.name)),
+            *self._calling_sequence_called_fn(
+                function.temporary_count,
+                saved_registers,
+            ),
+            *function.body,
+            *self._return_sequence_called_fn(function.param_count, saved_registers),
+        ]
+
+    def _generate_return_value(self, expression: Expression) -> list[TMLine]:
+        # Calls already leave their value in the return value register, so calls
+        # that are returned (including from either branch of an if) skip moving
+        # the value through another register
+        if isinstance(expression, FunctionCallExpression):
+            arguments = [
+                argument.value for argument in expression.argument_list.arguments
+            ]
+            if (
+                self._tail_calls
+                and expression.function_name.value == self._function_name
+            ):
+                return self._generate_tail_call(arguments)
+            return self._generate_function_call(
+                expression.function_name.value,
+                arguments,
+                GENERAL_PURPOSE_REGISTERS,
+            )
+        if isinstance(expression, IfExpression):
+            return self._generate_if(
+                expression,
+                GENERAL_PURPOSE_REGISTERS,
+                self._generate_return_value(expression.consequent),
+                self._generate_return_value(expression.alternative),
+            )
+        target = GENERAL_PURPOSE_REGISTERS[0]
+        return [
+            *self._generate_expression(expression, GENERAL_PURPOSE_REGISTERS),
+            LdaCommand(REG_RETURN_VALUE, 0, target, "Move return value"),
+        ]
+
+    def _generate_tail_call(self, arguments: list[Expression]) -> list[TMLine]:
+        # A function returning the value of a call to itself can reuse its frame
+        # instead of building a new one: the new arguments overwrite the current
+        # ones and the body starts over, so the original caller is returned to
+        # directly and recursion doesn't use any more DMEM.
+        #
+        # Every argument that reads a parameter is evaluated before any parameter
+        # is overwritten (along with the arguments before it that could print or
+        # fail). Parameters passed along unchanged aren't stored at all.
+        changed = [
+            idx
+            for idx, argument in enumerate(arguments)
+            if not (
+                isinstance(argument, Identifier)
+                and self._parameters.get(argument.value) == idx
+            )
+        ]
+        order, held_count = held_first(
+            [arguments[idx] for idx in changed],
+            reads_parameters,
+        )
+        return [
+            Comment(f"Tail call to {self._function_name}"),
+            *self._store_arguments(
+                arguments,
+                [changed[idx] for idx in order],
+                held_count,
+                GENERAL_PURPOSE_REGISTERS,
+                lambda idx: (-1 - idx, REG_STATUS),
+            ),
+            LabelReference(
+                "LDC",
+                REG_PC,
+                body_label(self._function_name),
+                comment=f"Jump to the body of {self._function_name}",
+            ),
+        ]
+
+    def _generate_if(
+        self,
+        expression: IfExpression,
+        registers: tuple[int, ...],
+        consequent: list[TMLine],
+        alternative: list[TMLine],
+    ) -> list[TMLine]:
+        else_label = self._new_label("else")
+        end_label = self._new_label("end if")
+        if self._condition_jumps:
+            condition = self._generate_branch(
+                expression.condition,
+                registers,
+                else_label,
+                jump_if=False,
+            )
+        else:
+            condition = [
+                *self._generate_expression(expression.condition, registers),
+                LabelReference(
+                    "JEQ",
+                    registers[0],
+                    else_label,
+                    REG_PC,
+                    "Jump to else branch",
+                ),
+            ]
+        return [
+            *condition,
+            *consequent,
+            LabelReference("LDA", REG_PC, end_label, REG_PC, "Skip else branch"),
+            Label(else_label),
+            *alternative,
+            Label(end_label),
+        ]
+
+    def _generate_branch(
+        self,
+        expression: Expression,
+        registers: tuple[int, ...],
+        label: str,
+        *,
+        jump_if: bool,
+    ) -> list[TMLine]:
+        # Jumps to the label when the boolean expression is jump_if and falls
+        # through otherwise. Comparisons jump on the difference of their sides,
+        # and and/or jump as soon as one side decides the result, so no boolean
+        # value is computed along the way. Only the given registers and the
+        # scratch register are overwritten.
+        target = registers[0]
+        if isinstance(expression, BooleanLiteral):
+            if (expression.value == "true") != jump_if:
+                return []
+            return [LabelReference("LDA", REG_PC, label, REG_PC, "Jump")]
+        if isinstance(expression, NotExpression):
+            return self._generate_branch(
+                expression.value,
+                registers,
+                label,
+                jump_if=not jump_if,
+            )
+        if isinstance(expression, (AndExpression, OrExpression)):
+            # An and is decided by a false side, an or by a true one
+            decided_by = isinstance(expression, OrExpression)
+            if jump_if == decided_by:
+                return [
+                    *self._generate_branch(
+                        expression.left_side,
+                        registers,
+                        label,
+                        jump_if=jump_if,
+                    ),
+                    *self._generate_branch(
+                        expression.right_side,
+                        registers,
+                        label,
+                        jump_if=jump_if,
+                    ),
+                ]
+            decided_label = self._new_label("short circuit")
+            return [
+                *self._generate_branch(
+                    expression.left_side,
+                    registers,
+                    decided_label,
+                    jump_if=decided_by,
+                ),
+                *self._generate_branch(
+                    expression.right_side,
+                    registers,
+                    label,
+                    jump_if=jump_if,
+                ),
+                Label(decided_label),
+            ]
+        if isinstance(expression, (LessThanExpression, EqualsExpression)):
+            return self._generate_comparison_branch(
+                expression,
+                registers,
+                label,
+                jump_if=jump_if,
+            )
+        return [
+            *self._generate_expression(expression, registers),
+            LabelReference(
+                "JNE" if jump_if else "JEQ",
+                target,
+                label,
+                REG_PC,
+                f"Jump if {str(jump_if).lower()}",
+            ),
+        ]
+
+    def _generate_comparison_branch(
+        self,
+        expression: LessThanExpression | EqualsExpression,
+        registers: tuple[int, ...],
+        label: str,
+        *,
+        jump_if: bool,
+    ) -> list[TMLine]:
+        # The jump commands testing a difference (or a value compared with 0)
+        # for the comparison being true and false
+        target = registers[0]
+        less_than = isinstance(expression, LessThanExpression)
+        jumps = ("JLT", "JGE") if less_than else ("JEQ", "JNE")
+        left, right = expression.left_side, expression.right_side
+        if is_zero(right):
+            code = self._generate_expression(left, registers)
+        elif is_zero(left):
+            # 0 < x is x > 0
+            jumps = ("JGT", "JLE") if less_than else jumps
+            code = self._generate_expression(right, registers)
+        else:
+            code = self._generate_binary_expression(
+                expression,
+                registers,
+                lambda destination, left, right: [
+                    SubCommand(destination, left, right),
+                ],
+            )
+        return [
+            *code,
+            LabelReference(
+                jumps[0] if jump_if else jumps[1],
+                target,
+                label,
+                REG_PC,
+                f"Jump if {str(jump_if).lower()}",
+            ),
+        ]
+
+    def _generate_boolean(
+        self,
+        expression: Expression,
+        registers: tuple[int, ...],
+    ) -> list[TMLine]:
+        # Evaluates a boolean expression into the first register by branching on
+        # it
+        true_label = self._new_label("true")
+        end_label = self._new_label("end boolean")
+        return [
+            *self._generate_branch(expression, registers, true_label, jump_if=True),
+            LdcCommand(registers[0], 0, "False"),
+            LabelReference("LDA", REG_PC, end_label, REG_PC, "Skip true"),
+            Label(true_label),
+            LdcCommand(registers[0], 1, "True"),
+            Label(end_label),
+        ]
+
     def _generate_expression(
         self,
         expression: Expression,
-        into_reg: int,
+        registers: tuple[int, ...],
     ) -> list[TMLine]:
+        # Evaluates the expression into the first of the given registers. Only the
+        # given registers and the scratch register are overwritten.
+        target = registers[0]
         if isinstance(expression, IntegerLiteral):
-            return [LdcCommand(into_reg, int(expression.value))]
+            return [LdcCommand(target, int(expression.value))]
+        if isinstance(expression, BooleanLiteral):
+            return [LdcCommand(target, 1 if expression.value == "true" else 0)]
+        if isinstance(expression, Identifier):
+            if expression.value not in self._parameters:
+                raise CodeGenerationError(f"Unknown identifier {expression.value}")
+            return [
+                LdCommand(
+                    target,
+                    -1 - self._parameters[expression.value],
+                    REG_STATUS,
+                    f"Load {expression.value}",
+                ),
+            ]
+        if isinstance(expression, UnaryMinusExpression):
+            if isinstance(expression.value, IntegerLiteral):
+                return [LdcCommand(target, -int(expression.value.value))]
+            return [
+                *self._generate_expression(expression.value, registers),
+                SubCommand(target, REG_ZERO, target),
+            ]
+        if isinstance(expression, NotExpression):
+            if self._condition_jumps and is_comparison(expression.value):
+                # Jumping on the opposite of the comparison is cheaper than
+                # computing the comparison and flipping it
+                return self._generate_boolean(expression, registers)
+            return [
+                *self._generate_expression(expression.value, registers),
+                LdcCommand(REG_SCRATCH, 1),
+                SubCommand(target, REG_SCRATCH, target),
+            ]
+        if isinstance(expression, (AndExpression, OrExpression)):
+            return self._generate_short_circuit(expression, registers)
+        if isinstance(expression, BinaryExpression):
+            return self._generate_binary_expression(expression, registers)
+        if isinstance(expression, IfExpression):
+            return self._generate_if(
+                expression,
+                registers,
+                self._generate_expression(expression.consequent, registers),
+                self._generate_expression(expression.alternative, registers),
+            )
+        if isinstance(expression, FunctionCallExpression):
+            return [
+                *self._generate_function_call(
+                    expression.function_name.value,
+                    [argument.value for argument in expression.argument_list.arguments],
+                    registers,
+                ),
+                LdaCommand(target, 0, REG_RETURN_VALUE, "Move return value"),
+            ]
         raise CodeGenerationError(
             f"Generating code for expression of type {expression.__class__.__name__} is not yet implemented",
         )
 
-    def generate(self):
-        self._code: list[TMLine] = [
-            *self._generate_setup(),
-            *self._generate_print_fn(),
+    def _generate_short_circuit(
+        self,
+        expression: AndExpression | OrExpression,
+        registers: tuple[int, ...],
+    ) -> list[TMLine]:
+        # The right side is only evaluated when the left side doesn't already
+        # decide the result, which recursive functions rely on to terminate
+        target = registers[0]
+        end_label = self._new_label("short circuit")
+        if self._condition_jumps and is_condition(expression.left_side):
+            # A left side that would have to be turned into a value is jumped
+            # on instead, and the value it decides the result with is loaded
+            # only when it does
+            decided_by = isinstance(expression, OrExpression)
+            decided_label = self._new_label("short circuit")
+            return [
+                *self._generate_branch(
+                    expression.left_side,
+                    registers,
+                    decided_label,
+                    jump_if=decided_by,
+                ),
+                *self._generate_expression(expression.right_side, registers),
+                LabelReference("LDA", REG_PC, end_label, REG_PC, "Skip result"),
+                Label(decided_label),
+                LdcCommand(target, int(decided_by), str(decided_by)),
+                Label(end_label),
+            ]
+        jump = "JEQ" if isinstance(expression, AndExpression) else "JNE"
+        return [
+            *self._generate_expression(expression.left_side, registers),
+            LabelReference(jump, target, end_label, REG_PC, "Short circuit"),
+            *self._generate_expression(expression.right_side, registers),
+            Label(end_label),
+        ]
+
+    def _generate_binary_expression(
+        self,
+        expression: BinaryExpression,
+        registers: tuple[int, ...],
+        combine: Callable[[int, int, int], list[TMLine]] | None = None,
+    ) -> list[TMLine]:
+        # Evaluates both sides and combines them (by default into the expression's
+        # value) with combine(destination, left, right)
+        if combine is None:
+            combine = partial(self._combine, expression)
+        left, right = expression.left_side, expression.right_side
+        target = registers[0]
+        if len(registers) > 1:
+            # The side needing more registers is evaluated first, so the other
+            # side can be evaluated with one register fewer. The right side only
+            # goes first when that can't change what is printed or where the
+            # program fails, that is unless both sides could print or fail.
+            if self._register_need(left) >= self._register_need(right) or not (
+                is_discardable(left) or is_discardable(right)
+            ):
+                return [
+                    *self._generate_expression(left, registers),
+                    *self._generate_expression(right, registers[1:]),
+                    *combine(target, target, registers[1]),
+                ]
+            return [
+                *self._generate_expression(right, registers),
+                *self._generate_expression(left, registers[1:]),
+                *combine(target, registers[1], target),
+            ]
+        # Out of registers, but a literal or parameter can be loaded straight into
+        # the scratch register without spilling the other side
+        if is_leaf(right):
+            return [
+                *self._generate_expression(left, registers),
+                *self._generate_expression(right, (REG_SCRATCH,)),
+                *combine(target, target, REG_SCRATCH),
+            ]
+        if is_leaf(left):
+            return [
+                *self._generate_expression(right, registers),
+                *self._generate_expression(left, (REG_SCRATCH,)),
+                *combine(target, REG_SCRATCH, target),
+            ]
+        temporary = self._allocate_temporary()
+        code = [
+            *self._generate_expression(left, registers),
+            StCommand(target, temporary, REG_STATUS, "Spill left side"),
+            *self._generate_expression(right, registers),
+            LdCommand(REG_SCRATCH, temporary, REG_STATUS, "Reload left side"),
+            *combine(target, REG_SCRATCH, target),
         ]
-        for definition in self._ast.definition_list:
-            self._code.extend(self._generate_function(definition))
+        self._release_temporary()
+        return code
+
+    def _combine(
+        self,
+        expression: BinaryExpression,
+        destination: int,
+        left: int,
+        right: int,
+    ) -> list[TMLine]:
+        # Booleans are represented as 0 (false) and 1 (true)
+        if type(expression) in ARITHMETIC_COMMANDS:
+            return [ARITHMETIC_COMMANDS[type(expression)](destination, left, right)]
+        if isinstance(expression, (LessThanExpression, EqualsExpression)):
+            jump = (
+                JltCommand if isinstance(expression, LessThanExpression) else JeqCommand
+            )
+            return [
+                SubCommand(destination, left, right),
+                jump(destination, 2, REG_PC),
+                LdcCommand(destination, 0, "False"),
+                LdaCommand(REG_PC, 1, REG_PC),
+                LdcCommand(destination, 1, "True"),
+            ]
+        raise CodeGenerationError(
+            f"Generating code for expression of type {expression.__class__.__name__} is not yet implemented",
+        )
+
+    def _allocate_caches(self, definitions: list[Definition]):
+        self._cache_addresses = {}
+        self._caches_end = CACHES_START
+        for definition in definitions:
+            name = definition.name.value
+            if name not in self._memoized_functions:
+                continue
+            if self._cache_size < 1:
+                raise CodeGenerationError(
+                    f"Cache size has to be at least 1, not {self._cache_size}",
+                )
+            self._cache_addresses[name] = self._caches_end
+            self._caches_end += self._cache_size * (self._get_parameter_count(name) + 2)
+
+    def _check_caches_fit(self, main: GeneratedFunction):
+        # Main's frame has to fit in DMEM after the caches. Its return address
+        # follows the return value cell and the arguments, and top ends up past
+        # the frame's header and temporaries.
+        if not self._cache_addresses:
+            return
+        return_address = self._caches_end + main.param_count + 1
+        frame_end = return_address + TEMPORARIES_OFFSET + main.temporary_count
+        if frame_end > DMEM_SIZE:
+            raise CodeGenerationError(
+                f"Caches of {self._cache_size} results take up DMEM up to address "
+                + f"{self._caches_end - 1}, leaving no room for main's frame in "
+                + f"the {DMEM_SIZE} cells of DMEM",
+            )
+
+    def _generate_program(self) -> list[TMLine]:
+        # A function only saves the general purpose registers it writes that have
+        # to be left as they were, which is only known once every call to it has
+        # been generated
+        self._held_registers = {}
+        definitions = list(self._ast.definition_list)
+        functions: list[GeneratedFunction] = []
+        if self._dead_function_elimination:
+            # Functions main never ends up calling are left out entirely
+            reachable = reachable_functions(self._ast)
+            definitions = [
+                definition
+                for definition in definitions
+                if definition.name.value in reachable
+            ]
+            if "print" in reachable:
+                functions.append(self._generate_print_fn())
+        else:
+            functions.append(self._generate_print_fn())
+        self._allocate_caches(definitions)
+        functions.extend(
+            self._generate_function(definition) for definition in definitions
+        )
+        self._check_caches_fit(
+            next(function for function in functions if function.name == "main"),
+        )
+        preserved = self._preserved_registers([function.name for function in functions])
+        code = self._generate_setup()
+        for function in functions:
+            if self._live_register_saves:
+                saved = sorted(
+                    written_registers(function.body) & preserved[function.name],
+                )
+            else:
+                saved = list(GENERAL_PURPOSE_REGISTERS)
+            code.extend(self._complete_function(function, saved))
+        return code
+
+    def generate(self):
+        # Jumps and calls refer to labels, which are turned into addresses once the
+        # whole program has been generated
+        self._label_count = 0
+        code = resolve_labels(self._generate_program())
+        if self._peephole:
+            code = optimize(code)
+        self._emitter = TMEmitter()
+        self._emitter.extend(code)
+
+    @property
+    def lines(self) -> list[TMLine]:
+        return self._emitter.lines
+
+    def render(self) -> str:
+        return self._emitter.render()
 
-        for line in self._code:
-            line.print()
+    def write(self, file: TextIO):
+        self._emitter.write(file)
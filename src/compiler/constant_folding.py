@@ -0,0 +1,234 @@
+from collections.abc import Callable
+
+from compiler.ast_nodes import (
+    AndExpression,
+    BinaryExpression,
+    BooleanAnnotation,
+    BooleanLiteral,
+    DivideExpression,
+    EqualsExpression,
+    Expression,
+    FunctionCallExpression,
+    IfExpression,
+    IntegerAnnotation,
+    IntegerLiteral,
+    LessThanExpression,
+    MinusExpression,
+    NotExpression,
+    OrExpression,
+    PlusExpression,
+    Program,
+    TimesExpression,
+    UnaryExpression,
+    UnaryMinusExpression,
+)
+
+# Klein integers are 32 bit words on the TM machine. Operations whose result
+# doesn't fit are left for the machine to evaluate.
+MIN_WORD = -(2**31)
+MAX_WORD = 2**31 - 1
+
+
+def truncating_divide(dividend: int, divisor: int) -> int:
+    # Division truncates towards zero on the TM machine
+    quotient = abs(dividend) // abs(divisor)
+    return -quotient if (dividend < 0) != (divisor < 0) else quotient
+
+
+INTEGER_OPERATIONS: dict[type[BinaryExpression], Callable[[int, int], int | bool]] = {
+    PlusExpression: lambda left, right: left + right,
+    MinusExpression: lambda left, right: left - right,
+    TimesExpression: lambda left, right: left * right,
+    DivideExpression: truncating_divide,
+    LessThanExpression: lambda left, right: left < right,
+    EqualsExpression: lambda left, right: left == right,
+}
+
+
+def integer_value(expression: Expression) -> int | None:
+    # Negative constants are represented as the negation of a literal
+    if isinstance(expression, IntegerLiteral):
+        return int(expression.value)
+    if isinstance(expression, UnaryMinusExpression) and isinstance(
+        expression.value,
+        IntegerLiteral,
+    ):
+        return -int(expression.value.value)
+    return None
+
+
+def boolean_value(expression: Expression) -> bool | None:
+    if isinstance(expression, BooleanLiteral):
+        return expression.value == "true"
+    return None
+
+
+def make_integer(value: int) -> Expression:
+    literal = IntegerLiteral(str(abs(value)))
+    literal.add_annotation(IntegerAnnotation())
+    if value >= 0:
+        return literal
+    negation = UnaryMinusExpression(literal)
+    negation.add_annotation(IntegerAnnotation())
+    return negation
+
+
+def make_boolean(value: bool) -> BooleanLiteral:  # noqa: FBT001
+    literal = BooleanLiteral("true" if value else "false")
+    literal.add_annotation(BooleanAnnotation())
+    return literal
+
+
+def make_not(expression: Expression) -> NotExpression:
+    negation = NotExpression(expression)
+    negation.add_annotation(BooleanAnnotation())
+    return negation
+
+
+def is_discardable(expression: Expression) -> bool:
+    # Whether leaving the expression out of the program can't change what the
+    # program does. Calls can print or never return and division can fail.
+    if isinstance(expression, (FunctionCallExpression, DivideExpression)):
+        return False
+    if isinstance(expression, BinaryExpression):
+        return is_discardable(expression.left_side) and is_discardable(
+            expression.right_side,
+        )
+    if isinstance(expression, UnaryExpression):
+        return is_discardable(expression.value)
+    if isinstance(expression, IfExpression):
+        return (
+            is_discardable(expression.condition)
+            and is_discardable(expression.consequent)
+            and is_discardable(expression.alternative)
+        )
+    return True
+
+
+def fold_constants(program: Program) -> Program:
+    # Replaces the constant parts of every function body with their value and
+    # simplifies operations whose result doesn't depend on one of their operands.
+    # The ast is updated in place and returned.
+    for definition in program.definition_list:
+        body = definition.body
+        for print_expression in body.print_expressions:
+            _ = fold_expression(print_expression)
+        body.body = fold_expression(body.body)
+    return program
+
+
+def fold_expression(expression: Expression) -> Expression:
+    if isinstance(expression, FunctionCallExpression):
+        for argument in expression.argument_list.arguments:
+            argument.value = fold_expression(argument.value)
+        return expression
+    if isinstance(expression, UnaryMinusExpression):
+        expression.value = fold_expression(expression.value)
+        value = integer_value(expression.value)
+        if value is not None and MIN_WORD <= -value <= MAX_WORD:
+            return make_integer(-value)
+        if isinstance(expression.value, UnaryMinusExpression):
+            return expression.value.value
+        return expression
+    if isinstance(expression, NotExpression):
+        expression.value = fold_expression(expression.value)
+        value = boolean_value(expression.value)
+        if value is not None:
+            return make_boolean(not value)
+        if isinstance(expression.value, NotExpression):
+            return expression.value.value
+        return expression
+    if isinstance(expression, IfExpression):
+        return fold_if(expression)
+    if isinstance(expression, (AndExpression, OrExpression)):
+        return fold_logical(expression)
+    if isinstance(expression, BinaryExpression):
+        return fold_binary(expression)
+    return expression
+
+
+def fold_if(expression: IfExpression) -> Expression:
+    expression.condition = fold_expression(expression.condition)
+    condition = boolean_value(expression.condition)
+    if condition is not None:
+        return fold_expression(
+            expression.consequent if condition else expression.alternative,
+        )
+    expression.consequent = fold_expression(expression.consequent)
+    expression.alternative = fold_expression(expression.alternative)
+    consequent = boolean_value(expression.consequent)
+    alternative = boolean_value(expression.alternative)
+    if consequent is True and alternative is False:
+        return expression.condition
+    if consequent is False and alternative is True:
+        return make_not(expression.condition)
+    return expression
+
+
+def fold_logical(expression: AndExpression | OrExpression) -> Expression:
+    # Only the left side decides whether the right side is evaluated, so a
+    # constant left side removes the operation entirely, while a constant right
+    # side can only be dropped together with the operation
+    expression.left_side = fold_expression(expression.left_side)
+    expression.right_side = fold_expression(expression.right_side)
+    # The value that decides the result without looking at the other side
+    deciding = isinstance(expression, OrExpression)
+    left = boolean_value(expression.left_side)
+    if left is not None:
+        return make_boolean(deciding) if left == deciding else expression.right_side
+    right = boolean_value(expression.right_side)
+    if right is None:
+        return expression
+    if right != deciding:
+        return expression.left_side
+    if is_discardable(expression.left_side):
+        return make_boolean(deciding)
+    return expression
+
+
+def fold_binary(expression: BinaryExpression) -> Expression:  # noqa: PLR0912
+    expression.left_side = fold_expression(expression.left_side)
+    expression.right_side = fold_expression(expression.right_side)
+    left, right = expression.left_side, expression.right_side
+
+    if isinstance(expression, EqualsExpression):
+        left_boolean, right_boolean = boolean_value(left), boolean_value(right)
+        if left_boolean is not None and right_boolean is not None:
+            return make_boolean(left_boolean == right_boolean)
+
+    left_value, right_value = integer_value(left), integer_value(right)
+    if left_value is not None and right_value is not None:
+        # Division by zero is left to fail at runtime
+        if isinstance(expression, DivideExpression) and right_value == 0:
+            return expression
+        result = INTEGER_OPERATIONS[type(expression)](left_value, right_value)
+        if isinstance(result, bool):
+            return make_boolean(result)
+        if MIN_WORD <= result <= MAX_WORD:
+            return make_integer(result)
+        return expression
+
+    if isinstance(expression, PlusExpression):
+        if left_value == 0:
+            return right
+        if right_value == 0:
+            return left
+    elif isinstance(expression, MinusExpression):
+        if right_value == 0:
+            return left
+        if left_value == 0:
+            negation = UnaryMinusExpression(right)
+            negation.add_annotation(IntegerAnnotation())
+            return fold_expression(negation)
+    elif isinstance(expression, TimesExpression):
+        if left_value == 1:
+            return right
+        if right_value == 1:
+            return left
+        if (left_value == 0 and is_discardable(right)) or (
+            right_value == 0 and is_discardable(left)
+        ):
+            return make_integer(0)
+    elif isinstance(expression, DivideExpression) and right_value == 1:
+        return left
+    return expression
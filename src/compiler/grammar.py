@@ -0,0 +1,338 @@
+import os
+import re
+from enum import StrEnum, auto
+
+from typing_extensions import override
+
+from compiler.ast_nodes import SemanticAction
+from compiler.klein_errors import GrammarError
+from compiler.scanner import KEYWORDS, SINGLE_CHARACTER_TOKENS
+from compiler.tokens import TokenType
+
+
+class NonTerminal(StrEnum):
+    PROGRAM = auto()
+    DEFINITION_LIST = auto()
+    DEFINITION = auto()
+    PARAMETER_LIST = auto()
+    FORMAL_PARAMETERS = auto()
+    FORMAL_PARAMETERS_REST = auto()
+    ID_WITH_TYPE = auto()
+    TYPE = auto()
+    BODY = auto()
+    PRINT_EXPRESSION = auto()
+    EXPRESSION = auto()
+    EXPRESSION_REST = auto()
+    SIMPLE_EXPRESSION = auto()
+    SIMPLE_EXPRESSION_REST = auto()
+    TERM = auto()
+    TERM_REST = auto()
+    FACTOR = auto()
+    FACTOR_REST = auto()
+    ARGUMENT_LIST = auto()
+    FORMAL_ARGUMENTS = auto()
+    FORMAL_ARGUMENTS_REST = auto()
+    LITERAL = auto()
+
+    @override
+    def __str__(self):
+        return self.name.upper()
+
+
+# Terminals that the grammar writes like nonterminals
+NAMED_TERMINALS: dict[str, TokenType] = {
+    "IDENTIFIER": TokenType.IDENTIFIER,
+    "INTEGER-LITERAL": TokenType.INTEGER,
+    "BOOLEAN-LITERAL": TokenType.BOOLEAN,
+}
+QUOTED_TERMINALS: dict[str, TokenType] = KEYWORDS | SINGLE_CHARACTER_TOKENS
+TERMINAL_ORDER: dict[TokenType, int] = {
+    terminal: idx for idx, terminal in enumerate(TokenType)
+}
+
+GRAMMAR_PATTERN = re.compile(
+    r"""
+    (?P<head><[A-Z-]+>)\s*::=
+    | (?P<symbol><[A-Z-]+>)
+    | "(?P<quoted>[^"]*)"
+    | (?P<epsilon>ε)
+    | (?P<alternative>\|)
+    | (?P<whitespace>\s+)
+    | (?P<illegal>.)
+    """,
+    re.VERBOSE,
+)
+
+
+class Grammar:
+    # An LL(1) grammar where each nonterminal maps to its alternatives. Semantic
+    # actions can appear anywhere in an alternative, but never take part in
+    # FIRST/FOLLOW sets.
+    def __init__(
+        self,
+        productions: dict[
+            NonTerminal,
+            list[list[NonTerminal | TokenType | SemanticAction]],
+        ],
+    ):
+        if len(productions) == 0:
+            raise GrammarError("The grammar does not contain any rules")
+        self.productions: dict[
+            NonTerminal,
+            list[list[NonTerminal | TokenType | SemanticAction]],
+        ] = productions
+        self.start: NonTerminal = next(iter(productions))
+        self._check_defined()
+        self.nullable: set[NonTerminal] = set()
+        self.first: dict[NonTerminal, set[TokenType]] = {
+            nonterminal: set() for nonterminal in productions
+        }
+        self.follow: dict[NonTerminal, set[TokenType]] = {
+            nonterminal: set() for nonterminal in productions
+        }
+        # Conflicts build_parse_table resolved in favor of the alternative that
+        # consumes the terminal
+        self.resolved_conflicts: list[str] = []
+        self._compute_first_sets()
+        self._compute_follow_sets()
+
+    def _check_defined(self):
+        for nonterminal, alternatives in self.productions.items():
+            for alternative in alternatives:
+                for symbol in alternative:
+                    if (
+                        isinstance(symbol, NonTerminal)
+                        and symbol not in self.productions
+                    ):
+                        raise GrammarError(
+                            f"{symbol} is used by {nonterminal} but never defined",
+                        )
+
+    def first_of(
+        self,
+        symbols: list[NonTerminal | TokenType | SemanticAction],
+    ) -> tuple[set[TokenType], bool]:
+        # Returns the FIRST set of a sequence of symbols, and whether the whole
+        # sequence can derive the empty string
+        first: set[TokenType] = set()
+        for symbol in symbols:
+            if isinstance(symbol, SemanticAction):
+                continue
+            if isinstance(symbol, TokenType):
+                first.add(symbol)
+                return first, False
+            first |= self.first[symbol]
+            if symbol not in self.nullable:
+                return first, False
+        return first, True
+
+    def _compute_first_sets(self):
+        changed = True
+        while changed:
+            changed = False
+            for nonterminal, alternatives in self.productions.items():
+                for alternative in alternatives:
+                    first, nullable = self.first_of(alternative)
+                    if not first <= self.first[nonterminal]:
+                        self.first[nonterminal] |= first
+                        changed = True
+                    if nullable and nonterminal not in self.nullable:
+                        self.nullable.add(nonterminal)
+                        changed = True
+
+    def _compute_follow_sets(self):
+        self.follow[self.start].add(TokenType.END_OF_FILE)
+        changed = True
+        while changed:
+            changed = False
+            for nonterminal, alternatives in self.productions.items():
+                for alternative in alternatives:
+                    for idx, symbol in enumerate(alternative):
+                        if not isinstance(symbol, NonTerminal):
+                            continue
+                        follow, nullable = self.first_of(alternative[idx + 1 :])
+                        if nullable:
+                            follow |= self.follow[nonterminal]
+                        if not follow <= self.follow[symbol]:
+                            self.follow[symbol] |= follow
+                            changed = True
+
+    def build_parse_table(
+        self,
+    ) -> dict[
+        tuple[NonTerminal, TokenType],
+        list[NonTerminal | TokenType | SemanticAction],
+    ]:
+        # Alternatives are predicted by their FIRST set, and nullable alternatives
+        # are additionally predicted by the FOLLOW set of their nonterminal. When
+        # both predict the same terminal, the alternative that consumes it wins.
+        # This is how the grammar resolves trailing operators after an if
+        # expression (e.g. `if a then b else c + d` adds d to c), the same way
+        # dangling elses are usually resolved. Any other conflict is an error.
+        parse_table: dict[
+            tuple[NonTerminal, TokenType],
+            list[NonTerminal | TokenType | SemanticAction],
+        ] = {}
+        predicted_by_follow: set[tuple[NonTerminal, TokenType]] = set()
+        conflicts: list[str] = []
+        self.resolved_conflicts.clear()
+
+        def predict(
+            nonterminal: NonTerminal,
+            terminals: set[TokenType],
+            alternative: list[NonTerminal | TokenType | SemanticAction],
+            *,
+            by_follow: bool,
+        ):
+            # Sorted so the table (and any conflicts) come out the same every run
+            for terminal in sorted(terminals, key=TERMINAL_ORDER.__getitem__):
+                key = (nonterminal, terminal)
+                if key not in parse_table:
+                    parse_table[key] = alternative
+                    if by_follow:
+                        predicted_by_follow.add(key)
+                    continue
+                message = (
+                    f"{nonterminal} on {terminal} could be "
+                    f"{format_rule(parse_table[key])} or {format_rule(alternative)}"
+                )
+                if by_follow and key not in predicted_by_follow:
+                    self.resolved_conflicts.append(message)
+                else:
+                    conflicts.append(message)
+
+        nullable_alternatives: list[
+            tuple[NonTerminal, list[NonTerminal | TokenType | SemanticAction]]
+        ] = []
+        for nonterminal, alternatives in self.productions.items():
+            for alternative in alternatives:
+                first, nullable = self.first_of(alternative)
+                predict(nonterminal, first, alternative, by_follow=False)
+                if nullable:
+                    nullable_alternatives.append((nonterminal, alternative))
+        for nonterminal, alternative in nullable_alternatives:
+            predict(nonterminal, self.follow[nonterminal], alternative, by_follow=True)
+
+        if len(conflicts) > 0:
+            raise GrammarError(
+                "The grammar is not LL(1):\n" + "\n".join(conflicts),
+            )
+        return parse_table
+
+
+def format_rule(rule: list[NonTerminal | TokenType | SemanticAction]) -> str:
+    if len(rule) == 0:
+        return "ε"
+    return " ".join(str(symbol) for symbol in rule)
+
+
+def resolve_symbol(name: str) -> NonTerminal | TokenType | SemanticAction:
+    # Names are written like <FORMAL-PARAMETERS> in the grammar and like
+    # formal_parameters in the enums
+    if name in NAMED_TERMINALS:
+        return NAMED_TERMINALS[name]
+    value = name.lower().replace("-", "_")
+    if value in NonTerminal._value2member_map_:
+        return NonTerminal(value)
+    if value in SemanticAction._value2member_map_:
+        return SemanticAction(value)
+    raise GrammarError(f"Unknown symbol <{name}>")
+
+
+def parse_grammar(
+    text: str,
+) -> dict[NonTerminal, list[list[NonTerminal | TokenType | SemanticAction]]]:
+    # Every line starting with // is a comment. Rules start with
+    # `<NONTERMINAL> ::=`, alternatives are separated by `|` and can span lines.
+    lines = [line for line in text.split("\n") if not line.strip().startswith("//")]
+    productions: dict[
+        NonTerminal,
+        list[list[NonTerminal | TokenType | SemanticAction]],
+    ] = {}
+    alternatives: list[list[NonTerminal | TokenType | SemanticAction]] | None = None
+    for match in GRAMMAR_PATTERN.finditer("\n".join(lines)):
+        kind = match.lastgroup
+        if kind == "whitespace":
+            continue
+        if kind == "head":
+            head = resolve_symbol(match.group("head")[1:-1])
+            if not isinstance(head, NonTerminal):
+                raise GrammarError(f"{match.group('head')} is not a nonterminal")
+            if head in productions:
+                raise GrammarError(f"{match.group('head')} is defined twice")
+            alternatives = [[]]
+            productions[head] = alternatives
+            continue
+        if alternatives is None:
+            raise GrammarError(f'Found "{match.group()}" before the first rule')
+        if kind == "alternative":
+            alternatives.append([])
+        elif kind == "epsilon":
+            pass
+        elif kind == "symbol":
+            alternatives[-1].append(resolve_symbol(match.group("symbol")[1:-1]))
+        elif kind == "quoted":
+            quoted = match.group("quoted")
+            if quoted not in QUOTED_TERMINALS:
+                raise GrammarError(f'Unknown terminal "{quoted}"')
+            alternatives[-1].append(QUOTED_TERMINALS[quoted])
+        else:
+            raise GrammarError(f'Unexpected character "{match.group()}"')
+    return productions
+
+
+def read_grammar(filename: str) -> Grammar:
+    file_dir = os.path.dirname(__file__)
+    with open(os.path.join(file_dir, filename), encoding="utf-8") as grammar_file:
+        return Grammar(parse_grammar(grammar_file.read()))
+
+
+def generate_parse_table_from_grammar(filename: str):
+    return read_grammar(filename).build_parse_table()
+
+
+def format_terminal(terminal: TokenType) -> str:
+    # Terminals are displayed the way the grammar writes them
+    for name, named_terminal in NAMED_TERMINALS.items():
+        if named_terminal == terminal:
+            return name
+    if terminal == TokenType.END_OF_FILE:
+        return "$"
+    for quoted, quoted_terminal in QUOTED_TERMINALS.items():
+        if quoted_terminal == terminal:
+            return f'"{quoted}"'.replace("*", "\\*")
+    return str(terminal)
+
+
+def format_sets_as_markdown(
+    title: str,
+    sets: dict[NonTerminal, set[TokenType]],
+    nullable: set[NonTerminal] | None = None,
+) -> str:
+    rows: list[tuple[str, str]] = []
+    for nonterminal, terminals in sets.items():
+        cells = [
+            format_terminal(terminal)
+            for terminal in sorted(terminals, key=TERMINAL_ORDER.__getitem__)
+        ]
+        if nullable is not None and nonterminal in nullable:
+            cells.append("ε")
+        rows.append((nonterminal.name.replace("_", "-"), ", ".join(cells)))
+    name_width = max(len(name) for name, _ in rows)
+    set_width = max(len(title), *(len(cells) for _, cells in rows))
+    lines = [
+        f"| {'':<{name_width}} | {title:<{set_width}} |",
+        f"| {'-' * name_width} | {'-' * set_width} |",
+    ]
+    lines.extend(
+        f"| {name:<{name_width}} | {cells:<{set_width}} |" for name, cells in rows
+    )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # Prints the first and follow sets in the format of doc/first-and-follow-sets.md
+    grammar = read_grammar("refactored-grammar.txt")
+    print(format_sets_as_markdown("first", grammar.first, grammar.nullable))
+    print()
+    print(format_sets_as_markdown("follow", grammar.follow))
@@ -0,0 +1,253 @@
+from collections.abc import Iterator
+from copy import deepcopy
+from dataclasses import dataclass
+
+from compiler.ast_nodes import (
+    AndExpression,
+    BinaryExpression,
+    Definition,
+    Expression,
+    FunctionCallExpression,
+    Identifier,
+    IfExpression,
+    OrExpression,
+    Program,
+    UnaryExpression,
+)
+from compiler.ast_utils import called_functions, is_leaf, walk
+from compiler.constant_folding import is_discardable
+from compiler.symbol_table import SymbolTable
+
+# Functions whose body (after inlining the calls within it, and with the
+# parameters replaced by the arguments) has at most this many expressions are
+# inlined
+MAX_INLINED_SIZE = 16
+
+
+@dataclass
+class InliningDecision:
+    caller: str
+    callee: str
+    inlined: bool
+    reason: str = ""  # Why the call was kept
+
+
+def expression_size(expression: Expression) -> int:
+    return sum(1 for _ in walk(expression))
+
+
+def parameter_uses(
+    expression: Expression,
+    conditional: bool = False,  # noqa: FBT001, FBT002
+) -> Iterator[tuple[str, bool]]:
+    # Every identifier in the expression, and whether it is only evaluated
+    # depending on a condition (in a branch of an if or the right side of a short
+    # circuiting operator)
+    if isinstance(expression, Identifier):
+        yield expression.value, conditional
+    elif isinstance(expression, (AndExpression, OrExpression)):
+        yield from parameter_uses(expression.left_side, conditional)
+        yield from parameter_uses(expression.right_side, True)  # noqa: FBT003
+    elif isinstance(expression, BinaryExpression):
+        yield from parameter_uses(expression.left_side, conditional)
+        yield from parameter_uses(expression.right_side, conditional)
+    elif isinstance(expression, UnaryExpression):
+        yield from parameter_uses(expression.value, conditional)
+    elif isinstance(expression, IfExpression):
+        yield from parameter_uses(expression.condition, conditional)
+        yield from parameter_uses(expression.consequent, True)  # noqa: FBT003
+        yield from parameter_uses(expression.alternative, True)  # noqa: FBT003
+    elif isinstance(expression, FunctionCallExpression):
+        for argument in expression.argument_list.arguments:
+            yield from parameter_uses(argument.value, conditional)
+
+
+def substitute(expression: Expression, arguments: dict[str, Expression]) -> Expression:
+    # Replaces the parameters in the expression with (a copy of) their argument,
+    # updating the expression in place
+    if isinstance(expression, Identifier):
+        return deepcopy(arguments[expression.value])
+    if isinstance(expression, BinaryExpression):
+        expression.left_side = substitute(expression.left_side, arguments)
+        expression.right_side = substitute(expression.right_side, arguments)
+    elif isinstance(expression, UnaryExpression):
+        expression.value = substitute(expression.value, arguments)
+    elif isinstance(expression, IfExpression):
+        expression.condition = substitute(expression.condition, arguments)
+        expression.consequent = substitute(expression.consequent, arguments)
+        expression.alternative = substitute(expression.alternative, arguments)
+    elif isinstance(expression, FunctionCallExpression):
+        for argument in expression.argument_list.arguments:
+            argument.value = substitute(argument.value, arguments)
+    return expression
+
+
+class Inliner:
+    # Replaces calls to small functions that can't end up calling themselves with
+    # the function's body, with the parameters replaced by the arguments. That
+    # saves building a stack frame and saving registers for the call.
+    #
+    # Arguments are evaluated where (and as often as) their parameter is used
+    # instead of once before the call, which only makes no difference when they
+    # can't print or fail. So an argument containing a call or a division is only
+    # allowed when the function can't print or fail either, and its parameter is
+    # used exactly once regardless of any conditions. Other than a literal or a
+    # parameter, an argument is only copied into one use of its parameter, so
+    # nested calls can't multiply the code (or the work) they inline.
+    #
+    # Functions printing values are never inlined, since prints can only appear
+    # at the start of a function's body. The ast is updated in place, and the
+    # symbol table's references are updated to the calls left afterwards.
+    def __init__(
+        self,
+        program: Program,
+        symbol_table: SymbolTable,
+        max_size: int = MAX_INLINED_SIZE,
+    ):
+        self._program: Program = program
+        self._symbol_table: SymbolTable = symbol_table
+        self._max_size: int = max_size
+        self._definitions: dict[str, Definition] = {
+            definition.name.value: definition for definition in program.definition_list
+        }
+        self._processed: set[str] = set()
+        self.decisions: list[InliningDecision] = []
+
+    def inline(self) -> Program:
+        for name in self._definitions:
+            self._process(name)
+        self._update_references()
+        return self._program
+
+    def _process(self, name: str):
+        # Functions are processed before they are inlined anywhere, so what gets
+        # inlined already has the calls within it inlined
+        if name in self._processed:
+            return
+        self._processed.add(name)
+        body = self._definitions[name].body
+        for print_expression in body.print_expressions:
+            _ = self._inline_calls(print_expression, name)
+        body.body = self._inline_calls(body.body, name)
+
+    def _is_recursive(self, name: str) -> bool:
+        # Whether the function can end up calling itself
+        pending = [name]
+        seen: set[str] = set()
+        while pending:
+            symbol = self._symbol_table.scope_lookup(pending.pop())
+            if symbol is None:
+                continue
+            for called in symbol.forward_references:
+                if called == name:
+                    return True
+                if called not in seen:
+                    seen.add(called)
+                    pending.append(called)
+        return False
+
+    def _inline_calls(self, expression: Expression, caller: str) -> Expression:
+        if isinstance(expression, BinaryExpression):
+            expression.left_side = self._inline_calls(expression.left_side, caller)
+            expression.right_side = self._inline_calls(expression.right_side, caller)
+        elif isinstance(expression, UnaryExpression):
+            expression.value = self._inline_calls(expression.value, caller)
+        elif isinstance(expression, IfExpression):
+            expression.condition = self._inline_calls(expression.condition, caller)
+            expression.consequent = self._inline_calls(expression.consequent, caller)
+            expression.alternative = self._inline_calls(
+                expression.alternative,
+                caller,
+            )
+        elif isinstance(expression, FunctionCallExpression):
+            for argument in expression.argument_list.arguments:
+                argument.value = self._inline_calls(argument.value, caller)
+            callee = expression.function_name.value
+            if callee not in self._definitions:
+                return expression
+            arguments = [
+                argument.value for argument in expression.argument_list.arguments
+            ]
+            reason = self._reason_to_keep(callee, arguments)
+            self.decisions.append(
+                InliningDecision(caller, callee, reason is None, reason or ""),
+            )
+            if reason is None:
+                return self._inlined_body(callee, arguments)
+        return expression
+
+    def _reason_to_keep(self, callee: str, arguments: list[Expression]) -> str | None:
+        definition = self._definitions[callee]
+        if self._is_recursive(callee):
+            return "recursive"
+        if definition.body.print_expressions:
+            return "prints"
+        self._process(callee)
+        size = expression_size(definition.body.body)
+        if size > self._max_size:
+            return f"too large ({size} expressions)"
+
+        parameters = [
+            parameter.name.value for parameter in definition.parameters.parameters
+        ]
+        uses = list(parameter_uses(definition.body.body))
+        effects = [
+            parameter
+            for parameter, argument in zip(parameters, arguments, strict=True)
+            if not is_discardable(argument)
+        ]
+        if effects:
+            if len(effects) > 1 or not is_discardable(definition.body.body):
+                return "arguments may print or fail"
+            if [use for use in uses if use[0] == effects[0]] != [(effects[0], False)]:
+                return f"{effects[0]} may print or fail and is not used exactly once"
+
+        use_counts = {
+            parameter: sum(1 for use in uses if use[0] == parameter)
+            for parameter in parameters
+        }
+        for parameter, argument in zip(parameters, arguments, strict=True):
+            if use_counts[parameter] > 1 and not is_leaf(argument):
+                return (
+                    f"{parameter} is used {use_counts[parameter]} times and its "
+                    + "argument is not a literal or parameter"
+                )
+        # Each use of a parameter is replaced by its argument
+        size += sum(
+            use_counts[parameter] * (expression_size(argument) - 1)
+            for parameter, argument in zip(parameters, arguments, strict=True)
+        )
+        if size > self._max_size:
+            return f"too large once inlined ({size} expressions)"
+        return None
+
+    def _inlined_body(self, callee: str, arguments: list[Expression]) -> Expression:
+        definition = self._definitions[callee]
+        parameters = [
+            parameter.name.value for parameter in definition.parameters.parameters
+        ]
+        return substitute(
+            deepcopy(definition.body.body),
+            dict(zip(parameters, arguments, strict=True)),
+        )
+
+    def _update_references(self):
+        for symbol in self._symbol_table:
+            symbol.backward_references = set()
+            if symbol.name in self._definitions:
+                symbol.forward_references = called_functions(
+                    self._definitions[symbol.name],
+                )
+        self._symbol_table.update_backward_references()
+
+
+def inline_functions(
+    program: Program,
+    symbol_table: SymbolTable,
+    max_size: int = MAX_INLINED_SIZE,
+) -> list[InliningDecision]:
+    # Inlines calls in the program (in place) and returns what was decided for
+    # each call
+    inliner = Inliner(program, symbol_table, max_size)
+    _ = inliner.inline()
+    return inliner.decisions
@@ -0,0 +1,753 @@
+from abc import ABC, abstractmethod
+from collections import Counter
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+
+from typing_extensions import override
+
+from compiler.ast_nodes import (
+    AndExpression,
+    BinaryExpression,
+    BooleanLiteral,
+    Definition,
+    DivideExpression,
+    EqualsExpression,
+    Expression,
+    FunctionCallExpression,
+    Identifier,
+    IfExpression,
+    IntegerLiteral,
+    LessThanExpression,
+    MinusExpression,
+    NotExpression,
+    OrExpression,
+    PlusExpression,
+    TimesExpression,
+    UnaryMinusExpression,
+)
+from compiler.klein_errors import CodeGenerationError
+
+# A function's code in three-address form: a list of basic blocks, each a list of
+# instructions computing values into virtual registers followed by a terminator
+# that leaves the block. There are as many virtual registers as needed, they are
+# only mapped onto tm registers (or stack frame cells) by the backend.
+
+OPERATORS: dict[type[BinaryExpression], str] = {
+    PlusExpression: "+",
+    MinusExpression: "-",
+    TimesExpression: "*",
+    DivideExpression: "/",
+    LessThanExpression: "<",
+    EqualsExpression: "=",
+}
+# Operators whose operands can be swapped
+COMMUTATIVE_OPERATORS = frozenset(("+", "*", "="))
+
+
+@dataclass(frozen=True)
+class VirtualRegister:
+    number: int
+
+    @override
+    def __str__(self) -> str:
+        return f"v{self.number}"
+
+
+# Operands are either virtual registers or integer constants (booleans are 0 and 1)
+Operand = VirtualRegister | int
+
+
+def replaced(operand: Operand, replacements: dict[VirtualRegister, Operand]) -> Operand:
+    if isinstance(operand, VirtualRegister):
+        return replacements.get(operand, operand)
+    return operand
+
+
+def registers_in(operands: list[Operand]) -> list[VirtualRegister]:
+    return [operand for operand in operands if isinstance(operand, VirtualRegister)]
+
+
+class IRInstruction(ABC):
+    # The virtual register the instruction writes, if any
+    dest: VirtualRegister | None
+
+    @abstractmethod
+    def operands(self) -> list[Operand]:
+        raise NotImplementedError("Operands must be implemented by subclass")
+
+    @abstractmethod
+    def replace_operands(self, replacements: dict[VirtualRegister, Operand]):
+        raise NotImplementedError("Replacing operands must be implemented by subclass")
+
+    def uses(self) -> list[VirtualRegister]:
+        return registers_in(self.operands())
+
+
+@dataclass
+class Copy(IRInstruction):
+    dest: VirtualRegister
+    source: Operand
+
+    @override
+    def operands(self) -> list[Operand]:
+        return [self.source]
+
+    @override
+    def replace_operands(self, replacements: dict[VirtualRegister, Operand]):
+        self.source = replaced(self.source, replacements)
+
+    @override
+    def __str__(self) -> str:
+        return f"{self.dest} = {self.source}"
+
+
+@dataclass
+class LoadParameter(IRInstruction):
+    dest: VirtualRegister
+    index: int
+    name: str
+
+    @override
+    def operands(self) -> list[Operand]:
+        return []
+
+    @override
+    def replace_operands(self, replacements: dict[VirtualRegister, Operand]):
+        pass
+
+    @override
+    def __str__(self) -> str:
+        return f"{self.dest} = param {self.name}"
+
+
+@dataclass
+class BinaryOperation(IRInstruction):
+    # Comparisons produce 1 when they hold and 0 otherwise
+    operator: str
+    dest: VirtualRegister
+    left: Operand
+    right: Operand
+
+    @override
+    def operands(self) -> list[Operand]:
+        return [self.left, self.right]
+
+    @override
+    def replace_operands(self, replacements: dict[VirtualRegister, Operand]):
+        self.left = replaced(self.left, replacements)
+        self.right = replaced(self.right, replacements)
+
+    @override
+    def __str__(self) -> str:
+        return f"{self.dest} = {self.left} {self.operator} {self.right}"
+
+
+@dataclass
+class Call(IRInstruction):
+    dest: VirtualRegister | None  # None when the value isn't used, like print's
+    function: str
+    arguments: list[Operand]
+
+    @override
+    def operands(self) -> list[Operand]:
+        return list(self.arguments)
+
+    @override
+    def replace_operands(self, replacements: dict[VirtualRegister, Operand]):
+        self.arguments = [
+            replaced(argument, replacements) for argument in self.arguments
+        ]
+
+    @override
+    def __str__(self) -> str:
+        call = f"call {self.function}({', '.join(map(str, self.arguments))})"
+        return call if self.dest is None else f"{self.dest} = {call}"
+
+
+class Terminator(IRInstruction):
+    dest: VirtualRegister | None = None
+
+    @abstractmethod
+    def successors(self) -> list[str]:
+        raise NotImplementedError("Successors must be implemented by subclass")
+
+
+@dataclass
+class Jump(Terminator):
+    target: str
+
+    @override
+    def operands(self) -> list[Operand]:
+        return []
+
+    @override
+    def replace_operands(self, replacements: dict[VirtualRegister, Operand]):
+        pass
+
+    @override
+    def successors(self) -> list[str]:
+        return [self.target]
+
+    @override
+    def __str__(self) -> str:
+        return f"goto {self.target}"
+
+
+@dataclass
+class Branch(Terminator):
+    relation: str  # "<" or "="
+    left: Operand
+    right: Operand
+    true_target: str
+    false_target: str
+
+    @override
+    def operands(self) -> list[Operand]:
+        return [self.left, self.right]
+
+    @override
+    def replace_operands(self, replacements: dict[VirtualRegister, Operand]):
+        self.left = replaced(self.left, replacements)
+        self.right = replaced(self.right, replacements)
+
+    @override
+    def successors(self) -> list[str]:
+        return [self.true_target, self.false_target]
+
+    @override
+    def __str__(self) -> str:
+        return (
+            f"if {self.left} {self.relation} {self.right} "
+            + f"goto {self.true_target} else {self.false_target}"
+        )
+
+
+@dataclass
+class Return(Terminator):
+    value: Operand
+
+    @override
+    def operands(self) -> list[Operand]:
+        return [self.value]
+
+    @override
+    def replace_operands(self, replacements: dict[VirtualRegister, Operand]):
+        self.value = replaced(self.value, replacements)
+
+    @override
+    def successors(self) -> list[str]:
+        return []
+
+    @override
+    def __str__(self) -> str:
+        return f"return {self.value}"
+
+
+@dataclass
+class TailCall(Terminator):
+    # Starts the function over with new arguments, returning the value of the call
+    arguments: list[Operand]
+
+    @override
+    def operands(self) -> list[Operand]:
+        return list(self.arguments)
+
+    @override
+    def replace_operands(self, replacements: dict[VirtualRegister, Operand]):
+        self.arguments = [
+            replaced(argument, replacements) for argument in self.arguments
+        ]
+
+    @override
+    def successors(self) -> list[str]:
+        return []
+
+    @override
+    def __str__(self) -> str:
+        return f"tail call ({', '.join(map(str, self.arguments))})"
+
+
+@dataclass
+class BasicBlock:
+    label: str
+    instructions: list[IRInstruction] = field(default_factory=list)
+    terminator: Terminator = field(default_factory=lambda: Return(0))
+
+    def all_instructions(self) -> list[IRInstruction]:
+        return [*self.instructions, self.terminator]
+
+
+@dataclass
+class IRFunction:
+    name: str
+    parameters: list[str]
+    blocks: list[BasicBlock]  # In the order they are laid out, the entry first
+
+    def instructions(self) -> Iterator[IRInstruction]:
+        for block in self.blocks:
+            yield from block.all_instructions()
+
+    @override
+    def __str__(self) -> str:
+        lines = [f"function {self.name}({', '.join(self.parameters)})"]
+        for block in self.blocks:
+            lines.append(f"{block.label}:")
+            lines.extend(
+                f"    {instruction}" for instruction in block.all_instructions()
+            )
+        return "\n".join(lines)
+
+
+class IRBuilder:
+    # Lowers a function's (annotated) ast into three-address code. Every
+    # expression gets a fresh virtual register, so most registers are written
+    # exactly once. The exceptions are the registers holding the value of an if or
+    # and/or used as a value, which each branch writes before joining.
+    #
+    # Conditions are lowered into branches to the block for each outcome, so
+    # comparisons and and/or only produce a value where one is used.
+    def __init__(self, definition: Definition, *, tail_calls: bool = True):
+        self._definition: Definition = definition
+        self._name: str = definition.name.value
+        self._parameters: list[str] = [
+            parameter.name.value for parameter in definition.parameters.parameters
+        ]
+        self._tail_calls: bool = tail_calls
+        self._register_count: int = 0
+        self._label_count: int = 0
+        self._blocks: list[BasicBlock] = []
+        self._block: BasicBlock = self._start_block("entry")
+
+    def build(self) -> IRFunction:
+        for print_expression in self._definition.body.print_expressions:
+            arguments = [
+                self._lower_value(argument.value)
+                for argument in print_expression.argument_list.arguments
+            ]
+            self._emit(Call(None, "print", arguments))
+        self._lower_return(self._definition.body.body)
+        return IRFunction(self._name, self._parameters, self._blocks)
+
+    def _new_register(self) -> VirtualRegister:
+        self._register_count += 1
+        return VirtualRegister(self._register_count)
+
+    def _new_label(self, description: str) -> str:
+        self._label_count += 1
+        return f"{description}{self._label_count}"
+
+    def _start_block(self, label: str) -> BasicBlock:
+        # Blocks are laid out in the order they are started
+        self._block = BasicBlock(label)
+        self._blocks.append(self._block)
+        return self._block
+
+    def _emit(self, instruction: IRInstruction):
+        self._block.instructions.append(instruction)
+
+    def _terminate(self, terminator: Terminator):
+        self._block.terminator = terminator
+
+    def _lower_return(self, expression: Expression):
+        # Ends the current block by returning the expression's value
+        if isinstance(expression, IfExpression):
+            then_label = self._new_label("then")
+            else_label = self._new_label("else")
+            self._lower_condition(expression.condition, then_label, else_label)
+            _ = self._start_block(then_label)
+            self._lower_return(expression.consequent)
+            _ = self._start_block(else_label)
+            self._lower_return(expression.alternative)
+        elif (
+            isinstance(expression, FunctionCallExpression)
+            and self._tail_calls
+            and expression.function_name.value == self._name
+        ):
+            self._terminate(
+                TailCall(
+                    [
+                        self._lower_value(argument.value)
+                        for argument in expression.argument_list.arguments
+                    ],
+                ),
+            )
+        else:
+            self._terminate(Return(self._lower_value(expression)))
+
+    def _lower_condition(
+        self,
+        expression: Expression,
+        true_label: str,
+        false_label: str,
+    ):
+        # Ends the current block by branching on a boolean expression
+        if isinstance(expression, BooleanLiteral):
+            self._terminate(
+                Jump(true_label if expression.value == "true" else false_label),
+            )
+        elif isinstance(expression, NotExpression):
+            self._lower_condition(expression.value, false_label, true_label)
+        elif isinstance(expression, (AndExpression, OrExpression)):
+            right_label = self._new_label("right")
+            if isinstance(expression, AndExpression):
+                self._lower_condition(expression.left_side, right_label, false_label)
+            else:
+                self._lower_condition(expression.left_side, true_label, right_label)
+            _ = self._start_block(right_label)
+            self._lower_condition(expression.right_side, true_label, false_label)
+        elif isinstance(expression, (LessThanExpression, EqualsExpression)):
+            left = self._lower_value(expression.left_side)
+            right = self._lower_value(expression.right_side)
+            self._terminate(
+                Branch(
+                    OPERATORS[type(expression)],
+                    left,
+                    right,
+                    true_label,
+                    false_label,
+                ),
+            )
+        else:
+            value = self._lower_value(expression)
+            self._terminate(Branch("=", value, 0, false_label, true_label))
+
+    def _lower_join(self, result: VirtualRegister, expression: Expression, end: str):
+        # Ends the current block by writing the expression's value into the
+        # register an if or and/or joins on, and jumping to where they join. An
+        # if or and/or in a branch writes the same register and joins in the same
+        # place, instead of joining on its own register that is then copied.
+        if isinstance(expression, (AndExpression, OrExpression, IfExpression)):
+            self._lower_branches(expression, result, end)
+        else:
+            self._emit(Copy(result, self._lower_value(expression)))
+            self._terminate(Jump(end))
+
+    def _lower_value(self, expression: Expression) -> Operand:
+        # Appends the instructions computing the expression's value to the current
+        # block (or starts new ones) and returns where the value ends up
+        if isinstance(expression, IntegerLiteral):
+            return int(expression.value)
+        if isinstance(expression, BooleanLiteral):
+            return 1 if expression.value == "true" else 0
+        if isinstance(expression, Identifier):
+            if expression.value not in self._parameters:
+                raise CodeGenerationError(f"Unknown identifier {expression.value}")
+            dest = self._new_register()
+            index = self._parameters.index(expression.value)
+            self._emit(LoadParameter(dest, index, expression.value))
+            return dest
+        if isinstance(expression, UnaryMinusExpression):
+            return self._lower_operation("-", 0, expression.value)
+        if isinstance(expression, NotExpression):
+            return self._lower_operation("-", 1, expression.value)
+        if isinstance(expression, (AndExpression, OrExpression, IfExpression)):
+            result = self._new_register()
+            end_label = self._new_label("end")
+            self._lower_branches(expression, result, end_label)
+            _ = self._start_block(end_label)
+            return result
+        if isinstance(expression, BinaryExpression):
+            left = self._lower_value(expression.left_side)
+            return self._lower_operation(
+                OPERATORS[type(expression)],
+                left,
+                expression.right_side,
+            )
+        if isinstance(expression, FunctionCallExpression):
+            arguments = [
+                self._lower_value(argument.value)
+                for argument in expression.argument_list.arguments
+            ]
+            dest = self._new_register()
+            self._emit(Call(dest, expression.function_name.value, arguments))
+            return dest
+        raise CodeGenerationError(
+            f"Lowering expression of type {expression.__class__.__name__} is not yet implemented",
+        )
+
+    def _lower_operation(
+        self,
+        operator: str,
+        left: Operand,
+        right_side: Expression,
+    ) -> VirtualRegister:
+        right = self._lower_value(right_side)
+        dest = self._new_register()
+        self._emit(BinaryOperation(operator, dest, left, right))
+        return dest
+
+    def _lower_branches(
+        self,
+        expression: AndExpression | OrExpression | IfExpression,
+        result: VirtualRegister,
+        end_label: str,
+    ):
+        # Ends the current block with the branches of an if or and/or used as a
+        # value, which each write the result register and jump to the end label.
+        # The left side of an and/or is branched on, and the value it decides
+        # the result with is only written when it does.
+        if isinstance(expression, IfExpression):
+            then_label = self._new_label("then")
+            else_label = self._new_label("else")
+            self._lower_condition(expression.condition, then_label, else_label)
+            _ = self._start_block(then_label)
+            self._lower_join(result, expression.consequent, end_label)
+            _ = self._start_block(else_label)
+            self._lower_join(result, expression.alternative, end_label)
+            return
+        right_label = self._new_label("right")
+        decided_label = self._new_label("decided")
+        decided_by = isinstance(expression, OrExpression)
+        if decided_by:
+            self._lower_condition(expression.left_side, decided_label, right_label)
+        else:
+            self._lower_condition(expression.left_side, right_label, decided_label)
+        _ = self._start_block(right_label)
+        self._lower_join(result, expression.right_side, end_label)
+        _ = self._start_block(decided_label)
+        self._emit(Copy(result, int(decided_by)))
+        self._terminate(Jump(end_label))
+
+
+def lower_function(definition: Definition, *, tail_calls: bool = True) -> IRFunction:
+    return IRBuilder(definition, tail_calls=tail_calls).build()
+
+
+def definition_counts(function: IRFunction) -> Counter[VirtualRegister]:
+    return Counter(
+        instruction.dest
+        for instruction in function.instructions()
+        if instruction.dest is not None
+    )
+
+
+def liveness(
+    function: IRFunction,
+) -> tuple[dict[str, set[VirtualRegister]], dict[str, set[VirtualRegister]]]:
+    # The virtual registers live on entry to and exit from each block, iterated
+    # backwards until nothing changes
+    blocks = {block.label: block for block in function.blocks}
+    live_in: dict[str, set[VirtualRegister]] = {label: set() for label in blocks}
+    live_out: dict[str, set[VirtualRegister]] = {label: set() for label in blocks}
+    changed = True
+    while changed:
+        changed = False
+        for block in reversed(function.blocks):
+            out: set[VirtualRegister] = set()
+            for successor in block.terminator.successors():
+                out |= live_in[successor]
+            live = set(out)
+            for instruction in reversed(block.all_instructions()):
+                if instruction.dest is not None:
+                    live.discard(instruction.dest)
+                live.update(instruction.uses())
+            if out != live_out[block.label] or live != live_in[block.label]:
+                live_out[block.label] = out
+                live_in[block.label] = live
+                changed = True
+    return live_in, live_out
+
+
+def live_intervals(
+    function: IRFunction,
+) -> tuple[dict[VirtualRegister, int], dict[VirtualRegister, int], list[int]]:
+    # Numbers the instructions in the order the blocks are laid out, and finds
+    # the first and last position each register is live at and the positions of
+    # the calls
+    live_in, live_out = liveness(function)
+    starts: dict[VirtualRegister, int] = {}
+    ends: dict[VirtualRegister, int] = {}
+    calls: list[int] = []
+
+    def extend(register: VirtualRegister, position: int):
+        starts[register] = min(starts.get(register, position), position)
+        ends[register] = max(ends.get(register, position), position)
+
+    position = 0
+    for block in function.blocks:
+        for register in live_in[block.label]:
+            extend(register, position)
+        for instruction in block.all_instructions():
+            for register in instruction.uses():
+                extend(register, position)
+            if instruction.dest is not None:
+                extend(instruction.dest, position)
+            if isinstance(instruction, Call):
+                calls.append(position)
+            position += 1
+        for register in live_out[block.label]:
+            extend(register, position - 1)
+    return starts, ends, calls
+
+
+def remove_unreachable_blocks(function: IRFunction) -> bool:
+    blocks = {block.label: block for block in function.blocks}
+    reachable = {function.blocks[0].label}
+    pending = [function.blocks[0].label]
+    while pending:
+        for successor in blocks[pending.pop()].terminator.successors():
+            if successor not in reachable:
+                reachable.add(successor)
+                pending.append(successor)
+    kept = [block for block in function.blocks if block.label in reachable]
+    changed = len(kept) != len(function.blocks)
+    function.blocks = kept
+    return changed
+
+
+def propagate_copies(function: IRFunction) -> bool:
+    # Replaces the uses of a register copied from a constant or another register
+    # with what it was copied from. Only registers written once are replaced (and
+    # only by constants or registers written once), whose definition comes before
+    # every use, so the copied value can't have changed where it is used.
+    counts = definition_counts(function)
+    replacements: dict[VirtualRegister, Operand] = {}
+    for instruction in function.instructions():
+        if (
+            isinstance(instruction, Copy)
+            and counts[instruction.dest] == 1
+            and (isinstance(instruction.source, int) or counts[instruction.source] == 1)
+        ):
+            replacements[instruction.dest] = instruction.source
+    for dest, source in replacements.items():
+        origin = source
+        while isinstance(origin, VirtualRegister) and origin in replacements:
+            origin = replacements[origin]
+        replacements[dest] = origin
+    changed = False
+    for instruction in function.instructions():
+        before = instruction.operands()
+        instruction.replace_operands(replacements)
+        changed = changed or instruction.operands() != before
+    return changed
+
+
+def use_counts(function: IRFunction) -> Counter[VirtualRegister]:
+    return Counter(
+        register
+        for instruction in function.instructions()
+        for register in instruction.uses()
+    )
+
+
+def passed_along(function: IRFunction) -> set[VirtualRegister]:
+    # The parameter loads only used to pass the parameter unchanged to a tail
+    # call, which doesn't have to store those arguments (or load them)
+    loaded = {
+        instruction.dest: instruction.index
+        for instruction in function.instructions()
+        if isinstance(instruction, LoadParameter)
+    }
+    uses = use_counts(function)
+    return {
+        argument
+        for block in function.blocks
+        if isinstance(block.terminator, TailCall)
+        for idx, argument in enumerate(block.terminator.arguments)
+        if isinstance(argument, VirtualRegister)
+        and loaded.get(argument) == idx
+        and uses[argument] == 1
+    }
+
+
+def predecessors(function: IRFunction) -> dict[str, list[str]]:
+    preceding: dict[str, list[str]] = {block.label: [] for block in function.blocks}
+    for block in function.blocks:
+        for successor in block.terminator.successors():
+            preceding[successor].append(block.label)
+    return preceding
+
+
+def eliminate_common_subexpressions(function: IRFunction) -> bool:
+    # Value numbering: a parameter load or operation computing what an earlier
+    # one already computed becomes a copy of its result. A block starts out with
+    # the values computed by the end of its predecessor when it has only one
+    # (like the branches of an if), which are always computed before it. Only
+    # operations on constants and registers written once are reused. Nothing is
+    # reused across a call, since a value kept in a register during a call costs
+    # the called function a save and restore, which is more than loading or
+    # computing it again. Parameters passed along unchanged to a tail call keep
+    # their own load, which the backend leaves out.
+    counts = definition_counts(function)
+    preceding = predecessors(function)
+    unchanged = passed_along(function)
+    available_after: dict[str, dict[tuple[object, ...], VirtualRegister]] = {}
+    changed = False
+    for block in function.blocks:
+        available: dict[tuple[object, ...], VirtualRegister] = {}
+        if len(preceding[block.label]) == 1:
+            available = dict(available_after.get(preceding[block.label][0], {}))
+        available_after[block.label] = available
+        for position, instruction in enumerate(block.instructions):
+            if isinstance(instruction, Call):
+                available.clear()
+                continue
+            key = _value_key(instruction, counts, unchanged)
+            if key is None or counts[instruction.dest] != 1:
+                continue
+            if key in available:
+                block.instructions[position] = Copy(instruction.dest, available[key])
+                changed = True
+            else:
+                available[key] = instruction.dest
+    return changed
+
+
+def _value_key(
+    instruction: IRInstruction,
+    counts: dict[VirtualRegister, int],
+    unchanged: set[VirtualRegister],
+) -> tuple[object, ...] | None:
+    # What the instruction computes, if value numbering may reuse it
+    if isinstance(instruction, LoadParameter):
+        if instruction.dest in unchanged:
+            return None
+        return ("param", instruction.index)
+    if isinstance(instruction, BinaryOperation) and all(
+        isinstance(operand, int) or counts[operand] == 1
+        for operand in instruction.operands()
+    ):
+        operands = [instruction.left, instruction.right]
+        if instruction.operator in COMMUTATIVE_OPERATORS:
+            operands.sort(key=str)
+        return (instruction.operator, *operands)
+    return None
+
+
+def eliminate_dead_code(function: IRFunction) -> bool:
+    # Removes instructions writing registers that are never read afterwards.
+    # Calls are kept since they may print, and so are divisions since they may
+    # fail.
+    _, live_out = liveness(function)
+    changed = False
+    for block in function.blocks:
+        live = set(live_out[block.label]) | set(block.terminator.uses())
+        kept: list[IRInstruction] = []
+        for instruction in reversed(block.instructions):
+            removable = not isinstance(instruction, Call) and not (
+                isinstance(instruction, BinaryOperation) and instruction.operator == "/"
+            )
+            if instruction.dest not in live and removable:
+                changed = True
+                continue
+            if instruction.dest is not None:
+                live.discard(instruction.dest)
+            live.update(instruction.uses())
+            kept.append(instruction)
+        block.instructions = kept[::-1]
+    return changed
+
+
+def optimize_function(function: IRFunction) -> IRFunction:
+    # Runs the passes (in place) until none of them changes anything
+    changed = True
+    while changed:
+        changed = remove_unreachable_blocks(function)
+        changed = propagate_copies(function) or changed
+        changed = eliminate_common_subexpressions(function) or changed
+        changed = eliminate_dead_code(function) or changed
+    return function
+
+
+def instruction_count(function: IRFunction) -> int:
+    return sum(1 for _ in function.instructions())
@@ -0,0 +1,587 @@
+from typing import Any
+
+from typing_extensions import override
+
+from compiler.ast_nodes import Definition, Program
+from compiler.code_generator import (
+    GENERAL_PURPOSE_REGISTERS,
+    REG_PC,
+    REG_RETURN_VALUE,
+    REG_STATUS,
+    REG_TOP,
+    REG_ZERO,
+    CodeGenerator,
+    MemoryLocation,
+    body_label,
+)
+from compiler.ir import (
+    BasicBlock,
+    BinaryOperation,
+    Branch,
+    Call,
+    Copy,
+    IRFunction,
+    IRInstruction,
+    Jump,
+    LoadParameter,
+    Operand,
+    Return,
+    TailCall,
+    Terminator,
+    VirtualRegister,
+    definition_counts,
+    live_intervals,
+    liveness,
+    lower_function,
+    optimize_function,
+    use_counts,
+)
+from compiler.klein_errors import CodeGenerationError
+from compiler.symbol_table import SymbolTable
+from compiler.tm import (
+    AddCommand,
+    Comment,
+    DivCommand,
+    JeqCommand,
+    JltCommand,
+    Label,
+    LabelReference,
+    LdaCommand,
+    LdcCommand,
+    LdCommand,
+    MulCommand,
+    StCommand,
+    SubCommand,
+    TMLine,
+)
+
+ARITHMETIC_COMMANDS = {
+    "+": AddCommand,
+    "-": SubCommand,
+    "*": MulCommand,
+    "/": DivCommand,
+}
+# The commands jumping when a relation between a difference (or a value
+# compared with 0) and 0 holds and when it doesn't
+RELATION_JUMPS: dict[str, tuple[str, str]] = {"<": ("JLT", "JGE"), "=": ("JEQ", "JNE")}
+# 0 < x is x > 0
+FLIPPED_RELATION_JUMPS: dict[str, tuple[str, str]] = {
+    "<": ("JGT", "JLE"),
+    "=": ("JEQ", "JNE"),
+}
+
+
+def parameter_location(index: int) -> MemoryLocation:
+    return MemoryLocation("dmem", -1 - index)
+
+
+class IRCodeGenerator(CodeGenerator):
+    # Generates each function's body by lowering it into three-address code
+    # (see ir.py), optimizing that and mapping its virtual registers onto the
+    # general purpose registers with linear scan allocation. Everything around
+    # the bodies (the calling convention, saving registers, memoization and the
+    # peephole optimizer) is shared with the direct code generator.
+    #
+    # A virtual register loaded from a parameter and never written otherwise is
+    # simply reloaded from the parameter's cell wherever it is used when it
+    # doesn't get a register (or is kept across a call, which would cost the
+    # called function a save and restore). Other virtual registers that don't
+    # get one are spilled into the frame's temporaries.
+    def __init__(
+        self,
+        ast: Program,
+        symbol_table: SymbolTable,
+        *,
+        ir_optimizations: bool = True,
+        **options: Any,  # noqa: ANN401
+    ):
+        super().__init__(ast, symbol_table, **options)
+        self._ir_optimizations: bool = ir_optimizations
+        # Details of the function currently being generated
+        self._ir_function: IRFunction = IRFunction("", [], [])
+        self._locations: dict[VirtualRegister, MemoryLocation] = {}
+        self._end_label: str = ""
+
+    def lower(self, definition: Definition) -> IRFunction:
+        function = lower_function(definition, tail_calls=self._tail_calls)
+        if self._ir_optimizations:
+            _ = optimize_function(function)
+        return function
+
+    @override
+    def _generate_body(self, definition: Definition) -> list[TMLine]:
+        self._ir_function = self.lower(definition)
+        self._locations = self._allocate_registers(self._ir_function)
+        self._end_label = f"{self._function_name}: end"
+        code: list[TMLine] = []
+        blocks = self._ir_function.blocks
+        live_out = liveness(self._ir_function)[1]
+        for idx, block in enumerate(blocks):
+            next_label = blocks[idx + 1].label if idx + 1 < len(blocks) else None
+            code.extend(self._generate_block(block, live_out[block.label], next_label))
+        code.append(Label(self._end_label))
+        return code
+
+    def _block_label(self, label: str) -> str:
+        return f"{self._function_name}: {label}"
+
+    def _allocate_registers(
+        self,
+        function: IRFunction,
+    ) -> dict[VirtualRegister, MemoryLocation]:
+        # Each virtual register is live from the first instruction writing it to
+        # the last one reading it in the order the blocks are laid out. Registers
+        # whose intervals don't overlap share a general purpose register, an
+        # interval ending where another starts included (the instruction reads
+        # the first before writing the second). When they run out, the interval
+        # that is cheapest to do without is spilled: one that can be reloaded from
+        # a parameter, otherwise the one ending last.
+        counts = definition_counts(function)
+        reloadable = {
+            instruction.dest: instruction.index
+            for instruction in function.instructions()
+            if isinstance(instruction, LoadParameter) and counts[instruction.dest] == 1
+        }
+        starts, ends, calls = live_intervals(function)
+        locations: dict[VirtualRegister, MemoryLocation] = {}
+        for block in function.blocks:
+            if self._returns_last_value(block):
+                # Computed straight into the return value register
+                dest = block.instructions[-1].dest
+                if dest is not None and counts[dest] == 1:
+                    locations[dest] = MemoryLocation("register", REG_RETURN_VALUE)
+
+        # Parameters used once are simply loaded where they are used
+        uses = use_counts(function)
+        for register, index in reloadable.items():
+            if uses[register] <= 1 or any(
+                starts[register] < call < ends[register] for call in calls
+            ):
+                locations[register] = parameter_location(index)
+
+        def spill(register: VirtualRegister):
+            if register in reloadable:
+                locations[register] = parameter_location(reloadable[register])
+            else:
+                locations[register] = MemoryLocation("dmem", self._allocate_temporary())
+
+        active: list[VirtualRegister] = []
+        free = list(GENERAL_PURPOSE_REGISTERS)
+        for register in sorted(starts, key=lambda register: starts[register]):
+            if register in locations:
+                continue
+            for other in [other for other in active if ends[other] <= starts[register]]:
+                active.remove(other)
+                free.append(locations[other].position)
+            if free:
+                free.sort()
+                locations[register] = MemoryLocation("register", free.pop(0))
+                active.append(register)
+                continue
+            victim = max(
+                [*active, register],
+                key=lambda other: (other in reloadable, ends[other]),
+            )
+            if victim != register:
+                locations[register] = locations[victim]
+                active.remove(victim)
+                active.append(register)
+            spill(victim)
+        return locations
+
+    def _returns_last_value(self, block: BasicBlock) -> bool:
+        # Whether the block returns the value its last instruction computes
+        return (
+            bool(block.instructions)
+            and isinstance(block.terminator, Return)
+            and block.instructions[-1].dest is not None
+            and block.terminator.value == block.instructions[-1].dest
+        )
+
+    def _register_of(self, operand: Operand) -> int | None:
+        # The register already holding the operand, if any
+        if isinstance(operand, int):
+            return REG_ZERO if operand == 0 else None
+        location = self._locations[operand]
+        return location.position if location.location == "register" else None
+
+    def _load(self, operand: Operand, register: int) -> list[TMLine]:
+        if isinstance(operand, int):
+            return [LdcCommand(register, operand)]
+        location = self._locations[operand]
+        if location.location == "register":
+            if location.position == register:
+                return []
+            return [LdaCommand(register, 0, location.position, f"Move {operand}")]
+        if location.position < 0:
+            name = self._ir_function.parameters[-1 - location.position]
+            return [LdCommand(register, location.position, REG_STATUS, f"Load {name}")]
+        return [
+            LdCommand(register, location.position, REG_STATUS, f"Reload {operand}"),
+        ]
+
+    def _store(self, dest: VirtualRegister, register: int) -> list[TMLine]:
+        # Moves a value computed into the register to where dest is kept
+        location = self._locations[dest]
+        if location.location == "register":
+            if location.position == register:
+                return []
+            return [LdaCommand(location.position, 0, register, f"Move into {dest}")]
+        return [StCommand(register, location.position, REG_STATUS, f"Spill {dest}")]
+
+    def _fetch_operands(
+        self,
+        operands: list[Operand],
+        target: int,
+        live: set[VirtualRegister],
+    ) -> tuple[list[TMLine], list[int], list[TMLine]]:
+        # Gets every operand into a register, loading the ones that aren't in one
+        # into the target register (unless it holds another operand), the scratch
+        # register or general purpose registers not holding a live value. When
+        # there are none, one is borrowed by saving it in a temporary. Returns the
+        # code loading the operands, their registers and the code giving back
+        # borrowed registers.
+        occupied = {
+            register
+            for register in map(self._register_of, [*operands, *live])
+            if register is not None
+        }
+        scratch = [
+            register
+            for register in (target, REG_RETURN_VALUE, *GENERAL_PURPOSE_REGISTERS)
+            if register not in occupied
+        ]
+        scratch = list(dict.fromkeys(scratch))
+        code: list[TMLine] = []
+        restore: list[TMLine] = []
+        loaded: dict[Operand, int] = {}
+        registers: list[int] = []
+        for operand in operands:
+            register = self._register_of(operand)
+            if register is None and operand in loaded:
+                register = loaded[operand]
+            if register is None:
+                if scratch:
+                    register = scratch.pop(0)
+                else:
+                    register = next(
+                        register
+                        for register in GENERAL_PURPOSE_REGISTERS
+                        if register not in registers and register != target
+                    )
+                    temporary = self._allocate_temporary()
+                    self._release_temporary()
+                    code.append(
+                        StCommand(register, temporary, REG_STATUS, "Borrow register"),
+                    )
+                    restore.append(
+                        LdCommand(
+                            register,
+                            temporary,
+                            REG_STATUS,
+                            "Give back register",
+                        ),
+                    )
+                code.extend(self._load(operand, register))
+                loaded[operand] = register
+            registers.append(register)
+        return code, registers, restore
+
+    def _target(self, dest: VirtualRegister) -> int:
+        # The register an instruction computes dest into
+        register = self._register_of(dest)
+        return REG_RETURN_VALUE if register is None else register
+
+    def _generate_block(
+        self,
+        block: BasicBlock,
+        live_out: set[VirtualRegister],
+        next_label: str | None,
+    ) -> list[TMLine]:
+        instructions = block.all_instructions()
+        # The virtual registers live after each instruction
+        live_after: list[set[VirtualRegister]] = [set() for _ in instructions]
+        live = set(live_out)
+        for idx in range(len(instructions) - 1, -1, -1):
+            live_after[idx] = set(live)
+            if instructions[idx].dest is not None:
+                live.discard(instructions[idx].dest)
+            live.update(instructions[idx].uses())
+
+        code: list[TMLine] = [Label(self._block_label(block.label))]
+        for instruction, live in zip(instructions, live_after, strict=True):
+            code.append(Comment(str(instruction)))
+            if isinstance(instruction, Terminator):
+                code.extend(self._generate_terminator(instruction, live, next_label))
+            else:
+                code.extend(self._generate_instruction(instruction, live))
+        return code
+
+    def _generate_instruction(
+        self,
+        instruction: IRInstruction,
+        live: set[VirtualRegister],
+    ) -> list[TMLine]:
+        if isinstance(instruction, LoadParameter):
+            if self._register_of(instruction.dest) is None:
+                # Reloaded from the parameter wherever it is used
+                return []
+            return [
+                LdCommand(
+                    self._target(instruction.dest),
+                    -1 - instruction.index,
+                    REG_STATUS,
+                    f"Load {instruction.name}",
+                ),
+            ]
+        if isinstance(instruction, Copy):
+            target = self._target(instruction.dest)
+            return [
+                *self._load(instruction.source, target),
+                *self._store(instruction.dest, target),
+            ]
+        if isinstance(instruction, BinaryOperation):
+            return self._generate_operation(instruction, live)
+        if isinstance(instruction, Call):
+            return self._generate_call(instruction, live)
+        raise CodeGenerationError(
+            f"Generating code for {instruction.__class__.__name__} is not yet implemented",
+        )
+
+    def _generate_terminator(
+        self,
+        instruction: Terminator,
+        live: set[VirtualRegister],
+        next_label: str | None,
+    ) -> list[TMLine]:
+        if isinstance(instruction, Jump):
+            if instruction.target == next_label:
+                return []
+            return [self._jump(instruction.target)]
+        if isinstance(instruction, Branch):
+            return self._generate_branch(instruction, live, next_label)
+        if isinstance(instruction, Return):
+            code = self._load(instruction.value, REG_RETURN_VALUE)
+            if next_label is not None:
+                code.append(
+                    LabelReference("LDA", REG_PC, self._end_label, REG_PC, "Return"),
+                )
+            return code
+        if isinstance(instruction, TailCall):
+            return self._generate_ir_tail_call(instruction)
+        raise CodeGenerationError(
+            f"Generating code for {instruction.__class__.__name__} is not yet implemented",
+        )
+
+    def _jump(self, label: str) -> LabelReference:
+        return LabelReference("LDA", REG_PC, self._block_label(label), REG_PC, "Jump")
+
+    def _generate_operation(
+        self,
+        instruction: BinaryOperation,
+        live: set[VirtualRegister],
+    ) -> list[TMLine]:
+        target = self._target(instruction.dest)
+        live = live - {instruction.dest}
+        operator = instruction.operator
+        left_operand, right_operand = instruction.left, instruction.right
+        if operator == "+" and isinstance(left_operand, int):
+            left_operand, right_operand = right_operand, left_operand
+        if operator in ("+", "-") and isinstance(right_operand, int):
+            # Adding a constant is an address computation
+            code, (left,), restore = self._fetch_operands([left_operand], target, live)
+            offset = right_operand if operator == "+" else -right_operand
+            return [
+                *code,
+                LdaCommand(target, offset, left),
+                *restore,
+                *self._store(instruction.dest, target),
+            ]
+        code, (left, right), restore = self._fetch_operands(
+            [left_operand, right_operand],
+            target,
+            live,
+        )
+        if operator in ARITHMETIC_COMMANDS:
+            code.append(ARITHMETIC_COMMANDS[operator](target, left, right))
+        else:
+            # Booleans are represented as 0 (false) and 1 (true)
+            jump = JltCommand if operator == "<" else JeqCommand
+            code.extend(
+                [
+                    SubCommand(target, left, right),
+                    jump(target, 2, REG_PC),
+                    LdcCommand(target, 0, "False"),
+                    LdaCommand(REG_PC, 1, REG_PC),
+                    LdcCommand(target, 1, "True"),
+                ],
+            )
+        return [*code, *restore, *self._store(instruction.dest, target)]
+
+    def _generate_call(
+        self,
+        instruction: Call,
+        live: set[VirtualRegister],
+    ) -> list[TMLine]:
+        function_name = instruction.function
+        param_count = len(instruction.arguments)
+        if param_count != self._get_parameter_count(function_name):
+            raise CodeGenerationError(
+                f"Wrong number of arguments passed to {function_name}",
+            )
+        # The registers holding values needed after the call
+        held = {
+            register
+            for register in map(self._register_of, live - {instruction.dest})
+            if register is not None
+        }
+        callers = self._held_registers.setdefault(function_name, {})
+        callers.setdefault(self._function_name, set()).update(held)
+
+        code: list[TMLine] = [Comment(f"Calling {function_name}")]
+        for idx, argument in enumerate(instruction.arguments):
+            register = self._register_of(argument)
+            if register is None:
+                register = REG_RETURN_VALUE
+                code.extend(self._load(argument, register))
+            code.append(
+                StCommand(
+                    register,
+                    param_count - idx,
+                    REG_TOP,
+                    f"Store argument {idx + 1}",
+                ),
+            )
+        code.extend(self._calling_sequence_calling_fn(function_name, param_count))
+        code.append(Comment(f"Returning from {function_name}"))
+        if instruction.dest is not None:
+            code.extend(self._store(instruction.dest, REG_RETURN_VALUE))
+        return code
+
+    def _generate_branch(
+        self,
+        branch: Branch,
+        live: set[VirtualRegister],
+        next_label: str | None,
+    ) -> list[TMLine]:
+        # Jumps on the difference of the operands, which is the other operand
+        # when one of them is 0 and an address computation when one is a
+        # constant. Whichever target comes next is fallen through to.
+        jumps = RELATION_JUMPS[branch.relation]
+        left, right = branch.left, branch.right
+        if isinstance(left, int) and not isinstance(right, int):
+            # c < x is x - c > 0
+            left, right = right, left
+            jumps = FLIPPED_RELATION_JUMPS[branch.relation]
+        if isinstance(right, int):
+            code, (tested,), _ = self._fetch_operands([left], REG_RETURN_VALUE, live)
+            if right != 0:
+                code.append(LdaCommand(REG_RETURN_VALUE, -right, tested))
+                tested = REG_RETURN_VALUE
+        else:
+            tested = REG_RETURN_VALUE
+            code, (left_register, right_register), restore = self._fetch_operands(
+                [left, right],
+                tested,
+                live,
+            )
+            code.extend([SubCommand(tested, left_register, right_register), *restore])
+        if branch.true_target == next_label:
+            return [
+                *code,
+                LabelReference(
+                    jumps[1],
+                    tested,
+                    self._block_label(branch.false_target),
+                    REG_PC,
+                    "Jump if false",
+                ),
+            ]
+        code.append(
+            LabelReference(
+                jumps[0],
+                tested,
+                self._block_label(branch.true_target),
+                REG_PC,
+                "Jump if true",
+            ),
+        )
+        if branch.false_target != next_label:
+            code.append(self._jump(branch.false_target))
+        return code
+
+    def _generate_ir_tail_call(self, tail_call: TailCall) -> list[TMLine]:
+        # The new arguments overwrite the current ones and the body starts over.
+        # Parameters passed along unchanged aren't stored, and arguments reloaded
+        # from a parameter that is overwritten are loaded before any is stored.
+        changed = {
+            idx: argument
+            for idx, argument in enumerate(tail_call.arguments)
+            if not (
+                isinstance(argument, VirtualRegister)
+                and self._locations[argument] == parameter_location(idx)
+            )
+        }
+        overwritten = [parameter_location(idx) for idx in changed]
+        in_registers = set(map(self._register_of, tail_call.arguments))
+        free = [
+            register
+            for register in GENERAL_PURPOSE_REGISTERS
+            if register not in in_registers
+        ]
+        code: list[TMLine] = [Comment(f"Tail call to {self._function_name}")]
+        early: dict[int, MemoryLocation] = {}
+        temporaries = 0
+        for idx, argument in changed.items():
+            if (
+                isinstance(argument, VirtualRegister)
+                and self._locations[argument] in overwritten
+            ):
+                if free:
+                    early[idx] = MemoryLocation("register", free.pop(0))
+                    code.extend(self._load(argument, early[idx].position))
+                else:
+                    early[idx] = MemoryLocation("dmem", self._allocate_temporary())
+                    temporaries += 1
+                    code.extend(
+                        [
+                            *self._load(argument, REG_RETURN_VALUE),
+                            StCommand(
+                                REG_RETURN_VALUE,
+                                early[idx].position,
+                                REG_STATUS,
+                            ),
+                        ],
+                    )
+        for idx, argument in changed.items():
+            location = early.get(idx)
+            if location is not None and location.location == "register":
+                register = location.position
+            elif location is not None:
+                register = REG_RETURN_VALUE
+                code.append(LdCommand(register, location.position, REG_STATUS))
+            else:
+                register = self._register_of(argument)
+                if register is None:
+                    register = REG_RETURN_VALUE
+                    code.extend(self._load(argument, register))
+            code.append(
+                StCommand(register, -1 - idx, REG_STATUS, f"Store argument {idx + 1}"),
+            )
+        for _ in range(temporaries):
+            self._release_temporary()
+        code.append(
+            LabelReference(
+                "LDC",
+                REG_PC,
+                body_label(self._function_name),
+                comment=f"Jump to the body of {self._function_name}",
+            ),
+        )
+        return code
+
+
+CODE_GENERATOR_BACKENDS: dict[str, type[CodeGenerator]] = {
+    "direct": CodeGenerator,
+    "ir": IRCodeGenerator,
+}
@@ -1,11 +1,12 @@
 from typing_extensions import override
 
-from compiler.position import Position
+from compiler.position import LineIndex, Position
 from compiler.util import insert_newlines
 
 
 class KleinError(Exception):
-    def format_line_position(self, original_line: str, position: Position) -> str:
+    def format_line_position(self, line_index: LineIndex, position: Position) -> str:
+        original_line = line_index.get_line(position.get_line_number() - 1)
         # This method is a bit too complex, but it essentially adds the line number
         # and then spaces for subsequent lines. Then, it prints a carrot indicating
         # the position (in this new wrapped string) where the error occured
@@ -60,19 +61,20 @@ class ParseError(KleinError):
         self,
         cause: str,
         position: Position | None = None,
-        original_line: str | None = None,
+        line_index: LineIndex | None = None,
         *args: object,
     ) -> None:
         self._message: str = cause
         self._position: Position | None = position
-        self._original_line: str | None = original_line
+        # The offending line is only looked up when the error is rendered
+        self._line_index: LineIndex | None = line_index
         super().__init__(*args)
 
     @override
     def __str__(self) -> str:
-        if self._original_line is not None and self._position is not None:
+        if self._line_index is not None and self._position is not None:
             line_information = (
-                f"\n{self.format_line_position(self._original_line, self._position)}"
+                f"\n{self.format_line_position(self._line_index, self._position)}"
             )
         else:
             line_information = ""
@@ -103,3 +105,27 @@ class CodeGenerationError(KleinError):
         return insert_newlines(
             f"Klein Code Generation Error: {self._message}",
         )
+
+
+class GrammarError(KleinError):
+    def __init__(self, message: str):
+        super().__init__()
+        self._message: str = message
+
+    @override
+    def __str__(self) -> str:
+        return insert_newlines(
+            f"Klein Grammar Error: {self._message}",
+        )
+
+
+class TMError(KleinError):
+    def __init__(self, message: str):
+        super().__init__()
+        self._message: str = message
+
+    @override
+    def __str__(self) -> str:
+        return insert_newlines(
+            f"TM Error: {self._message}",
+        )
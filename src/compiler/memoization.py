@@ -0,0 +1,93 @@
+from collections.abc import Iterator
+
+from compiler.ast_nodes import (
+    BinaryExpression,
+    Expression,
+    FunctionAnnotation,
+    FunctionCallExpression,
+    IfExpression,
+    Program,
+    UnaryExpression,
+)
+from compiler.symbol_table import SymbolTable
+
+
+def pure_functions(symbol_table: SymbolTable) -> set[str]:
+    # The functions that can't end up printing: the ones that don't call print,
+    # or any function that can end up printing
+    functions = {
+        symbol.name: symbol.forward_references
+        for symbol in symbol_table
+        if isinstance(symbol.symbol_type, FunctionAnnotation)
+    }
+    impure = {"print"}
+    changed = True
+    while changed:
+        changed = False
+        for name, called in functions.items():
+            if name not in impure and called & impure:
+                impure.add(name)
+                changed = True
+    return set(functions) - impure
+
+
+def reaches(symbol_table: SymbolTable, start: str, target: str) -> bool:
+    # Whether calling start can end up calling target (or start is target)
+    pending = [start]
+    seen = {start}
+    while pending:
+        name = pending.pop()
+        if name == target:
+            return True
+        symbol = symbol_table.scope_lookup(name)
+        if symbol is None:
+            continue
+        for called in symbol.forward_references - seen:
+            seen.add(called)
+            pending.append(called)
+    return False
+
+
+def frame_building_calls(
+    expression: Expression,
+    name: str,
+    tail: bool = True,  # noqa: FBT001, FBT002
+) -> Iterator[str]:
+    # The functions the function called name calls, except for the calls to
+    # itself whose value it returns (which reuse its frame)
+    if isinstance(expression, FunctionCallExpression):
+        called = expression.function_name.value
+        if not (tail and called == name):
+            yield called
+        for argument in expression.argument_list.arguments:
+            yield from frame_building_calls(argument.value, name, False)  # noqa: FBT003
+    elif isinstance(expression, IfExpression):
+        yield from frame_building_calls(expression.condition, name, False)  # noqa: FBT003
+        yield from frame_building_calls(expression.consequent, name, tail)
+        yield from frame_building_calls(expression.alternative, name, tail)
+    elif isinstance(expression, BinaryExpression):
+        yield from frame_building_calls(expression.left_side, name, False)  # noqa: FBT003
+        yield from frame_building_calls(expression.right_side, name, False)  # noqa: FBT003
+    elif isinstance(expression, UnaryExpression):
+        yield from frame_building_calls(expression.value, name, False)  # noqa: FBT003
+
+
+def memoized_functions(program: Program, symbol_table: SymbolTable) -> set[str]:
+    # Pure functions that call themselves (directly or through other functions)
+    # other than by returning the value of a call to themselves. Those are the
+    # ones whose calls can branch out into calls with the same arguments, like
+    # fib(n - 1) + fib(n - 2). Functions that only loop through tail calls are
+    # left alone, since their result would be cached under the arguments of the
+    # last iteration only. main is only called once.
+    pure = pure_functions(symbol_table)
+    memoized: set[str] = set()
+    for definition in program.definition_list:
+        name = definition.name.value
+        if name == "main" or name not in pure:
+            continue
+        if any(
+            reaches(symbol_table, called, name)
+            for called in frame_building_calls(definition.body.body, name)
+        ):
+            memoized.add(name)
+    return memoized
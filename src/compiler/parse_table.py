@@ -1,42 +1,16 @@
+import hashlib
 import os
-from enum import StrEnum, auto
+import pickle
+import sys
+from functools import cache
 from io import TextIOWrapper
 
-from typing_extensions import override
-
+from compiler import grammar
 from compiler.ast_nodes import SemanticAction
+from compiler.grammar import NonTerminal, generate_parse_table_from_grammar
 from compiler.tokens import TokenType
 
 
-class NonTerminal(StrEnum):
-    PROGRAM = auto()
-    DEFINITION_LIST = auto()
-    DEFINITION = auto()
-    PARAMETER_LIST = auto()
-    FORMAL_PARAMETERS = auto()
-    FORMAL_PARAMETERS_REST = auto()
-    ID_WITH_TYPE = auto()
-    TYPE = auto()
-    BODY = auto()
-    PRINT_EXPRESSION = auto()
-    EXPRESSION = auto()
-    EXPRESSION_REST = auto()
-    SIMPLE_EXPRESSION = auto()
-    SIMPLE_EXPRESSION_REST = auto()
-    TERM = auto()
-    TERM_REST = auto()
-    FACTOR = auto()
-    FACTOR_REST = auto()
-    ARGUMENT_LIST = auto()
-    FORMAL_ARGUMENTS = auto()
-    FORMAL_ARGUMENTS_REST = auto()
-    LITERAL = auto()
-
-    @override
-    def __str__(self):
-        return self.name.upper()
-
-
 def clean_csv_file(csvfile: TextIOWrapper) -> list[list[str]]:
     table: list[list[str]] = []
     for raw_row in csvfile:
@@ -95,9 +69,110 @@ def process_table_into_parsetable(table: list[list[str]]):
 
 
 def generate_parse_table(filename: str):
+    # Tables are either generated from a grammar or read from a (hand made) csv
+    if not filename.endswith(".csv"):
+        return generate_parse_table_from_grammar(filename)
     csvtable: list[list[str]] = read_csv_to_table(filename)
     return process_table_into_parsetable(csvtable)
 
 
+def parse_table_cache_path(filename: str) -> str:
+    # The cached table is keyed on the contents of the table's source (and the
+    # python version, since pickles of enums are only guaranteed to load on the
+    # same version), so editing the CSV or grammar automatically invalidates it.
+    file_dir = os.path.dirname(__file__)
+    sources = [os.path.join(file_dir, filename)]
+    if not filename.endswith(".csv"):
+        # Tables generated from a grammar also depend on the generator
+        sources.append(grammar.__file__)
+    digest = hashlib.sha256()
+    for source in sources:
+        with open(source, "rb") as source_file:
+            digest.update(source_file.read())
+    name, _ = os.path.splitext(filename)
+    return os.path.join(
+        file_dir,
+        "__pycache__",
+        f"{name}.{sys.implementation.cache_tag}.{digest.hexdigest()[:16]}.pickle",
+    )
+
+
+@cache
+def load_parse_table(filename: str):
+    # Same as generate_parse_table, but the table is only built once per
+    # process and is stored next to the bytecode between runs. The returned
+    # table is shared, so callers must not modify it.
+    cache_path = parse_table_cache_path(filename)
+    try:
+        with open(cache_path, "rb") as cachefile:
+            parse_table: dict[
+                tuple[NonTerminal, TokenType],
+                list[NonTerminal | TokenType | SemanticAction],
+            ] = pickle.load(cachefile)  # noqa: S301
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+        parse_table = generate_parse_table(filename)
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            # Written under a temporary name so that concurrent compilers never
+            # load a partially written table
+            temporary_path = f"{cache_path}.{os.getpid()}"
+            with open(temporary_path, "wb") as cachefile:
+                pickle.dump(parse_table, cachefile, pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary_path, cache_path)
+        except OSError:
+            # Caching is only an optimization, a read-only install still works
+            pass
+    return parse_table
+
+
+# The parser's stack holds grammar symbols interned as tagged ints: terminals come
+# first, then nonterminals, then semantic actions. This way the parser can tell
+# what kind of symbol it popped with a comparison instead of an isinstance check.
+TERMINALS: tuple[TokenType, ...] = tuple(TokenType)
+NONTERMINALS: tuple[NonTerminal, ...] = tuple(NonTerminal)
+SEMANTIC_ACTIONS: tuple[SemanticAction, ...] = tuple(SemanticAction)
+NONTERMINAL_BASE = len(TERMINALS)
+SEMANTIC_ACTION_BASE = NONTERMINAL_BASE + len(NONTERMINALS)
+
+TERMINAL_CODES: dict[TokenType, int] = {
+    terminal: code for code, terminal in enumerate(TERMINALS)
+}
+
+
+def intern_symbol(symbol: NonTerminal | TokenType | SemanticAction) -> int:
+    # Each StrEnum is checked separately since members of different enums with the
+    # same value would compare (and hash) equal
+    if isinstance(symbol, TokenType):
+        return TERMINAL_CODES[symbol]
+    if isinstance(symbol, NonTerminal):
+        return NONTERMINAL_BASE + NONTERMINALS.index(symbol)
+    return SEMANTIC_ACTION_BASE + SEMANTIC_ACTIONS.index(symbol)
+
+
+def densify_parse_table(
+    parse_table: dict[
+        tuple[NonTerminal, TokenType],
+        list[NonTerminal | TokenType | SemanticAction],
+    ],
+) -> list[list[tuple[int, ...] | None]]:
+    # Indexed by [nonterminal code - NONTERMINAL_BASE][terminal code]. Rules are
+    # stored already reversed so they can be pushed straight onto the stack, and
+    # missing entries are None.
+    dense_table: list[list[tuple[int, ...] | None]] = [
+        [None] * len(TERMINALS) for _ in NONTERMINALS
+    ]
+    for (nonterminal, terminal), rule in parse_table.items():
+        row = intern_symbol(nonterminal) - NONTERMINAL_BASE
+        dense_table[row][TERMINAL_CODES[terminal]] = tuple(
+            intern_symbol(symbol) for symbol in reversed(rule)
+        )
+    return dense_table
+
+
+@cache
+def load_dense_parse_table(filename: str):
+    return densify_parse_table(load_parse_table(filename))
+
+
 if __name__ == "__main__":
     print(generate_parse_table("parse-table.csv"))
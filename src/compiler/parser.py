@@ -5,18 +5,41 @@ from compiler.ast_nodes import (
     action_to_astnode,
 )
 from compiler.klein_errors import ParseError
-from compiler.parse_table import NonTerminal, generate_parse_table
+from compiler.parse_table import (
+    NONTERMINAL_BASE,
+    NONTERMINALS,
+    SEMANTIC_ACTION_BASE,
+    SEMANTIC_ACTIONS,
+    TERMINAL_CODES,
+    TERMINALS,
+    NonTerminal,
+    intern_symbol,
+    load_dense_parse_table,
+    load_parse_table,
+)
 from compiler.scanner import Scanner, tokentype_to_str
 from compiler.tokens import Token, TokenType
 
+# Indexed by semantic action code - SEMANTIC_ACTION_BASE
+SEMANTIC_ACTION_BUILDERS = tuple(
+    action_to_astnode[action] for action in SEMANTIC_ACTIONS
+)
+
 
 class Parser:
-    def __init__(self, scanner: Scanner, parse_table_filename: str = "parse-table.csv"):
+    def __init__(
+        self,
+        scanner: Scanner,
+        parse_table_filename: str = "refactored-grammar.txt",
+    ):
         self._scanner: Scanner = scanner
         self._parse_table: dict[
             tuple[NonTerminal, TokenType],
             list[NonTerminal | TokenType | SemanticAction],
-        ] = generate_parse_table(parse_table_filename)
+        ] = load_parse_table(parse_table_filename)
+        self._dense_parse_table: list[list[tuple[int, ...] | None]] = (
+            load_dense_parse_table(parse_table_filename)
+        )
 
     def _generate_expected_options(
         self,
@@ -35,68 +58,81 @@ class Parser:
             )
         return expected_message
 
+    def unexpected_token_error(
+        self,
+        expected: TokenType,
+        received: Token,
+    ) -> ParseError:
+        # Public, like invalid_transition_error, since the generated recursive
+        # descent parser raises the same errors as this one
+        return ParseError(
+            f"Expected {tokentype_to_str(expected)} and received {tokentype_to_str(received.token_type)}",
+            position=received.position,
+            line_index=self._scanner.line_index,
+        )
+
+    def invalid_transition_error(
+        self,
+        nonterminal: NonTerminal,
+        received: Token,
+    ) -> ParseError:
+        # Find all could-be tokens to let the user know what might have been
+        # expected and report those.
+        expected_message: str = self._generate_expected_options(nonterminal)
+        to_display = tokentype_to_str(received.token_type)
+        return ParseError(
+            f"Invalid transition from {nonterminal} to {to_display}.\n{expected_message}",
+            position=received.position,
+            line_index=self._scanner.line_index,
+        )
+
     def parse(self) -> Program:
-        stack: list[NonTerminal | TokenType | SemanticAction] = [
-            TokenType.END_OF_FILE,
-            NonTerminal.PROGRAM,
+        # Local names keep attribute lookups out of the hot loop
+        scanner = self._scanner
+        dense_table = self._dense_parse_table
+        stack: list[int] = [
+            TERMINAL_CODES[TokenType.END_OF_FILE],
+            intern_symbol(NonTerminal.PROGRAM),
         ]
         semantic_stack: SemanticStack = SemanticStack()
         most_recent_token: Token | None = None
 
-        while len(stack) > 0:
-            next_stack_item: NonTerminal | TokenType | SemanticAction = stack.pop()
-            if isinstance(next_stack_item, TokenType):
+        while stack:
+            code = stack.pop()
+            if code < NONTERMINAL_BASE:
                 # next stack item is a token, so pop the next token and check if
                 # it equals the next scanner value if so, continue
                 # otherwise, raise a parse error
-                next_token = self._scanner.next()
+                next_token = scanner.next()
                 most_recent_token = next_token
-                if next_stack_item != next_token.token_type:
-                    raise ParseError(
-                        f"Expected {tokentype_to_str(next_stack_item)} and received {tokentype_to_str(next_token.token_type)}",
-                        position=next_token.position,
-                        original_line=self._scanner.get_line(
-                            next_token.position.get_line_number() - 1,
-                        ),
-                    )
-            elif isinstance(next_stack_item, NonTerminal):
+                if next_token.token_type is not TERMINALS[code]:
+                    raise self.unexpected_token_error(TERMINALS[code], next_token)
+            elif code < SEMANTIC_ACTION_BASE:
                 # Know we know a is a NonTerminal
-                next_token = self._scanner.peek()
+                next_token = scanner.peek()
                 most_recent_token = next_token
-                key = (next_stack_item, next_token.token_type)
-                if key in self._parse_table:
+                rule = dense_table[code - NONTERMINAL_BASE][
+                    TERMINAL_CODES[next_token.token_type]
+                ]
+                if rule is not None:
                     # If we have a rule, add theh tokens/nonterminals onto the stack
-                    # in reverse order
-                    rule = self._parse_table[(next_stack_item, next_token.token_type)]
-                    stack.extend(reversed(rule))
+                    # (the rules are already stored in reverse order)
+                    stack.extend(rule)
                 else:
-                    # Otherwise, find all could-be tokens to let the user know what
-                    # might have been expected and report those.
-                    expected_message: str = self._generate_expected_options(
-                        next_stack_item,
-                    )
-                    from_display = (
-                        tokentype_to_str(key[0])
-                        if isinstance(key[0], TokenType)
-                        else str(key[0])
-                    )
-                    to_display = tokentype_to_str(key[1])
-                    raise ParseError(
-                        f"Invalid transition from {from_display} to {to_display}.\n{expected_message}",
-                        position=next_token.position,
-                        original_line=self._scanner.get_line(
-                            next_token.position.get_line_number() - 1,
-                        ),
+                    raise self.invalid_transition_error(
+                        NONTERMINALS[code - NONTERMINAL_BASE],
+                        next_token,
                     )
-            elif isinstance(next_stack_item, SemanticAction):  # pyright: ignore[reportUnnecessaryIsInstance]
-                action = action_to_astnode[next_stack_item]
-                astnode = action(semantic_stack, most_recent_token)
-                semantic_stack.push(astnode)
             else:
-                raise ParseError(  # pyright: ignore[reportUnreachable]
-                    f"Unexpected value on stack: Received {next_stack_item} of type {next_stack_item.__class__.__name__}",
+                astnode = SEMANTIC_ACTION_BUILDERS[code - SEMANTIC_ACTION_BASE](
+                    semantic_stack,
+                    most_recent_token,
                 )
+                semantic_stack.push(astnode)
+
+        return self._finish(semantic_stack)
 
+    def _finish(self, semantic_stack: SemanticStack) -> Program:
         if len(semantic_stack) != 1:
             raise ParseError(
                 f"Expected 1 value in semantic stack when done parsing. Instead encountered {len(semantic_stack)} items: {semantic_stack}",
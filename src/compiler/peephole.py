@@ -0,0 +1,451 @@
+from collections.abc import Iterable
+
+from compiler.tm import (
+    FUNCTION_MARKER,
+    Comment,
+    LdaCommand,
+    RMCommand,
+    ROCommand,
+    TMCommand,
+    TMLine,
+)
+
+REG_ZERO = 0
+REG_RETURN_VALUE = 4
+REG_STATUS = 5
+REG_TOP = 6
+REG_PC = 7
+# Registers a called function saves on entry (at the same offset from the status
+# pointer as their number) and restores before returning
+SAVED_REGISTERS = (1, 2, 3)
+
+RO_COMMANDS = frozenset(("HALT", "IN", "OUT", "ADD", "SUB", "MUL", "DIV"))
+CONDITIONAL_JUMPS = frozenset(("JLT", "JLE", "JEQ", "JNE", "JGE", "JGT"))
+# Commands that only write a register and can't fail, so they can be left out
+# when nothing reads the register
+REMOVABLE_COMMANDS = frozenset(("LDC", "LDA", "LD", "ADD", "SUB", "MUL"))
+
+
+def register_set(*registers: int) -> int:
+    # Sets of registers are bit masks. R0 always holds 0 and R7 is handled by
+    # following the jumps, so neither is ever part of a set.
+    mask = 0
+    for register in registers:
+        if register not in (REG_ZERO, REG_PC):
+            mask |= 1 << register
+    return mask
+
+
+# Registers a returning function hands back to its caller. The caller only reads
+# the general purpose registers it held values in during the call, which the
+# function either restores before returning or never writes, and rewriting the
+# function never makes it write a register it didn't write before.
+LIVE_ON_RETURN = register_set(REG_RETURN_VALUE, REG_STATUS, REG_TOP)
+# A call reads the new frame's status and top pointers. It only counts as writing
+# the return value register, since the general purpose registers it may change
+# are the ones the caller doesn't read again before writing them.
+CALL_USES = register_set(REG_STATUS, REG_TOP)
+CALL_DEFINES = register_set(REG_RETURN_VALUE)
+
+
+def uses(command: TMCommand) -> int:
+    r, s, t = command.operands
+    if command.command in ("ADD", "SUB", "MUL", "DIV"):
+        return register_set(s, t)
+    if command.command == "OUT":
+        return register_set(r)
+    if command.command in ("LDA", "LD"):
+        return register_set(t)
+    if command.command == "ST" or command.command in CONDITIONAL_JUMPS:
+        return register_set(r, t)
+    return 0
+
+
+def defines(command: TMCommand) -> int:
+    if command.command in ("ADD", "SUB", "MUL", "DIV", "IN", "LDC", "LDA", "LD"):
+        return register_set(command.operands[0])
+    return 0
+
+
+def is_save_or_restore(command: TMCommand) -> bool:
+    r, s, t = command.operands
+    return (
+        command.command in ("ST", "LD")
+        and r in SAVED_REGISTERS
+        and s == r
+        and t == REG_STATUS
+    )
+
+
+def is_move(command: TMCommand) -> bool:
+    # LDA r,0(s) copies s into r and LDC r,0 copies R0 into r
+    r, s, t = command.operands
+    if r == REG_PC:
+        return False
+    if command.command == "LDA":
+        return s == 0 and t != REG_PC
+    return command.command == "LDC" and s == 0
+
+
+def move_source(command: TMCommand) -> int:
+    return command.operands[2] if command.command == "LDA" else REG_ZERO
+
+
+def with_operands(command: TMCommand, operands: tuple[int, int, int]) -> TMCommand:
+    if command.command in RO_COMMANDS:
+        return ROCommand(command.command, *operands, command.comment)
+    return RMCommand(command.command, *operands, command.comment)
+
+
+def replace_reads(command: TMCommand, register: int, replacement: int) -> TMCommand:
+    # The register is replaced wherever the command reads it (the first operand
+    # of most commands is written instead)
+    r, s, t = command.operands
+    if command.command in ("ADD", "SUB", "MUL", "DIV"):
+        return with_operands(
+            command,
+            (
+                r,
+                replacement if s == register else s,
+                replacement if t == register else t,
+            ),
+        )
+    if command.command in {"OUT", "ST"} or command.command in CONDITIONAL_JUMPS:
+        r = replacement if r == register else r
+    if command.command in ("LDA", "LD", "ST") or command.command in CONDITIONAL_JUMPS:
+        t = replacement if t == register else t
+    return with_operands(command, (r, s, t))
+
+
+class PeepholeOptimizer:
+    # Rewrites short sequences of generated tm code into cheaper equivalents.
+    #
+    # Jumps are tracked by the index of the command they lead to rather than by
+    # their offsets, so commands can be removed without breaking them. That covers
+    # relative jumps (and return addresses) computed from the program counter and
+    # absolute jumps to functions. The offsets are filled in again at the end.
+    #
+    # Every round works out which commands can follow each other and which
+    # registers are read later on, applies every rewrite that doesn't overlap
+    # another one, and removes the commands that were left out. Rounds are
+    # repeated until nothing changes.
+    def __init__(self, lines: Iterable[TMLine]):
+        self._lines: list[TMLine] = list(lines)
+        self._commands: list[TMCommand] = []
+        self._targets: list[int | None] = []
+        for line in self._lines:
+            if isinstance(line, TMCommand):
+                self._targets.append(self._target(line, len(self._commands)))
+                self._commands.append(line)
+        self._successors: list[list[int]] = []
+        self._live_out: list[int] = []
+        self._predecessor_count: list[int] = []
+        self._calls: set[int] = set()
+        self._entries: set[int] = set()
+        self._removed: set[int] = set()
+        self._replaced: dict[int, TMCommand] = {}
+
+    @staticmethod
+    def _target(command: TMCommand, idx: int) -> int | None:
+        r, s, t = command.operands
+        if t == REG_PC and (
+            command.command == "LDA" or command.command in CONDITIONAL_JUMPS
+        ):
+            return idx + 1 + s
+        if command.command == "LDC" and r == REG_PC:
+            return s
+        return None
+
+    def optimize(self) -> list[TMLine]:
+        while True:
+            self._analyze()
+            self._remove_unreachable()
+            for idx in range(len(self._commands)):
+                if not self._touched(idx):
+                    self._rewrite(idx)
+            self._remove_unused_saved_registers()
+            self._thread_jumps()
+            if not self._removed and not self._replaced:
+                break
+            self._compact()
+        return self._finish()
+
+    def _analyze(self):
+        count = len(self._commands)
+        self._removed = set()
+        self._replaced = {}
+        # A command jumping to a function is a call when the instruction after it
+        # is used as a return address
+        return_addresses = {
+            target
+            for command, target in zip(self._commands, self._targets, strict=True)
+            if target is not None
+            and command.command == "LDA"
+            and command.operands[0] != REG_PC
+        }
+        self._calls = {
+            idx
+            for idx, command in enumerate(self._commands)
+            if command.command == "LDC"
+            and command.operands[0] == REG_PC
+            and idx + 1 in return_addresses
+        }
+        # Functions start at the first command after their marker
+        self._entries = {0}
+        command_count = 0
+        for line in self._lines:
+            if isinstance(line, TMCommand):
+                command_count += 1
+            elif isinstance(line, Comment) and line.text.startswith(FUNCTION_MARKER):
+                self._entries.add(command_count)
+
+        self._successors = [self._successors_of(idx) for idx in range(count)]
+        self._predecessor_count = [0] * count
+        for successors in self._successors:
+            for successor in successors:
+                self._predecessor_count[successor] += 1
+
+        # Registers whose value is read later, worked out backwards until nothing
+        # changes
+        used = [uses(command) for command in self._commands]
+        defined = [defines(command) for command in self._commands]
+        for idx in self._calls:
+            used[idx] = CALL_USES
+            defined[idx] = CALL_DEFINES
+        returns = [
+            command.command == "LD" and command.operands[0] == REG_PC
+            for command in self._commands
+        ]
+        self._live_out = [0] * count
+        live_in = [0] * count
+        changed = True
+        while changed:
+            changed = False
+            for idx in range(count - 1, -1, -1):
+                if returns[idx]:
+                    live_out = LIVE_ON_RETURN
+                else:
+                    live_out = 0
+                    for successor in self._successors[idx]:
+                        live_out |= live_in[successor]
+                new_live_in = used[idx] | (live_out & ~defined[idx])
+                self._live_out[idx] = live_out
+                if new_live_in != live_in[idx]:
+                    live_in[idx] = new_live_in
+                    changed = True
+
+    def _successors_of(self, idx: int) -> list[int]:
+        command = self._commands[idx]
+        target = self._targets[idx]
+        r = command.operands[0]
+        following = [idx + 1] if idx + 1 < len(self._commands) else []
+        if command.command == "HALT" or (command.command == "LD" and r == REG_PC):
+            return []
+        if command.command == "LDC" and r == REG_PC:
+            return following if idx in self._calls else [target or 0]
+        if command.command == "LDA" and r == REG_PC:
+            return [target or 0]
+        if command.command in CONDITIONAL_JUMPS and target is not None:
+            return [*following, target]
+        return following
+
+    def _has_single_predecessor(self, idx: int) -> bool:
+        # Whether the command can only be reached from the command before it
+        return (
+            idx not in self._entries
+            and self._predecessor_count[idx] == 1
+            and idx in self._successors[idx - 1]
+        )
+
+    def _remove_unreachable(self):
+        reachable: set[int] = set()
+        pending = list(self._entries)
+        while pending:
+            idx = pending.pop()
+            if idx in reachable or idx >= len(self._commands):
+                continue
+            reachable.add(idx)
+            pending.extend(self._successors[idx])
+        self._removed.update(
+            idx for idx in range(len(self._commands)) if idx not in reachable
+        )
+
+    def _remove_unused_saved_registers(self):
+        # A function only has to save and restore the registers it changes (the
+        # functions it calls save their own)
+        entries = sorted(self._entries - {0})
+        ends = [*entries[1:], len(self._commands)]
+        for start, end in zip(entries, ends[: len(entries)], strict=True):
+            saves_and_restores: dict[int, list[int]] = {
+                register: [] for register in SAVED_REGISTERS
+            }
+            written = 0
+            for idx in range(start, end):
+                command = self._commands[idx]
+                if is_save_or_restore(command):
+                    saves_and_restores[command.operands[0]].append(idx)
+                elif idx not in self._removed:
+                    written |= defines(self._replaced.get(idx, command))
+            for register, indices in saves_and_restores.items():
+                if not written & register_set(register):
+                    self._removed.update(indices)
+
+    def _touched(self, *indices: int) -> bool:
+        return any(idx in self._removed or idx in self._replaced for idx in indices)
+
+    def _rewrite(self, idx: int):
+        command = self._commands[idx]
+        r, s, t = command.operands
+        # Registers are restored for the caller, which is left out of the
+        # registers read after returning
+        if is_save_or_restore(command):
+            return
+        following = idx + 1
+        next_command = (
+            self._commands[following] if following < len(self._commands) else None
+        )
+
+        # Jumps to the next command
+        if self._targets[idx] == following and (
+            command.command in CONDITIONAL_JUMPS
+            or (r == REG_PC and idx not in self._calls)
+        ):
+            self._removed.add(idx)
+            return
+
+        # Registers written but never read
+        if (
+            command.command in REMOVABLE_COMMANDS
+            and r != REG_PC
+            and not self._live_out[idx] & register_set(r)
+        ):
+            self._removed.add(idx)
+            return
+
+        if next_command is None or self._touched(following):
+            return
+        if not self._has_single_predecessor(following):
+            return
+
+        # Loading a value that was just stored
+        if (
+            command.command == "ST"
+            and next_command.command == "LD"
+            and next_command.operands[1:] == (s, t)
+            and next_command.operands[0] != REG_PC
+        ):
+            if next_command.operands[0] == r:
+                self._removed.add(following)
+            else:
+                self._replaced[following] = LdaCommand(
+                    next_command.operands[0],
+                    0,
+                    r,
+                    next_command.comment,
+                )
+            return
+
+        # Computing a value straight into the register it is moved to
+        if (
+            is_move(next_command)
+            and command.command in REMOVABLE_COMMANDS | {"DIV", "IN"}
+            and r not in (REG_PC, REG_ZERO)
+            and move_source(next_command) == r
+            and next_command.operands[0] != r
+            and not self._live_out[following] & register_set(r)
+        ):
+            self._replaced[idx] = with_operands(
+                command,
+                (next_command.operands[0], s, t),
+            )
+            self._removed.add(following)
+            return
+
+        # Reading a moved value from where it was moved from
+        if is_move(command) and uses(next_command) & register_set(r):
+            source = move_source(command)
+            if source == r:
+                return
+            if self._live_out[following] & register_set(r) and not (
+                defines(next_command) & register_set(r)
+            ):
+                return
+            self._replaced[following] = replace_reads(next_command, r, source)
+            self._removed.add(idx)
+
+    def _thread_jumps(self):
+        # Jumps to an unconditional jump go straight to where it leads
+        for idx, target in enumerate(self._targets):
+            command = self._commands[idx]
+            if target is None or idx in self._removed:
+                continue
+            if not (
+                command.command in CONDITIONAL_JUMPS
+                or (command.command == "LDA" and command.operands[0] == REG_PC)
+            ):
+                continue
+            final = target
+            for _ in range(len(self._commands)):
+                if final >= len(self._commands) or final in self._removed:
+                    break
+                jump = self._commands[final]
+                if not (jump.command == "LDA" and jump.operands[0] == REG_PC):
+                    break
+                next_target = self._targets[final]
+                if next_target is None or next_target == final:
+                    break
+                final = next_target
+            if final != target:
+                self._targets[idx] = final
+                # Nothing else changes about the command, but another round is
+                # needed in case the jump now leads to the next command
+                self._replaced.setdefault(idx, command)
+
+    def _compact(self):
+        # Drops the removed commands, with jumps to them leading to the next
+        # command that was kept instead
+        new_index: list[int] = []
+        kept = 0
+        for idx in range(len(self._commands) + 1):
+            new_index.append(kept)
+            if idx < len(self._commands) and idx not in self._removed:
+                kept += 1
+
+        lines: list[TMLine] = []
+        commands: list[TMCommand] = []
+        targets: list[int | None] = []
+        idx = 0
+        for line in self._lines:
+            if not isinstance(line, TMCommand):
+                lines.append(line)
+                continue
+            if idx not in self._removed:
+                command = self._replaced.get(idx, line)
+                target = self._targets[idx]
+                lines.append(command)
+                commands.append(command)
+                targets.append(None if target is None else new_index[target])
+            idx += 1
+        self._lines = lines
+        self._commands = commands
+        self._targets = targets
+
+    def _finish(self) -> list[TMLine]:
+        lines: list[TMLine] = []
+        idx = 0
+        for line in self._lines:
+            if not isinstance(line, TMCommand):
+                lines.append(line)
+                continue
+            target = self._targets[idx]
+            if target is not None:
+                r, _, t = line.operands
+                offset = target if t != REG_PC else target - (idx + 1)
+                line = with_operands(line, (r, offset, t))  # noqa: PLW2901
+            lines.append(line)
+            idx += 1
+        return lines
+
+
+def optimize(lines: Iterable[TMLine]) -> list[TMLine]:
+    return PeepholeOptimizer(lines).optimize()
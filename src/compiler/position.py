@@ -1,3 +1,4 @@
+from bisect import bisect_left
 from typing import SupportsIndex
 
 from typing_extensions import override
@@ -68,3 +69,39 @@ class Position(SupportsIndex):
     @override
     def __str__(self):
         return f"Line {self._line_number} Position {self._position}"
+
+
+class LineIndex:
+    # Stores the absolute position of every newline in a program so that absolute
+    # positions can be converted into line numbers/positions with a binary search
+    # instead of walking the program character by character.
+    def __init__(self, program: str):
+        self._program: str = program
+        self._newline_positions: list[int] = []
+        newline_position = program.find("\n")
+        while newline_position != -1:
+            self._newline_positions.append(newline_position)
+            newline_position = program.find("\n", newline_position + 1)
+
+    def line_count(self) -> int:
+        return len(self._newline_positions) + 1
+
+    def get_line(self, idx: int) -> str:
+        if idx < 0 or idx >= self.line_count():
+            raise IndexError(f"Cannot access line number {idx}: outside of program")
+        line_start = 0 if idx == 0 else self._newline_positions[idx - 1] + 1
+        line_end = (
+            self._newline_positions[idx]
+            if idx < len(self._newline_positions)
+            else len(self._program)
+        )
+        return self._program[line_start:line_end]
+
+    def position_of(self, absolute_position: int) -> Position:
+        line_idx = bisect_left(self._newline_positions, absolute_position)
+        line_start = 0 if line_idx == 0 else self._newline_positions[line_idx - 1] + 1
+        return Position(
+            line_idx + 1,
+            absolute_position - line_start + 1,
+            absolute_position,
+        )
@@ -1,6 +1,17 @@
+import argparse
+import os
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
+from dataclasses import dataclass
+from io import StringIO
+from pathlib import Path
 
-from compiler.code_generator import CodeGenerator
+from compiler.code_generator import DEFAULT_CACHE_SIZE
+from compiler.constant_folding import fold_constants
+from compiler.inliner import inline_functions
+from compiler.ir_backend import CODE_GENERATOR_BACKENDS
 from compiler.klein_errors import (
     CodeGenerationError,
     KleinError,
@@ -8,15 +19,42 @@ from compiler.klein_errors import (
     ParseError,
     SemanticError,
 )
-from compiler.parser import Parser
-from compiler.scanner import Scanner
+from compiler.memoization import memoized_functions
+from compiler.recursive_descent import PARSER_BACKENDS
+from compiler.regex_scanner import SCANNER_BACKENDS
 from compiler.semantic_analyzer import SemanticAnalyzer
 
 
-def compile():  # noqa: A001
-    program = sys.argv[1] if len(sys.argv) > 1 else ""
-    scanner = Scanner(program)
-    parser = Parser(scanner)
+@dataclass(frozen=True)
+class Optimizations:
+    inlining: bool = True
+    constant_folding: bool = True
+    tail_calls: bool = True
+    live_register_saves: bool = True
+    dead_function_elimination: bool = True
+    condition_jumps: bool = True
+    peephole: bool = True
+    # Caching the results of pure recursive functions is opt in, since it only
+    # pays off for functions called again with the same arguments
+    memoization: bool = False
+    cache_size: int = DEFAULT_CACHE_SIZE
+
+
+def compile_program(
+    program: str,
+    scanner_backend: str = "reference",
+    parser_backend: str = "table",
+    output: Path | None = None,
+    optimizations: Optimizations | None = None,
+    *,
+    code_generator_backend: str = "direct",
+) -> bool:
+    # Prints the tm code for the program (or writes it to the output path), or
+    # prints the errors preventing it from being compiled. Returns whether the
+    # program was compiled.
+    optimizations = optimizations or Optimizations()
+    scanner = SCANNER_BACKENDS[scanner_backend](program)
+    parser = PARSER_BACKENDS[parser_backend](scanner)
 
     semantic_analyzer: SemanticAnalyzer | None = None
     try:
@@ -24,9 +62,25 @@ def compile():  # noqa: A001
         semantic_analyzer = SemanticAnalyzer(ast)
         semantic_analyzer.annotate()
         symbol_table = semantic_analyzer.symbol_table
-        code_generator = CodeGenerator(ast, symbol_table)
+        if optimizations.inlining:
+            _ = inline_functions(ast, symbol_table)
+        if optimizations.constant_folding:
+            ast = fold_constants(ast)
+        memoized: set[str] = set()
+        if optimizations.memoization:
+            memoized = memoized_functions(ast, symbol_table)
+        code_generator = CODE_GENERATOR_BACKENDS[code_generator_backend](
+            ast,
+            symbol_table,
+            tail_calls=optimizations.tail_calls,
+            live_register_saves=optimizations.live_register_saves,
+            dead_function_elimination=optimizations.dead_function_elimination,
+            condition_jumps=optimizations.condition_jumps,
+            memoized_functions=memoized,
+            cache_size=optimizations.cache_size,
+            peephole=optimizations.peephole,
+        )
         code_generator.generate()
-        return
     except LexicalError as e:
         print(e)
     except ParseError as e:
@@ -41,8 +95,329 @@ def compile():  # noqa: A001
         print("Klein Error: unable to continue processing")
     except Exception:  # noqa: BLE001
         print("Klein Error: unable to continue processing")
+    else:
+        if output is None:
+            code_generator.write(sys.stdout)
+            return True
+        try:
+            with output.open("w", encoding="utf-8") as output_file:
+                code_generator.write(output_file)
+        except OSError as e:
+            print(f"Unable to write {output}: {e.strerror}")
+        else:
+            return True
+
+    return False
+
+
+def find_sources(paths: list[Path]) -> list[Path]:
+    # Directories are expanded into the klein programs they contain
+    sources: list[Path] = []
+    for path in paths:
+        if path.is_dir():
+            sources.extend(sorted(path.glob("*.kln")))
+        else:
+            sources.append(path)
+    return sources
+
+
+def read_source(source: Path) -> str | None:
+    # Returns the program in the source file, or prints why it can't be read
+    try:
+        return source.read_text()
+    except OSError as e:
+        print(f"Unable to read {source}: {e.strerror}")
+    except UnicodeDecodeError as e:
+        print(
+            f"Unable to read {source}: not valid {e.encoding} "
+            + f"({e.reason} at byte {e.start})",
+        )
+    return None
+
+
+@dataclass
+class CompilationResult:
+    source: Path
+    compiled: bool
+    output: str  # The tm code, or the errors if the program was not compiled
+    elapsed: float
+
+
+def compile_source(
+    source: Path,
+    scanner_backend: str = "reference",
+    parser_backend: str = "table",
+    optimizations: Optimizations | None = None,
+    *,
+    code_generator_backend: str = "direct",
+) -> CompilationResult:
+    output = StringIO()
+    start = time.perf_counter()
+    with redirect_stdout(output):
+        program = read_source(source)
+        compiled = program is not None and compile_program(
+            program,
+            scanner_backend,
+            parser_backend,
+            optimizations=optimizations,
+            code_generator_backend=code_generator_backend,
+        )
+    return CompilationResult(
+        source,
+        compiled,
+        output.getvalue(),
+        time.perf_counter() - start,
+    )
+
+
+def available_cores() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def report_result(result: CompilationResult):
+    # Writes the tm code of a compiled program next to its source. A program
+    # whose tm code can't be written is reported (and counted) as failed.
+    elapsed_ms = result.elapsed * 1000
+    if result.compiled:
+        destination = result.source.with_suffix(".tm")
+        try:
+            _ = destination.write_text(result.output)
+        except OSError as e:
+            result.compiled = False
+            result.output = f"Unable to write {destination}: {e.strerror}\n"
+        else:
+            print(f"{result.source}: compiled to {destination} in {elapsed_ms:.1f} ms")
+            return
+    print(f"{result.source}: failed in {elapsed_ms:.1f} ms")
+    for line in result.output.splitlines():
+        print(f"    {line}")
+
+
+def compile_batch(
+    paths: list[Path],
+    scanner_backend: str = "reference",
+    parser_backend: str = "table",
+    jobs: int | None = 1,
+    optimizations: Optimizations | None = None,
+    *,
+    code_generator_backend: str = "direct",
+) -> bool:
+    # Compiles every program and writes the tm code next to each source file.
+    # With one job everything runs in this process (so the parse table and other
+    # state is only loaded once), otherwise the programs are spread over a pool of
+    # worker processes (by default one per core) and reported as they finish. A
+    # program whose worker fails (or dies, breaking the pool) is reported as
+    # failed like any other. Returns whether every program was compiled.
+    sources = find_sources(paths)
+    workers = max(1, min(jobs or available_cores(), len(sources)))
+    start = time.perf_counter()
+    results: list[CompilationResult] = []
+    if workers == 1:
+        for source in sources:
+            results.append(
+                compile_source(
+                    source,
+                    scanner_backend,
+                    parser_backend,
+                    optimizations,
+                    code_generator_backend=code_generator_backend,
+                ),
+            )
+            report_result(results[-1])
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(
+                    compile_source,
+                    source,
+                    scanner_backend,
+                    parser_backend,
+                    optimizations,
+                    code_generator_backend=code_generator_backend,
+                ): source
+                for source in sources
+            }
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:  # noqa: BLE001
+                    results.append(
+                        CompilationResult(
+                            futures[future],
+                            False,  # noqa: FBT003
+                            f"Worker process failed: {e!r}\n",
+                            0.0,
+                        ),
+                    )
+                report_result(results[-1])
+
+    compiled_count = sum(1 for result in results if result.compiled)
+    compile_time = sum(result.elapsed for result in results)
+    print(
+        f"{compiled_count} of {len(sources)} programs compiled "
+        + f"in {time.perf_counter() - start:.3f} s "
+        + f"({compile_time:.3f} s spent compiling across {workers} "
+        + f"{'process' if workers == 1 else 'processes'})",
+    )
+    return compiled_count == len(sources)
+
+
+def compile():  # noqa: A001
+    argument_parser = argparse.ArgumentParser(
+        prog="klein_compile",
+        description="Compile a klein program into TM code",
+    )
+    argument_parser.add_argument("program", nargs="?", default="")
+    argument_parser.add_argument(
+        "--scanner",
+        choices=SCANNER_BACKENDS,
+        default="reference",
+        help="Scanner backend used to tokenize the program",
+    )
+    argument_parser.add_argument(
+        "--parser",
+        choices=PARSER_BACKENDS,
+        default="table",
+        help="Parser backend used to build the ast",
+    )
+    argument_parser.add_argument(
+        "--code-generator",
+        choices=CODE_GENERATOR_BACKENDS,
+        default="direct",
+        help="Code generator backend used to generate the tm code: straight from "
+        + "the ast, or through an optimized three-address intermediate "
+        + "representation with register allocation",
+    )
+    argument_parser.add_argument(
+        "--source",
+        type=Path,
+        metavar="PATH",
+        help="Read the program from a klein source file instead of the program "
+        + "argument",
+    )
+    argument_parser.add_argument(
+        "--batch",
+        nargs="+",
+        type=Path,
+        metavar="PATH",
+        help="Compile klein source files (or directories of them) instead of the "
+        + "program argument, writing each program's tm code next to its source",
+    )
+    argument_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes used to compile a batch, 0 uses every "
+        + "available core (default: 1)",
+    )
+    argument_parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        metavar="PATH",
+        help="Write the program's tm code to a file instead of printing it",
+    )
+    argument_parser.add_argument(
+        "--no-inlining",
+        dest="inlining",
+        action="store_false",
+        help="Keep calls to small functions instead of replacing them with the "
+        + "function's body",
+    )
+    argument_parser.add_argument(
+        "--no-constant-folding",
+        dest="constant_folding",
+        action="store_false",
+        help="Generate code for constant expressions instead of their values",
+    )
+    argument_parser.add_argument(
+        "--no-tail-calls",
+        dest="tail_calls",
+        action="store_false",
+        help="Compile recursive calls in tail position like any other call "
+        + "instead of reusing the caller's stack frame",
+    )
+    argument_parser.add_argument(
+        "--no-live-register-saves",
+        dest="live_register_saves",
+        action="store_false",
+        help="Save and restore every general purpose register in each function "
+        + "instead of only the ones it writes while a caller holds a value in them",
+    )
+    argument_parser.add_argument(
+        "--no-dead-function-elimination",
+        dest="dead_function_elimination",
+        action="store_false",
+        help="Generate code for every function, including the ones main never "
+        + "ends up calling",
+    )
+    argument_parser.add_argument(
+        "--no-condition-jumps",
+        dest="condition_jumps",
+        action="store_false",
+        help="Compute the value of conditions and test it instead of jumping on "
+        + "comparisons and and/or directly",
+    )
+    argument_parser.add_argument(
+        "--no-peephole",
+        dest="peephole",
+        action="store_false",
+        help="Leave the generated tm code as it is instead of rewriting short "
+        + "sequences of it into cheaper ones",
+    )
+    argument_parser.add_argument(
+        "--memoize",
+        dest="memoization",
+        action="store_true",
+        help="Cache the results of recursive functions that don't print in DMEM, "
+        + "so calls with arguments seen before return straight away",
+    )
+    argument_parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=DEFAULT_CACHE_SIZE,
+        help="Number of results cached for each memoized function, a result "
+        + f"replaces the one cached in its place (default: {DEFAULT_CACHE_SIZE})",
+    )
+    args = argument_parser.parse_args()
+    optimizations = Optimizations(
+        inlining=args.inlining,
+        constant_folding=args.constant_folding,
+        tail_calls=args.tail_calls,
+        live_register_saves=args.live_register_saves,
+        dead_function_elimination=args.dead_function_elimination,
+        condition_jumps=args.condition_jumps,
+        peephole=args.peephole,
+        memoization=args.memoization,
+        cache_size=args.cache_size,
+    )
 
-    sys.exit(1)
+    if args.batch is not None:
+        compiled = compile_batch(
+            args.batch,
+            args.scanner,
+            args.parser,
+            args.jobs or None,
+            optimizations,
+            code_generator_backend=args.code_generator,
+        )
+    else:
+        program = args.program
+        if args.source is not None:
+            program = read_source(args.source)
+        compiled = program is not None and compile_program(
+            program,
+            args.scanner,
+            args.parser,
+            args.output,
+            optimizations,
+            code_generator_backend=args.code_generator,
+        )
+    if not compiled:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,51 @@
+import argparse
+
+from compiler.ir import lower_function, optimize_function
+from compiler.klein_errors import (
+    CodeGenerationError,
+    LexicalError,
+    ParseError,
+    SemanticError,
+)
+from compiler.parser import Parser
+from compiler.scanner import Scanner
+from compiler.semantic_analyzer import SemanticAnalyzer
+
+
+def list_ir():
+    argument_parser = argparse.ArgumentParser(
+        prog="klein_list_ir",
+        description="Print the three-address code each function of a klein program "
+        + "is lowered into by the ir code generator backend",
+    )
+    argument_parser.add_argument("program", nargs="?", default="")
+    argument_parser.add_argument(
+        "--unoptimized",
+        action="store_true",
+        help="Print the code as it is lowered, before copy propagation, common "
+        + "subexpression elimination and dead code elimination",
+    )
+    args = argument_parser.parse_args()
+
+    analyzer: SemanticAnalyzer | None = None
+    try:
+        ast = Parser(Scanner(args.program)).parse()
+        analyzer = SemanticAnalyzer(ast)
+        analyzer.annotate()
+        for definition in ast.definition_list:
+            function = lower_function(definition)
+            if not args.unoptimized:
+                function = optimize_function(function)
+            print(function)
+    except (LexicalError, ParseError, CodeGenerationError) as e:
+        print(e)
+    except SemanticError as e:
+        if analyzer is not None:
+            analyzer.display_issues()
+        print(e)
+    except Exception:  # noqa: BLE001
+        print("Klein Error: unable to continue processing")
+
+
+if __name__ == "__main__":
+    list_ir()
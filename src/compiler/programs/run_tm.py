@@ -0,0 +1,47 @@
+import argparse
+import sys
+from pathlib import Path
+
+from compiler.klein_errors import TMError
+from compiler.tm_vm import TMMachine, parse_tm
+
+
+def run_tm():
+    argument_parser = argparse.ArgumentParser(
+        prog="klein_run_tm",
+        description="Run a TM program, printing the value of every OUT instruction",
+    )
+    argument_parser.add_argument("program", type=Path)
+    argument_parser.add_argument("arguments", nargs="*", type=int)
+    argument_parser.add_argument(
+        "--profile",
+        type=Path,
+        nargs="?",
+        const=Path("/dev/stderr"),
+        metavar="PATH",
+        help="Write a report of where the program spent its instructions to a file "
+        + "(default: stderr)",
+    )
+    argument_parser.add_argument(
+        "--hot-spots",
+        type=int,
+        default=20,
+        help="Number of most executed addresses included in the profile report",
+    )
+    args = argument_parser.parse_args()
+
+    try:
+        program = parse_tm(args.program.read_text())
+        machine = TMMachine(program)
+        if args.profile is None:
+            _ = machine.run(args.arguments)
+        else:
+            profile = machine.profile(args.arguments)
+            _ = args.profile.write_text(profile.report(program, args.hot_spots))
+    except TMError as e:
+        print(e)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    run_tm()
@@ -1,12 +1,23 @@
-import sys
+import argparse
 
 from compiler.klein_errors import KleinError
-from compiler.scanner import Scanner
+from compiler.regex_scanner import SCANNER_BACKENDS
 
 
 def list_tokens():
-    program = sys.argv[1] if len(sys.argv) > 1 else ""
-    scanner = Scanner(program)
+    argument_parser = argparse.ArgumentParser(
+        prog="klein_list_tokens",
+        description="Print every token of a klein program",
+    )
+    argument_parser.add_argument("program", nargs="?", default="")
+    argument_parser.add_argument(
+        "--scanner",
+        choices=SCANNER_BACKENDS,
+        default="reference",
+        help="Scanner backend used to tokenize the program",
+    )
+    args = argument_parser.parse_args()
+    scanner = SCANNER_BACKENDS[args.scanner](args.program)
 
     try:
         for token in scanner:
@@ -0,0 +1,254 @@
+import re
+from collections.abc import Callable
+from functools import cache
+
+from typing_extensions import override
+
+from compiler.ast_nodes import (
+    Program,
+    SemanticAction,
+    SemanticStack,
+    action_to_astnode,
+)
+from compiler.klein_errors import ParseError
+from compiler.parse_table import NonTerminal, load_parse_table
+from compiler.parser import Parser
+from compiler.scanner import Scanner
+from compiler.tokens import Token, TokenType
+
+# Predictions for more terminals than this are checked with a set lookup instead
+# of a chain of identity comparisons
+MAX_IDENTITY_CHECKS = 2
+
+
+def group_alternatives(
+    parse_table: dict[
+        tuple[NonTerminal, TokenType],
+        list[NonTerminal | TokenType | SemanticAction],
+    ],
+    nonterminal: NonTerminal,
+) -> list[tuple[list[NonTerminal | TokenType | SemanticAction], list[TokenType]]]:
+    # Collects every alternative of a nonterminal along with the terminals that
+    # predict it, in the order they first appear in the table
+    alternatives: dict[
+        tuple[NonTerminal | TokenType | SemanticAction, ...],
+        tuple[list[NonTerminal | TokenType | SemanticAction], list[TokenType]],
+    ] = {}
+    for terminal in TokenType:
+        rule = parse_table.get((nonterminal, terminal))
+        if rule is None:
+            continue
+        if tuple(rule) not in alternatives:
+            alternatives[tuple(rule)] = (rule, [])
+        alternatives[tuple(rule)][1].append(terminal)
+    return list(alternatives.values())
+
+
+def builder_name(action: SemanticAction) -> str:
+    # Every semantic action is the build classmethod of an ast node
+    return action_to_astnode[action].__self__.__name__  # pyright: ignore[reportFunctionMemberAccess]
+
+
+class RecursiveDescentGenerator:
+    # Writes the source of a module with one function per nonterminal. Each
+    # function picks an alternative by looking at the next token and then parses
+    # the alternative's symbols in order, calling the ast nodes' build methods
+    # directly instead of pushing semantic actions onto a stack.
+    #
+    # The functions are closures over the scanner and semantic stack. They are
+    # passed the token that was peeked when they were called and return the most
+    # recently peeked or consumed token, which is what the build methods expect
+    # (the table parser keeps track of the same token).
+    def __init__(
+        self,
+        parse_table: dict[
+            tuple[NonTerminal, TokenType],
+            list[NonTerminal | TokenType | SemanticAction],
+        ],
+    ):
+        self._parse_table: dict[
+            tuple[NonTerminal, TokenType],
+            list[NonTerminal | TokenType | SemanticAction],
+        ] = parse_table
+        self._lines: list[str] = []
+        self._predict_sets: list[str] = []
+        self._builders: set[str] = set()
+
+    def generate(self) -> str:
+        self._lines = []
+        self._emit(0, "def build_parser(parser, scanner, semantic_stack):")
+        self._emit(1, "push = semantic_stack.push")
+        for nonterminal in NonTerminal:
+            self._emit(0, "")
+            self._generate_function(nonterminal)
+        self._emit(0, "")
+        self._emit(1, f"return parse_{NonTerminal.PROGRAM.value}")
+
+        header = [
+            "# Generated by compiler.recursive_descent, do not edit",
+            f"from compiler.ast_nodes import {', '.join(sorted(self._builders))}",
+            "from compiler.parse_table import NonTerminal",
+            "from compiler.tokens import TokenType",
+            "",
+            *(
+                f"build_{camel_to_snake(builder)} = {builder}.build"
+                for builder in sorted(self._builders)
+            ),
+            *self._predict_sets,
+        ]
+        return "\n".join(header) + "\n\n\n" + "\n".join(self._lines) + "\n"
+
+    def _emit(self, indent: int, line: str):
+        self._lines.append("    " * indent + line if line else "")
+
+    def _condition(self, nonterminal: NonTerminal, terminals: list[TokenType]) -> str:
+        if len(terminals) <= MAX_IDENTITY_CHECKS:
+            return " or ".join(
+                f"token_type is TokenType.{terminal.name}" for terminal in terminals
+            )
+        name = f"PREDICT_{nonterminal.name}_{len(self._predict_sets)}"
+        members = ", ".join(f"TokenType.{terminal.name}" for terminal in terminals)
+        self._predict_sets.append(f"{name} = frozenset(({members}))")
+        return f"token_type in {name}"
+
+    def _generate_function(self, nonterminal: NonTerminal):
+        alternatives = group_alternatives(self._parse_table, nonterminal)
+        # Rules ending in the nonterminal itself (lists and the *-REST rules) are
+        # turned into loops so long programs don't exhaust the recursion limit
+        loops = any(
+            len(rule) > 0 and rule[-1] == nonterminal for rule, _ in alternatives
+        )
+        self._emit(1, f"def parse_{nonterminal.value}(token):")
+        indent = 2
+        if loops:
+            self._emit(2, "while True:")
+            indent = 3
+        self._emit(indent, "token_type = token.token_type")
+        for idx, (rule, terminals) in enumerate(alternatives):
+            keyword = "if" if idx == 0 else "elif"
+            self._emit(indent, f"{keyword} {self._condition(nonterminal, terminals)}:")
+            if loops and len(rule) > 0 and rule[-1] == nonterminal:
+                _ = self._generate_alternative(rule[:-1], terminals, indent + 1)
+                self._emit(indent + 1, "token = scanner.peek()")
+            else:
+                most_recent_token = self._generate_alternative(
+                    rule,
+                    terminals,
+                    indent + 1,
+                )
+                self._emit(indent + 1, f"return {most_recent_token}")
+        if len(alternatives) > 0:
+            self._emit(indent, "else:")
+            indent += 1
+        self._emit(
+            indent,
+            f"raise parser.invalid_transition_error(NonTerminal.{nonterminal.name}, token)",
+        )
+
+    def _generate_alternative(
+        self,
+        rule: list[NonTerminal | TokenType | SemanticAction],
+        terminals: list[TokenType],
+        indent: int,
+    ) -> str:
+        # Returns the expression holding the most recent token at the end of the
+        # alternative, which is the peeked token until something is consumed
+        most_recent_token = "token"
+        for idx, symbol in enumerate(rule):
+            if isinstance(symbol, NonTerminal):
+                argument = "token" if most_recent_token == "token" else "scanner.peek()"
+                self._emit(
+                    indent,
+                    f"most_recent_token = parse_{symbol.value}({argument})",
+                )
+                most_recent_token = "most_recent_token"
+            elif isinstance(symbol, TokenType):
+                self._emit(indent, "most_recent_token = scanner.next()")
+                if not (idx == 0 and terminals == [symbol]):
+                    # Otherwise the token was already checked when picking this
+                    # alternative
+                    self._emit(
+                        indent,
+                        f"if most_recent_token.token_type is not TokenType.{symbol.name}:",
+                    )
+                    self._emit(
+                        indent + 1,
+                        f"raise parser.unexpected_token_error(TokenType.{symbol.name}, most_recent_token)",
+                    )
+                most_recent_token = "most_recent_token"
+            else:
+                builder = builder_name(symbol)
+                self._builders.add(builder)
+                self._emit(
+                    indent,
+                    f"push(build_{camel_to_snake(builder)}(semantic_stack, {most_recent_token}))",
+                )
+        return most_recent_token
+
+
+def camel_to_snake(name: str) -> str:
+    return re.sub(r"(?<!^)(?=[A-Z])", "_", name).lower()
+
+
+def generate_recursive_descent_source(parse_table_filename: str) -> str:
+    return RecursiveDescentGenerator(load_parse_table(parse_table_filename)).generate()
+
+
+@cache
+def load_recursive_descent_parser(
+    parse_table_filename: str,
+) -> Callable[
+    ["RecursiveDescentParser", Scanner, SemanticStack],
+    Callable[[Token], Token],
+]:
+    # The generated module is compiled once per process, each parse only has to
+    # create the closures
+    source = generate_recursive_descent_source(parse_table_filename)
+    namespace: dict[str, object] = {}
+    exec(  # noqa: S102
+        compile(
+            source,
+            f"<recursive descent parser for {parse_table_filename}>",
+            "exec",
+        ),
+        namespace,
+    )
+    return namespace["build_parser"]  # pyright: ignore[reportReturnType]
+
+
+class RecursiveDescentParser(Parser):
+    def __init__(
+        self,
+        scanner: Scanner,
+        parse_table_filename: str = "refactored-grammar.txt",
+    ):
+        super().__init__(scanner, parse_table_filename)
+        self._build_parser: Callable[
+            [RecursiveDescentParser, Scanner, SemanticStack],
+            Callable[[Token], Token],
+        ] = load_recursive_descent_parser(parse_table_filename)
+
+    @override
+    def parse(self) -> Program:
+        semantic_stack = SemanticStack()
+        parse_program = self._build_parser(self, self._scanner, semantic_stack)
+        try:
+            _ = parse_program(self._scanner.peek())
+        except RecursionError as e:
+            raise ParseError(
+                "Program is nested too deeply for the recursive descent parser",
+            ) from e
+        token = self._scanner.next()
+        if token.token_type is not TokenType.END_OF_FILE:
+            raise self.unexpected_token_error(TokenType.END_OF_FILE, token)
+        return self._finish(semantic_stack)
+
+
+PARSER_BACKENDS: dict[str, type[Parser]] = {
+    "table": Parser,
+    "recursive-descent": RecursiveDescentParser,
+}
+
+
+if __name__ == "__main__":
+    print(generate_recursive_descent_source("refactored-grammar.txt"), end="")
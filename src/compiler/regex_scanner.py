@@ -0,0 +1,142 @@
+import re
+from typing import TYPE_CHECKING
+
+from typing_extensions import override
+
+from compiler.position import Position
+from compiler.scanner import (
+    BOOLEANS,
+    KEYWORDS,
+    MAX_IDENTIFIER_LENGTH,
+    MAX_INTEGER_INCL,
+    SINGLE_CHARACTER_TOKENS,
+    Scanner,
+)
+from compiler.tokens import Token, TokenType
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+# Identifiers and integers have to be followed by a delimiter (or the end of the
+# program). If they aren't, the whole alternation fails at their first character
+# and the catch all "illegal" group picks it up instead.
+DELIMITER_LOOKAHEAD = r"(?=[-+*/<=(),:\t\n\r ]|\Z)"
+
+# A comment mirrors full-fsm.jff: a star always consumes the character after it,
+# so the comment only ends at a "*)" which isn't preceded by an unpaired star.
+# Unterminated comments are left for the reference scanner to report.
+MASTER_PATTERN: re.Pattern[str] = re.compile(
+    rf"""
+    (?P<skippable>(?:[\t\n\r ]+|\(\*(?:[^*]|\*[^)])*\*\))+)
+    |(?P<identifier>[a-zA-Z][a-zA-Z0-9_]*){DELIMITER_LOOKAHEAD}
+    |(?P<integer>0|[1-9][0-9]*){DELIMITER_LOOKAHEAD}
+    |(?P<unterminated_comment>\(\*)
+    |(?P<symbol>[-+*/<=(),:])
+    |(?P<illegal>.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+MAX_INTEGER_LENGTH = len(str(MAX_INTEGER_INCL))
+
+
+class RegexScanner(Scanner):
+    # Fast path scanner which tokenizes the program with a single alternation
+    # regex. Anything the regex cannot handle (illegal characters, unterminated
+    # comments, out of bounds literals) is handed to the reference scanner so the
+    # reported LexicalError is identical. Like the reference scanner, it counts
+    # the characters it scans in characters_scanned.
+    def __init__(self, program: str):
+        self._consumed_offset: int = 0
+        super().__init__(program)
+        self._matches: Iterator[re.Match[str]] = MASTER_PATTERN.finditer(program)
+        self._lookahead_end: int = 0
+
+    @property
+    def position(self) -> Position:  # pyright: ignore[reportIncompatibleVariableOverride]
+        # Only computed when asked for, the fast path itself never needs it
+        return self.line_index.position_of(self._consumed_offset)
+
+    @position.setter
+    def position(self, position: Position):
+        self._consumed_offset = position.get_absolute_position()
+
+    @override
+    def next(self):
+        token = self.peek()
+        self._consumed_offset = self._lookahead_end
+        self._lookahead = None
+        self.has_terminated = token.token_type is TokenType.END_OF_FILE
+        return token
+
+    @override
+    def _scan(self) -> Token:
+        for match in self._matches:
+            kind = match.lastgroup
+            if kind == "skippable":
+                self.characters_scanned += match.end() - match.start()
+                continue
+            start = match.start()
+            lexeme = match.group()
+            if kind == "identifier" and len(lexeme) <= MAX_IDENTIFIER_LENGTH:
+                token_type = KEYWORDS.get(lexeme)
+                if token_type is not None:
+                    token = Token(self.line_index.position_of(start), token_type)
+                elif lexeme in BOOLEANS:
+                    token = Token(
+                        self.line_index.position_of(start),
+                        TokenType.BOOLEAN,
+                        lexeme,
+                    )
+                else:
+                    token = Token(
+                        self.line_index.position_of(start),
+                        TokenType.IDENTIFIER,
+                        lexeme,
+                    )
+            elif kind == "integer" and (
+                len(lexeme) < MAX_INTEGER_LENGTH
+                or (
+                    len(lexeme) == MAX_INTEGER_LENGTH
+                    and int(lexeme) <= MAX_INTEGER_INCL
+                )
+            ):
+                token = Token(
+                    self.line_index.position_of(start),
+                    TokenType.INTEGER,
+                    lexeme,
+                )
+            elif kind == "symbol":
+                token = Token(
+                    self.line_index.position_of(start),
+                    SINGLE_CHARACTER_TOKENS[lexeme],
+                )
+            else:
+                return self._scan_reference(start)
+            self._lookahead_end = match.end()
+            self.characters_scanned += self._lookahead_end - start
+            return token
+
+        self._lookahead_end = len(self.program)
+        return Token(
+            self.line_index.position_of(self._lookahead_end),
+            TokenType.END_OF_FILE,
+        )
+
+    def _scan_reference(self, offset: int) -> Token:
+        # Lets the reference scanner scan (and most likely reject) the token at the
+        # given offset, afterwards the fast path resumes wherever it stopped.
+        self.working_position = self.line_index.position_of(offset)
+        token = super()._scan()
+        self._matches = MASTER_PATTERN.finditer(
+            self.program,
+            self.working_position.get_absolute_position(),
+        )
+        self._lookahead_end = self.working_position.get_absolute_position()
+        return token
+
+
+SCANNER_BACKENDS: dict[str, type[Scanner]] = {
+    "reference": Scanner,
+    "regex": RegexScanner,
+}
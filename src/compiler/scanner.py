@@ -1,5 +1,8 @@
+from functools import cached_property
+from typing import NoReturn
+
 from compiler.klein_errors import KleinError, LexicalError
-from compiler.position import Position
+from compiler.position import LineIndex, Position
 from compiler.tokens import Token, TokenType
 
 ALPHABET = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
@@ -23,6 +26,9 @@ KEYWORDS: dict[str, TokenType] = {
     "print": TokenType.KEYWORD_PRINT,
 }
 BOOLEANS: set[str] = {"true", "false"}
+MAX_IDENTIFIER_LENGTH = 256
+MIN_INTEGER_INCL = 0
+MAX_INTEGER_INCL = (2**31) - 1
 
 TOKEN_TO_DISPLAY_CHAR: dict[TokenType, str] = {
     TokenType.LEFT_PAREN: "(",
@@ -37,6 +43,12 @@ TOKEN_TO_DISPLAY_CHAR: dict[TokenType, str] = {
     TokenType.EQUAL: "=",
 }
 
+# Operators and punctuation are all a single character long, so they map straight
+# from their text to their token type
+SINGLE_CHARACTER_TOKENS: dict[str, TokenType] = {
+    char: token_type for token_type, char in TOKEN_TO_DISPLAY_CHAR.items()
+}
+
 TOKEN_TO_DISPLAY_CHAR.update(
     [(v, k) for k, v in KEYWORDS.items()],
 )
@@ -48,256 +60,316 @@ def tokentype_to_str(token_type: TokenType) -> str:
     return str(token_type)
 
 
+# The scanner is a table driven version of doc/finite-state-machines/full-fsm.jff.
+# Each state is named after the JFLAP state it implements.
+STATE_START = 0  # q0
+STATE_IDENTIFIER = 1  # q1
+STATE_ZERO = 2  # q2
+STATE_INTEGER = 3  # q3
+STATE_OPERATOR = 4  # q4
+STATE_LEFT_PAREN = 5  # q5
+STATE_COMMENT = 6  # q6
+STATE_COMMENT_STAR = 7  # q7
+STATE_COMMENT_END = 8  # q8
+STATE_WHITESPACE = 9  # q9
+STATE_PUNCTUATION = 10  # q10
+STATE_COUNT = 11
+
+# Whitespace and comments are accepted, but never turned into tokens. In theory
+# could return token with type whitespace, but I don't think whitespace is
+# supposed to be a token.
+SKIPPED_STATES = (STATE_WHITESPACE, STATE_COMMENT_END)
+
+# Instead of a state, a transition can also accept the characters read so far
+# (without consuming the current one) or reject the current character.
+ACCEPT = -1
+REJECT = -2
+
+# Characters are grouped into classes which every state treats identically. This
+# keeps the transition table small: one column per class instead of per character.
+CLASS_LETTER = 0
+CLASS_ZERO = 1
+CLASS_NON_ZERO_INTEGER = 2
+CLASS_UNDERSCORE = 3
+CLASS_OPERATOR = 4
+CLASS_STAR = 5
+CLASS_LEFT_PAREN = 6
+CLASS_RIGHT_PAREN = 7
+CLASS_PUNCTUATION = 8
+CLASS_NEWLINE = 9
+CLASS_WHITESPACE = 10
+CLASS_OTHER = 11
+CLASS_END_OF_FILE = 12
+CLASS_COUNT = 13
+
+CHARACTER_CLASSES: dict[str, int] = {
+    **dict.fromkeys(ALPHABET, CLASS_LETTER),
+    "0": CLASS_ZERO,
+    **dict.fromkeys(NON_ZERO_INTEGERS, CLASS_NON_ZERO_INTEGER),
+    "_": CLASS_UNDERSCORE,
+    **dict.fromkeys("+-/<=", CLASS_OPERATOR),
+    "*": CLASS_STAR,
+    "(": CLASS_LEFT_PAREN,
+    ")": CLASS_RIGHT_PAREN,
+    **dict.fromkeys(",:", CLASS_PUNCTUATION),
+    "\n": CLASS_NEWLINE,
+    **dict.fromkeys("\t\r ", CLASS_WHITESPACE),
+}
+
+IDENTIFIER_CLASSES = (
+    CLASS_LETTER,
+    CLASS_ZERO,
+    CLASS_NON_ZERO_INTEGER,
+    CLASS_UNDERSCORE,
+)
+INTEGER_CLASSES = (CLASS_ZERO, CLASS_NON_ZERO_INTEGER)
+DELIMITER_CLASSES = (
+    CLASS_OPERATOR,
+    CLASS_STAR,
+    CLASS_LEFT_PAREN,
+    CLASS_RIGHT_PAREN,
+    CLASS_PUNCTUATION,
+    CLASS_NEWLINE,
+    CLASS_WHITESPACE,
+)
+
+# Transitions of full-fsm.jff, listed per state as (default, {class: target}).
+# Identifiers and integers must be followed by a delimiter (or the end of the
+# file) to be accepted, every other character is rejected.
+FSM_TRANSITIONS: dict[int, tuple[int, dict[int, int]]] = {
+    STATE_START: (
+        REJECT,
+        {
+            CLASS_LETTER: STATE_IDENTIFIER,
+            CLASS_ZERO: STATE_ZERO,
+            CLASS_NON_ZERO_INTEGER: STATE_INTEGER,
+            CLASS_OPERATOR: STATE_OPERATOR,
+            CLASS_STAR: STATE_OPERATOR,
+            CLASS_LEFT_PAREN: STATE_LEFT_PAREN,
+            CLASS_RIGHT_PAREN: STATE_PUNCTUATION,
+            CLASS_PUNCTUATION: STATE_PUNCTUATION,
+            CLASS_NEWLINE: STATE_WHITESPACE,
+            CLASS_WHITESPACE: STATE_WHITESPACE,
+        },
+    ),
+    STATE_IDENTIFIER: (
+        REJECT,
+        {
+            **dict.fromkeys(IDENTIFIER_CLASSES, STATE_IDENTIFIER),
+            **dict.fromkeys(DELIMITER_CLASSES, ACCEPT),
+            CLASS_END_OF_FILE: ACCEPT,
+        },
+    ),
+    STATE_ZERO: (
+        REJECT,
+        {**dict.fromkeys(DELIMITER_CLASSES, ACCEPT), CLASS_END_OF_FILE: ACCEPT},
+    ),
+    STATE_INTEGER: (
+        REJECT,
+        {
+            **dict.fromkeys(INTEGER_CLASSES, STATE_INTEGER),
+            **dict.fromkeys(DELIMITER_CLASSES, ACCEPT),
+            CLASS_END_OF_FILE: ACCEPT,
+        },
+    ),
+    STATE_OPERATOR: (ACCEPT, {}),
+    STATE_LEFT_PAREN: (ACCEPT, {CLASS_STAR: STATE_COMMENT}),
+    STATE_COMMENT: (
+        STATE_COMMENT,
+        {CLASS_STAR: STATE_COMMENT_STAR, CLASS_END_OF_FILE: REJECT},
+    ),
+    STATE_COMMENT_STAR: (
+        STATE_COMMENT,
+        {CLASS_RIGHT_PAREN: STATE_COMMENT_END, CLASS_END_OF_FILE: REJECT},
+    ),
+    STATE_COMMENT_END: (ACCEPT, {}),
+    STATE_WHITESPACE: (ACCEPT, {}),
+    STATE_PUNCTUATION: (ACCEPT, {}),
+}
+
+
+def build_transition_table() -> list[list[int]]:
+    table: list[list[int]] = []
+    for state in range(STATE_COUNT):
+        default, transitions = FSM_TRANSITIONS[state]
+        row = [default] * CLASS_COUNT
+        for character_class, target in transitions.items():
+            row[character_class] = target
+        table.append(row)
+    return table
+
+
+class _CharacterClassMap(dict[int, int]):
+    # Used with str.translate, so any character not explicitly listed (including
+    # all non-ascii characters) falls into the "other" class
+    def __missing__(self, key: int) -> int:
+        return CLASS_OTHER
+
+
+TRANSITION_TABLE: list[list[int]] = build_transition_table()
+CHARACTER_CLASS_MAP: _CharacterClassMap = _CharacterClassMap(
+    (ord(char), character_class) for char, character_class in CHARACTER_CLASSES.items()
+)
+
+
+def classify_characters(program: str) -> bytes:
+    # Converts the program into one byte per character holding its class, with
+    # an additional end of file class at the end so the scanner never has to
+    # bounds check the program.
+    return program.translate(CHARACTER_CLASS_MAP).encode("latin-1") + bytes(
+        [CLASS_END_OF_FILE],
+    )
+
+
 class Scanner:
     def __init__(self, program: str):
         self.program: str = program
         self.has_terminated: bool = False
         self.position: Position = Position()
         self.working_position: Position = Position()
-        self.accum: str = ""
+        self.characters_scanned: int = 0
+        self._lookahead: Token | None = None
+
+    @cached_property
+    def _character_classes(self) -> bytes:
+        return classify_characters(self.program)
+
+    @cached_property
+    def line_index(self) -> LineIndex:
+        return LineIndex(self.program)
 
     def get_line(self, idx: int):
-        lines: list[str] = self.program.split("\n")
-        if idx < 0 or idx >= len(lines):
-            raise IndexError(f"Cannot access line number {idx}: outside of program")
-        return lines[idx]
+        return self.line_index.get_line(idx)
 
     def __iter__(self):
         while self.has_next():
             yield self.next()
 
     def next(self):
-        return self._next(update_position=True)
+        token = self.peek()
+        self._lookahead = None
+        self.position.load(self.working_position)
+        self.has_terminated = token == TokenType.END_OF_FILE
+        return token
 
     def peek(self):
-        return self._next(update_position=False)
-
-    def _next(self, *, update_position: bool = True):
+        # The parser peeks at every token at least once before consuming it, so
+        # the peeked token is kept until next() consumes it instead of scanning
+        # it again.
         if self.has_terminated:
             raise KleinError("Cannot call next on a terminated scanner")
+        if self._lookahead is None:
+            self._lookahead = self._scan()
+        return self._lookahead
+
+    def _scan(self) -> Token:
+        # Runs the transition table from the working position until the current
+        # character is either accepted or rejected. Whitespace and comments are
+        # accepted without producing a token, after which scanning restarts.
+        program = self.program
+        character_classes = self._character_classes
+        transition_table = TRANSITION_TABLE
+        index = self.working_position.get_absolute_position()
+        line_number = self.working_position.get_line_number()
+        line_position = self.working_position.get_position()
+        while True:
+            start = index
+            start_line_number = line_number
+            start_line_position = line_position
+            if start >= len(program):
+                self.working_position = Position(line_number, line_position, index)
+                return Token(self.working_position.copy(), TokenType.END_OF_FILE)
+
+            state = STATE_START
+            while True:
+                character_class = character_classes[index]
+                next_state = transition_table[state][character_class]
+                if next_state < 0:
+                    break
+                index += 1
+                if character_class == CLASS_NEWLINE:
+                    line_number += 1
+                    line_position = 1
+                else:
+                    line_position += 1
+                state = next_state
+
+            self.characters_scanned += index - start
+            if next_state == REJECT:
+                self.working_position = Position(line_number, line_position, index)
+                self._reject(state, index)
+            if state not in SKIPPED_STATES:
+                self.working_position = Position(line_number, line_position, index)
+                return self._accept(
+                    state,
+                    program[start:index],
+                    Position(start_line_number, start_line_position, start),
+                )
 
-        token: Token | None = None
-        while token is None:
-            self.position.load(self.working_position)
-            token = self._stage0()
-
-        if update_position:
-            self.position.load(self.working_position)
-            self.has_terminated = token == TokenType.END_OF_FILE
-        else:
-            self.working_position.load(self.position)
-
-        return token
-
-    def _stage0(self):
-        if self.working_position >= len(self.program):
-            return Token(self.position.copy(), TokenType.END_OF_FILE)
-        self.accum = ""
-        char = self.program[self.working_position]
-        if char in ALPHABET:
-            self.accum += char
-            self.working_position += 1
-            return self._stage1()
-        if char in "0":
-            self.accum += char
-            self.working_position += 1
-            return self._stage2()
-        if char in NON_ZERO_INTEGERS:
-            self.accum += char
-            self.working_position += 1
-            return self._stage3()
-        if char in OPERATORS:
-            self.accum += char
-            self.working_position += 1
-            return self._stage4()
-        if char in "(":
-            self.accum += char
-            self.working_position += 1
-            return self._stage5()
-        if char in SKIPPABLE:
-            self.accum += char
-            self.working_position += 1
-            return self._stage9()
-        if char in PUNCTUATION:
-            self.accum += char
-            self.working_position += 1
-            return self._stage10()
-        raise LexicalError(
-            f'Illegal character "{char}" when looking for next token.',
-            self.working_position,
-        )
+    def _accept(self, state: int, lexeme: str, position: Position) -> Token:
+        if state == STATE_IDENTIFIER:
+            return self._categorize_identifier(lexeme, position)
+        if state in (STATE_ZERO, STATE_INTEGER):
+            return self._validate_integer(lexeme, position)
+        return Token(position, SINGLE_CHARACTER_TOKENS[lexeme])
 
-    def _categorize_identifier(self, identifier: str) -> Token:
-        max_identifier_length = 256
-        if len(identifier) > max_identifier_length:
+    def _reject(self, state: int, index: int) -> NoReturn:
+        char = self.program[index] if index < len(self.program) else ""
+        if state == STATE_START:
             raise LexicalError(
-                "Identifiers cannot be longer than 256 characters",
+                f'Illegal character "{char}" when looking for next token.',
                 self.working_position,
             )
-        if identifier in KEYWORDS:
-            token_type = KEYWORDS[identifier]
-            return Token(self.position.copy(), token_type)
-        if identifier in BOOLEANS:
-            return Token(self.position.copy(), TokenType.BOOLEAN, self.accum)
-        return Token(self.position.copy(), TokenType.IDENTIFIER, self.accum)
-
-    def _stage1(self) -> Token:
-        if self.working_position >= len(self.program):
-            return self._categorize_identifier(self.accum)
-        char = self.program[self.working_position]
-        if char in IDENTIFIER_CHARACTERS:
-            self.accum += char
-            self.working_position += 1
-            return self._stage1()
-        if char in DELIMITERS:
-            return self._categorize_identifier(self.accum)
-        debug_character = char
-        if not char.isprintable():
-            debug_character = f"utf8:{ord(char)}"
-
-        raise LexicalError(
-            f'Invalid character "{debug_character}" in identifier. Only alphanumeric characters and underscores allowed.',
-            self.working_position,
-        )
-
-    def _validate_integer(self, value: str) -> Token:
-        min_integer_incl = 0
-        max_integer_incl = (2**31) - 1
-        try:
-            numeric_value = int(value)
-        except Exception:
-            raise LexicalError(  # noqa: B904
-                f'Encountered illegal integer "{value}"',
+        if state == STATE_IDENTIFIER:
+            debug_character = char
+            if not char.isprintable():
+                debug_character = f"utf8:{ord(char)}"
+            raise LexicalError(
+                f'Invalid character "{debug_character}" in identifier. Only alphanumeric characters and underscores allowed.',
                 self.working_position,
             )
-        if numeric_value < min_integer_incl or numeric_value > max_integer_incl:
+        if state == STATE_ZERO and char in INTEGERS:
             raise LexicalError(
-                f"Integer literal must be bounded between {min_integer_incl} (incl) and {max_integer_incl} (incl).",
+                "Integer cannot start with leading 0",
                 self.working_position,
             )
-        return Token(self.position.copy(), TokenType.INTEGER, self.accum)
-
-    def _stage2(self) -> Token:
-        if self.working_position >= len(self.program):
-            return self._validate_integer(self.accum)
-        char = self.program[self.working_position]
-        if char in DELIMITERS:
-            return Token(self.position.copy(), TokenType.INTEGER, self.accum)
-        if char in INTEGERS:
+        if state in (STATE_ZERO, STATE_INTEGER):
             raise LexicalError(
-                "Integer cannot start with leading 0",
+                f'Invalid character "{char}" in integer',
                 self.working_position,
             )
-        raise LexicalError(
-            f'Invalid character "{char}" in integer',
-            self.working_position,
-        )
-
-    def _stage3(self) -> Token:
-        if self.working_position >= len(self.program):
-            return self._validate_integer(self.accum)
-        char = self.program[self.working_position]
-        if char in INTEGERS:
-            self.accum += char
-            self.working_position += 1
-            return self._stage3()
-        if char in DELIMITERS:
-            return self._validate_integer(self.accum)
-        raise LexicalError(
-            f'Invalid character "{char}" in integer',
-            self.working_position,
-        )
-
-    def _categorize_operator(self, operator: str):
-        if operator == "+":
-            return Token(self.position.copy(), TokenType.PLUS)
-        if operator == "-":
-            return Token(self.position.copy(), TokenType.MINUS)
-        if operator == "*":
-            return Token(self.position.copy(), TokenType.TIMES)
-        if operator == "/":
-            return Token(self.position.copy(), TokenType.DIVIDE)
-        if operator == "<":
-            return Token(self.position.copy(), TokenType.LESS_THAN)
-        if operator == "=":
-            return Token(self.position.copy(), TokenType.EQUAL)
-        raise LexicalError(
-            f'Unable to categorize operator: "{operator}"',
-            self.working_position,
-        )
-
-    def _stage4(self) -> Token:
-        return self._categorize_operator(self.accum)
-
-    def _stage5(self) -> Token | None:
-        if self.working_position >= len(self.program):
-            return self._categorize_punctuation(self.accum)
-        char = self.program[self.working_position]
-        if char in "*":
-            self.accum += char
-            self.working_position += 1
-            return self._stage6()
-        return self._categorize_punctuation(self.accum)
-
-    def _stage6(self) -> Token | None:
-        # Inside of a comment block, in order to avoid crazy recursion depth, we
-        # walk through the entire block in one function to avoid crazy recursion depth
-        while True:
-            if self.working_position >= len(self.program):
-                raise LexicalError(
-                    "All comments must be terminated before program ends",
-                    self.working_position,
-                )
-
-            char = self.program[self.working_position]
-            self.accum += char
-            self.working_position += 1
-            if char == "\n":
-                self.working_position.add_newline()
-            if char in "*":
-                return self._stage7()
-
-    def _stage7(self) -> Token | None:
-        if self.working_position >= len(self.program):
+        if state in (STATE_COMMENT, STATE_COMMENT_STAR):
             raise LexicalError(
                 "All comments must be terminated before program ends",
                 self.working_position,
             )
-        char = self.program[self.working_position]
-        self.accum += char
-        self.working_position += 1
-        if char == "\n":
-            self.working_position.add_newline()
-        if char in ")":
-            return self._stage8()
-        return self._stage6()
-
-    def _stage8(self) -> None:
-        return
-
-    def _stage9(self) -> None:
-        if self.accum == "\n":
-            self.working_position.add_newline()
-        # Don't return anything; this is whitespace which is ignored
-        # In theory could return token with type whitespace, but I don't
-        # think whitespace is supposed to be a token.
-
-    def _categorize_punctuation(self, punctuation: str):
-        if punctuation == "(":
-            return Token(self.position.copy(), TokenType.LEFT_PAREN)
-        if punctuation == ")":
-            return Token(self.position.copy(), TokenType.RIGHT_PAREN)
-        if punctuation == ",":
-            return Token(self.position.copy(), TokenType.COMMA)
-        if punctuation == ":":
-            return Token(self.position.copy(), TokenType.COLON)
         raise LexicalError(
-            f'Unable to categorize punctuation: "{punctuation}"',
+            f'Unable to scan character "{char}"',
             self.working_position,
         )
 
-    def _stage10(self) -> Token:
-        return self._categorize_punctuation(self.accum)
+    def _categorize_identifier(self, identifier: str, position: Position) -> Token:
+        if len(identifier) > MAX_IDENTIFIER_LENGTH:
+            raise LexicalError(
+                f"Identifiers cannot be longer than {MAX_IDENTIFIER_LENGTH} characters",
+                self.working_position,
+            )
+        if identifier in KEYWORDS:
+            token_type = KEYWORDS[identifier]
+            return Token(position, token_type)
+        if identifier in BOOLEANS:
+            return Token(position, TokenType.BOOLEAN, identifier)
+        return Token(position, TokenType.IDENTIFIER, identifier)
+
+    def _validate_integer(self, value: str, position: Position) -> Token:
+        # Very long literals are out of bounds anyway, so skip converting them
+        too_long = len(value) > len(str(MAX_INTEGER_INCL))
+        if too_long or not MIN_INTEGER_INCL <= int(value) <= MAX_INTEGER_INCL:
+            raise LexicalError(
+                f"Integer literal must be bounded between {MIN_INTEGER_INCL} (incl) and {MAX_INTEGER_INCL} (incl).",
+                self.working_position,
+            )
+        return Token(position, TokenType.INTEGER, value)
 
     def has_next(self) -> bool:
         return not self.has_terminated
@@ -1,69 +1,194 @@
 from abc import ABC, abstractmethod
-from typing import ClassVar
+from collections.abc import Iterable
+from dataclasses import dataclass
+from typing import TextIO
+
+from typing_extensions import override
+
+from compiler.klein_errors import TMError
+
+# Every function starts with a `Function: <name>` comment, which is how tools
+# reading tm code find where functions start
+FUNCTION_MARKER = "Function: "
+
+REG_ZERO = 0
+REG_PC = 7
+
+
+@dataclass
+class ColumnWidths:
+    line_num: int = 0
+    command: int = 0
+    register_section: int = 0
 
 
 class TMLine(ABC):
     @abstractmethod
-    def print(self):
-        raise NotImplementedError("Printing must be implemented by subclass")
+    def format(self, widths: ColumnWidths) -> str:
+        raise NotImplementedError("Formatting must be implemented by subclass")
 
 
 class Comment(TMLine):
     def __init__(self, comment: str):
         self._comment: str = comment
 
-    def print(self):
+    @property
+    def text(self) -> str:
+        return self._comment
+
+    @override
+    def format(self, widths: ColumnWidths) -> str:
         if len(self._comment) == 0:
-            print("*")
-        else:
-            print(f"* {self._comment}")
+            return "*"
+        return f"* {self._comment}"
 
 
 class TMCommand(TMLine):
-    max_line_size: ClassVar[int] = 0
-    max_command_size: ClassVar[int] = 0
-    max_register_section: ClassVar[int] = 0
-    seen_line_nums: ClassVar[set[int]] = set()
-    current_line_num: int = 0
-
     def __init__(
         self,
         command: str,
+        operands: tuple[int, int, int],
         register_section: str,
         comment: str | None = None,
         line_num: int | None = None,
     ):
-        if line_num in TMCommand.seen_line_nums:
-            raise IndexError(f"Duplicated line number {line_num}")
-        self.line_num: int = line_num or TMCommand.current_line_num
+        # Commands without a line number are given one by the TMEmitter they are
+        # emitted into
+        self.line_num: int | None = line_num
         self.command: str = command
+        self.operands: tuple[int, int, int] = operands
         self.register_section: str = register_section
         self.comment: str | None = comment
 
-        TMCommand.current_line_num += 1
-        TMCommand.max_line_size = max(TMCommand.max_line_size, len(str(self.line_num)))
-        TMCommand.max_command_size = max(TMCommand.max_command_size, len(self.command))
-        TMCommand.max_register_section = max(
-            TMCommand.max_register_section,
-            len(self.register_section),
-        )
-
-    def print(
-        self,
-    ):
-        line_num_formatted = str(self.line_num).rjust(TMCommand.max_line_size)
-        command_formatted = str(self.command).ljust(TMCommand.max_command_size)
+    @override
+    def format(self, widths: ColumnWidths) -> str:
+        line_num_formatted = str(self.line_num).rjust(widths.line_num)
+        command_formatted = str(self.command).ljust(widths.command)
         if self.comment:
             register_section_formatted = str(self.register_section).ljust(
-                TMCommand.max_register_section,
-            )
-            print(
-                f"{line_num_formatted}: {command_formatted} {register_section_formatted} ; {self.comment}",
+                widths.register_section,
             )
+            return f"{line_num_formatted}: {command_formatted} {register_section_formatted} ; {self.comment}"
+        return f"{line_num_formatted}: {command_formatted} {self.register_section}"
+
+
+class Label(TMLine):
+    # Names the address of the command after it. Labels don't take up any space
+    # in IMEM and are removed when the labels are resolved.
+    def __init__(self, name: str):
+        self.name: str = name
+
+    @override
+    def format(self, widths: ColumnWidths) -> str:
+        return f"* {self.name}:"
+
+
+class LabelReference(TMLine):
+    # A register-memory command whose address is a label. Relative to the program
+    # counter the label becomes an offset from the next command, otherwise
+    # (relative to R0) it becomes the label's absolute address.
+    def __init__(
+        self,
+        command: str,
+        r1: int,
+        label: str,
+        r2: int = REG_ZERO,
+        comment: str | None = None,
+    ):
+        if r2 not in (REG_ZERO, REG_PC):
+            raise TMError(f"{command} can't refer to {label} relative to R{r2}")
+        self.command: str = command
+        self.r1: int = r1
+        self.label: str = label
+        self.r2: int = r2
+        self.comment: str | None = comment
+
+    def resolve(self, address: int, label_address: int) -> "RMCommand":
+        offset = label_address - (address + 1) if self.r2 == REG_PC else label_address
+        return RMCommand(self.command, self.r1, offset, self.r2, self.comment)
+
+    @override
+    def format(self, widths: ColumnWidths) -> str:
+        # Only shown when code is printed before its labels are resolved
+        command_formatted = str(self.command).ljust(widths.command)
+        operands = f"{self.r1},{self.label}({self.r2})"
+        return f"{' ' * widths.line_num}  {command_formatted} {operands}"
+
+
+def resolve_labels(lines: Iterable[TMLine]) -> list[TMLine]:
+    # Two pass assembly: the first pass finds the address of every label, the
+    # second replaces the references to them with commands and drops the labels
+    program = list(lines)
+    addresses: dict[str, int] = {}
+    address = 0
+    for line in program:
+        if isinstance(line, Label):
+            if line.name in addresses:
+                raise TMError(f"Label {line.name} is defined more than once")
+            addresses[line.name] = address
+        elif isinstance(line, (TMCommand, LabelReference)):
+            address += 1
+
+    resolved: list[TMLine] = []
+    address = 0
+    for line in program:
+        if isinstance(line, Label):
+            continue
+        if isinstance(line, LabelReference):
+            if line.label not in addresses:
+                raise TMError(f"Undefined label {line.label}")
+            resolved.append(line.resolve(address, addresses[line.label]))
         else:
-            print(
-                f"{line_num_formatted}: {command_formatted} {self.register_section}",
-            )
+            resolved.append(line)
+        if isinstance(line, (TMCommand, LabelReference)):
+            address += 1
+    return resolved
+
+
+class TMEmitter:
+    # Collects the lines of a single tm program. Commands are given the next line
+    # number as they are emitted, and the column widths are only worked out once
+    # the whole program is known, so every compilation gets its own emitter and
+    # nothing is shared between them.
+    def __init__(self):
+        self.lines: list[TMLine] = []
+        self.next_line_num: int = 0
+        self._seen_line_nums: set[int] = set()
+
+    def emit(self, line: TMLine):
+        if isinstance(line, TMCommand):
+            if line.line_num is None:
+                line.line_num = self.next_line_num
+            if line.line_num in self._seen_line_nums:
+                raise IndexError(f"Duplicated line number {line.line_num}")
+            self._seen_line_nums.add(line.line_num)
+            self.next_line_num += 1
+        self.lines.append(line)
+
+    def extend(self, lines: Iterable[TMLine]):
+        for line in lines:
+            self.emit(line)
+
+    def column_widths(self) -> ColumnWidths:
+        widths = ColumnWidths()
+        for line in self.lines:
+            if isinstance(line, TMCommand):
+                widths.line_num = max(widths.line_num, len(str(line.line_num)))
+                widths.command = max(widths.command, len(line.command))
+                widths.register_section = max(
+                    widths.register_section,
+                    len(line.register_section),
+                )
+        return widths
+
+    def render(self) -> str:
+        # The whole program is formatted into one string so it can be written out
+        # at once instead of a line at a time
+        widths = self.column_widths()
+        return "".join(f"{line.format(widths)}\n" for line in self.lines)
+
+    def write(self, file: TextIO):
+        _ = file.write(self.render())
 
 
 class ROCommand(TMCommand):
@@ -78,6 +203,7 @@ class ROCommand(TMCommand):
     ):
         super().__init__(
             command,
+            (r1, r2, r3),
             f"{r1},{r2},{r3}",
             comment,
             line_num,
@@ -197,6 +323,7 @@ class RMCommand(TMCommand):
     ):
         super().__init__(
             command,
+            (r1, offset, r2),
             f"{r1},{offset}({r2})",
             comment,
             line_num,
@@ -0,0 +1,402 @@
+import re
+from array import array
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass, field
+
+from compiler.klein_errors import TMError
+from compiler.tm import FUNCTION_MARKER, Comment, TMCommand, TMLine
+
+REG_STATUS = 5
+REG_PC = 7
+REGISTER_COUNT = 8
+IMEM_SIZE = 1024
+DMEM_SIZE = 1024
+
+# An instruction's opcode is its index in this tuple. The register only (RO)
+# instructions come first, everything from LD on takes a memory operand (RM).
+OPCODES: tuple[str, ...] = (
+    "HALT",
+    "IN",
+    "OUT",
+    "ADD",
+    "SUB",
+    "MUL",
+    "DIV",
+    "LD",
+    "ST",
+    "LDA",
+    "LDC",
+    "JLT",
+    "JLE",
+    "JEQ",
+    "JNE",
+    "JGE",
+    "JGT",
+)
+OPCODE_NUMBERS: dict[str, int] = {name: idx for idx, name in enumerate(OPCODES)}
+(
+    HALT,
+    IN,
+    OUT,
+    ADD,
+    SUB,
+    MUL,
+    DIV,
+    LD,
+    ST,
+    LDA,
+    LDC,
+    JLT,
+    JLE,
+    JEQ,
+    JNE,
+    JGE,
+    JGT,
+) = range(len(OPCODES))
+
+# Matches `12: ADD 1,2,3` and `12: LD 1,-4(5)`, anything after the operands is a
+# comment
+INSTRUCTION_PATTERN = re.compile(
+    r"""
+    \s*(?P<address>\d+)\s*:\s*(?P<opcode>[A-Za-z]+)\s+
+    (?P<r>-?\d+)\s*,\s*(?P<s>-?\d+)\s*
+    (?:,\s*(?P<t>-?\d+)|\(\s*(?P<base>-?\d+)\s*\))
+    """,
+    re.VERBOSE,
+)
+# Name given to the instructions before the first function
+SETUP_FUNCTION = "<setup>"
+
+
+class TMProgram:
+    # The instructions are kept in four parallel arrays indexed by address: the
+    # opcode and its three operands (r,s,t for RO instructions and r,d(s) for RM
+    # instructions). Addresses that are never set hold HALT 0,0,0.
+    def __init__(self, size: int = IMEM_SIZE):
+        self.opcodes: array[int] = array("b", bytes(size))
+        self.r: array[int] = array("q", bytes(8 * size))
+        self.s: array[int] = array("q", bytes(8 * size))
+        self.t: array[int] = array("q", bytes(8 * size))
+        # The address each function starts at, in the order they appear
+        self.functions: list[tuple[int, str]] = []
+
+    def set(self, address: int, opcode: str, operands: tuple[int, int, int]):
+        if not 0 <= address < len(self.opcodes):
+            raise TMError(f"Address {address} is outside of instruction memory")
+        if opcode not in OPCODE_NUMBERS:
+            raise TMError(f"Unknown opcode {opcode} at address {address}")
+        # Registers are checked here so running the program never has to
+        registers = operands if OPCODE_NUMBERS[opcode] < LD else operands[::2]
+        for register in registers:
+            if not 0 <= register < REGISTER_COUNT:
+                raise TMError(f"{opcode} at address {address} uses register {register}")
+        self.opcodes[address] = OPCODE_NUMBERS[opcode]
+        self.r[address], self.s[address], self.t[address] = operands
+
+    def format_instruction(self, address: int) -> str:
+        opcode = self.opcodes[address]
+        r, s, t = self.r[address], self.s[address], self.t[address]
+        if opcode >= LD:
+            return f"{OPCODES[opcode]} {r},{s}({t})"
+        return f"{OPCODES[opcode]} {r},{s},{t}"
+
+    def function_at(self) -> list[str]:
+        # Maps every address to the function it belongs to
+        names = [SETUP_FUNCTION] * len(self.opcodes)
+        for idx, (start, name) in enumerate(self.functions):
+            end = (
+                self.functions[idx + 1][0]
+                if idx + 1 < len(self.functions)
+                else len(self.opcodes)
+            )
+            names[start:end] = [name] * (end - start)
+        return names
+
+
+def assemble(lines: Iterable[TMLine], size: int = IMEM_SIZE) -> TMProgram:
+    # Comments are skipped, every command has been given its line number by the
+    # emitter that produced it
+    program = TMProgram(size)
+    function: str | None = None
+    for line in lines:
+        if isinstance(line, Comment) and line.text.startswith(FUNCTION_MARKER):
+            function = line.text.removeprefix(FUNCTION_MARKER)
+        elif isinstance(line, TMCommand):
+            if line.line_num is None:
+                raise TMError(f"{line.command} has not been given a line number")
+            program.set(line.line_num, line.command, line.operands)
+            if function is not None:
+                program.functions.append((line.line_num, function))
+                function = None
+    return program
+
+
+def parse_tm(text: str, size: int = IMEM_SIZE) -> TMProgram:
+    program = TMProgram(size)
+    function: str | None = None
+    for line_number, line in enumerate(text.split("\n"), start=1):
+        stripped = line.strip()
+        if stripped.startswith("*"):
+            comment = stripped.removeprefix("*").strip()
+            if comment.startswith(FUNCTION_MARKER):
+                function = comment.removeprefix(FUNCTION_MARKER)
+            continue
+        if len(stripped) == 0:
+            continue
+        match = INSTRUCTION_PATTERN.match(line)
+        if match is None:
+            raise TMError(f"Unable to parse line {line_number}: {stripped}")
+        opcode = match.group("opcode").upper()
+        is_rm = match.group("base") is not None
+        if opcode in OPCODE_NUMBERS and is_rm != (OPCODE_NUMBERS[opcode] >= LD):
+            raise TMError(
+                f"Wrong operand format for {opcode} on line {line_number}: {stripped}",
+            )
+        address = int(match.group("address"))
+        program.set(
+            address,
+            opcode,
+            (
+                int(match.group("r")),
+                int(match.group("s")),
+                int(match.group("base") if is_rm else match.group("t")),
+            ),
+        )
+        if function is not None:
+            program.functions.append((address, function))
+            function = None
+    return program
+
+
+def read_input() -> int:
+    return int(input("Enter value for IN instruction: "))
+
+
+def write_output(value: int):
+    print(value)
+
+
+@dataclass
+class FunctionProfile:
+    name: str
+    calls: int = 0
+    instructions: int = 0
+
+
+@dataclass
+class TMProfile:
+    instructions_executed: int = 0
+    address_counts: list[int] = field(default_factory=list)
+    functions: dict[str, FunctionProfile] = field(default_factory=dict)
+    max_call_depth: int = 0
+    # How often each function's first address was reached by a call
+    call_counts: dict[int, int] = field(default_factory=dict)
+    # Highest DMEM address stored to, which is how deep the stack of frames got
+    max_stored_address: int = -1
+
+    def report(self, program: TMProgram, hot_spots: int = 20) -> str:
+        total = max(self.instructions_executed, 1)
+        lines = [
+            f"instructions executed: {self.instructions_executed}",
+            f"max call depth:        {self.max_call_depth}",
+            f"max stored address:    {self.max_stored_address}",
+            "",
+            f"{'function':<24} {'calls':>10} {'instructions':>14} {'share':>7}",
+        ]
+        for function in sorted(
+            self.functions.values(),
+            key=lambda function: (-function.instructions, function.name),
+        ):
+            lines.append(
+                f"{function.name:<24} {function.calls:>10} "
+                + f"{function.instructions:>14} "
+                + f"{function.instructions / total:>7.1%}",
+            )
+
+        names = program.function_at()
+        lines.extend(
+            [
+                "",
+                f"{'address':>7} {'count':>12} {'share':>7}  {'function':<24} instruction",
+            ],
+        )
+        executed_addresses = sorted(
+            (address for address, count in enumerate(self.address_counts) if count > 0),
+            key=lambda address: (-self.address_counts[address], address),
+        )
+        for address in executed_addresses[:hot_spots]:
+            count = self.address_counts[address]
+            lines.append(
+                f"{address:>7} {count:>12} {count / total:>7.1%}  "
+                + f"{names[address]:<24} {program.format_instruction(address)}",
+            )
+        return "\n".join(lines) + "\n"
+
+
+class TMMachine:
+    def __init__(
+        self,
+        program: TMProgram,
+        dmem_size: int = DMEM_SIZE,
+        read_input: Callable[[], int] = read_input,
+        write_output: Callable[[int], None] = write_output,
+    ):
+        self._program: TMProgram = program
+        self._read_input: Callable[[], int] = read_input
+        self._write_output: Callable[[int], None] = write_output
+        self.registers: array[int] = array("q", bytes(8 * REGISTER_COUNT))
+        self.dmem: array[int] = array("q", bytes(8 * dmem_size))
+        self.instructions_executed: int = 0
+
+    def run(self, arguments: Iterable[int] = ()) -> int:
+        # Runs the program from address 0 until it halts, with the arguments in
+        # DMEM[1..n] (where klein's main expects them) and DMEM[0] holding the
+        # highest address like the reference TM. Returns the number of instructions
+        # executed.
+        return self._execute(arguments, None)
+
+    def profile(self, arguments: Iterable[int] = ()) -> TMProfile:
+        # Runs the program the same way as run(), while counting how often each
+        # address is executed. A function is called whenever its first
+        # instruction runs right after a jump whose next instruction is the
+        # return address in the new frame (a tail call jumping back to the start
+        # of a function leaves the original return address in place), and
+        # returns whenever the program counter is loaded from memory (which is
+        # how the generated code returns).
+        profile = TMProfile()
+        _ = self._execute(arguments, profile)
+        names = self._program.function_at()
+        profile.functions = {
+            name: FunctionProfile(name)
+            for name in [SETUP_FUNCTION, *(name for _, name in self._program.functions)]
+        }
+        for address, count in enumerate(profile.address_counts):
+            profile.functions[names[address]].instructions += count
+        for start, name in self._program.functions:
+            profile.functions[name].calls += profile.call_counts.get(start, 0)
+        return profile
+
+    def _execute(self, arguments: Iterable[int], profile: TMProfile | None) -> int:
+        registers = self.registers
+        dmem = self.dmem
+        dmem_size = len(dmem)
+        for idx in range(REGISTER_COUNT):
+            registers[idx] = 0
+        for idx in range(dmem_size):
+            dmem[idx] = 0
+        dmem[0] = dmem_size - 1
+        for idx, argument in enumerate(arguments, start=1):
+            if idx >= dmem_size:
+                raise TMError("Too many arguments for data memory")
+            dmem[idx] = argument
+
+        opcodes = self._program.opcodes
+        rs = self._program.r
+        ss = self._program.s
+        ts = self._program.t
+        imem_size = len(opcodes)
+        read = self._read_input
+        write = self._write_output
+        executed = 0
+        pc = 0
+        profiling = profile is not None
+        address_counts = [0] * imem_size
+        function_starts = {start for start, _ in self._program.functions}
+        call_counts: dict[int, int] = {}
+        previous_pc = -1
+        call_depth = 0
+        max_call_depth = 0
+        max_stored_address = -1
+        try:
+            # The opcodes are checked roughly in order of how often generated code
+            # uses them. The program counter is written back before each
+            # instruction runs, since instructions can read and write it.
+            while True:
+                pc = registers[REG_PC]
+                if not 0 <= pc < imem_size:
+                    raise TMError(
+                        f"Program counter {pc} is outside of instruction memory",
+                    )
+                registers[REG_PC] = pc + 1
+                executed += 1
+                opcode = opcodes[pc]
+                r = rs[pc]
+                s = ss[pc]
+                t = ts[pc]
+                if profiling:
+                    address_counts[pc] += 1
+                    status = registers[REG_STATUS]
+                    if (
+                        pc in function_starts
+                        and 0 <= status < dmem_size
+                        and dmem[status] == previous_pc + 1
+                    ):
+                        call_counts[pc] = call_counts.get(pc, 0) + 1
+                        call_depth += 1
+                        max_call_depth = max(max_call_depth, call_depth)
+                    previous_pc = pc
+                    if opcode == LD and r == REG_PC:
+                        call_depth -= 1
+                    elif opcode == ST:
+                        max_stored_address = max(max_stored_address, s + registers[t])
+                if opcode == LD:
+                    address = s + registers[t]
+                    if not 0 <= address < dmem_size:
+                        raise TMError(
+                            f"LD from address {address} at {pc} is outside of data memory",
+                        )
+                    registers[r] = dmem[address]
+                elif opcode == ST:
+                    address = s + registers[t]
+                    if not 0 <= address < dmem_size:
+                        raise TMError(
+                            f"ST to address {address} at {pc} is outside of data memory",
+                        )
+                    dmem[address] = registers[r]
+                elif opcode == LDA:
+                    registers[r] = s + registers[t]
+                elif opcode == LDC:
+                    registers[r] = s
+                elif opcode == ADD:
+                    registers[r] = registers[s] + registers[t]
+                elif opcode == SUB:
+                    registers[r] = registers[s] - registers[t]
+                elif opcode >= JLT:
+                    value = registers[r]
+                    if (
+                        (opcode == JEQ and value == 0)
+                        or (opcode == JNE and value != 0)
+                        or (opcode == JLT and value < 0)
+                        or (opcode == JLE and value <= 0)
+                        or (opcode == JGT and value > 0)
+                        or (opcode == JGE and value >= 0)
+                    ):
+                        registers[REG_PC] = s + registers[t]
+                elif opcode == MUL:
+                    registers[r] = registers[s] * registers[t]
+                elif opcode == DIV:
+                    divisor = registers[t]
+                    if divisor == 0:
+                        raise TMError(f"Division by zero at {pc}")
+                    # Division truncates towards zero like the reference TM
+                    quotient = abs(registers[s]) // abs(divisor)
+                    registers[r] = (
+                        -quotient if (registers[s] < 0) != (divisor < 0) else quotient
+                    )
+                elif opcode == OUT:
+                    write(registers[r])
+                elif opcode == IN:
+                    registers[r] = read()
+                else:
+                    break
+        except OverflowError as e:
+            raise TMError(f"Integer overflow at {pc}") from e
+        finally:
+            self.instructions_executed = executed
+            if profile is not None:
+                profile.instructions_executed = executed
+                profile.address_counts = address_counts
+                profile.max_call_depth = max_call_depth
+                profile.call_counts = call_counts
+                profile.max_stored_address = max_stored_address
+        return executed
@@ -0,0 +1,134 @@
+from collections.abc import Iterable
+from pathlib import Path
+from typing import Any
+
+from compiler.ast_nodes import Program
+from compiler.code_generator import CodeGenerator
+from compiler.constant_folding import fold_constants
+from compiler.inliner import inline_functions
+from compiler.memoization import memoized_functions
+from compiler.parser import Parser
+from compiler.scanner import Scanner
+from compiler.semantic_analyzer import SemanticAnalyzer
+from compiler.symbol_table import SymbolTable
+from compiler.tm import TMEmitter
+from compiler.tm_vm import TMMachine, TMProfile, assemble
+
+PROGRAMS_DIR = Path(__file__).parent / "programs"
+
+# Arguments to run each sample program with (programs that don't pass semantic
+# analysis are left out)
+PROGRAM_ARGUMENTS: dict[str, list[list[int]]] = {
+    "average-digit.kln": [[1234]],
+    "circular-prime.kln": [[11], [50]],
+    "divide.kln": [[7, 3, 5]],
+    "divisible-by-seven.kln": [[49], [50]],
+    "euclid.kln": [[48, 18], [17, 5]],
+    "factors.kln": [[60]],
+    "farey.kln": [[3, 7, 10]],
+    "fibonacci.kln": [[10], [0]],
+    "generate-excellent.kln": [[2]],
+    "horner-hardcoded.kln": [[3]],
+    "horner-parameters.kln": [[1, 2, 3, 4, 5]],
+    "is-cantor-number-bool.kln": [[10], [12]],
+    "is-cantor-number-fast.kln": [[12]],
+    "is-cantor-number-v4.kln": [[13]],
+    "is-cantor-number.kln": [[20]],
+    "is-excellent.kln": [[48], [3468]],
+    "is-special.kln": [[145]],
+    "lib.kln": [[5]],
+    "modulus-by-hand.kln": [[17, 5]],
+    "palindrome.kln": [[12321], [123]],
+    "print-one.kln": [[]],
+    "public-private.kln": [[7, 11]],
+    "russian-peasant.kln": [[13, 7]],
+    "sieve-no-cli.kln": [[0]],
+    "sieve.kln": [[30]],
+    "sqrt-newton.kln": [[100, 1]],
+    "sum-factors.kln": [[28]],
+    "two-primes.kln": [[10, 1]],
+}
+
+# Every run of a sample program, to parametrize tests with
+PROGRAM_RUNS: list[tuple[str, list[int]]] = [
+    (filename, arguments)
+    for filename, runs in PROGRAM_ARGUMENTS.items()
+    for arguments in runs
+]
+
+
+def analyze(source: str) -> tuple[Program, SymbolTable]:
+    ast = Parser(Scanner(source)).parse()
+    semantic_analyzer = SemanticAnalyzer(ast)
+    semantic_analyzer.annotate()
+    return ast, semantic_analyzer.symbol_table
+
+
+def generate(  # noqa: PLR0913
+    ast: Program,
+    symbol_table: SymbolTable,
+    code_generator_class: type[CodeGenerator] = CodeGenerator,
+    *,
+    inlining: bool = False,
+    constant_folding: bool = False,
+    memoization: bool = False,
+    **options: Any,  # noqa: ANN401
+) -> CodeGenerator:
+    # Generates code the way klein_compile does, with the optimizations that run
+    # before code generation turned on by their flag and the rest passed on to
+    # the code generator
+    if inlining:
+        _ = inline_functions(ast, symbol_table)
+    if constant_folding:
+        ast = fold_constants(ast)
+    if memoization:
+        options["memoized_functions"] = memoized_functions(ast, symbol_table)
+    code_generator = code_generator_class(ast, symbol_table, **options)
+    code_generator.generate()
+    return code_generator
+
+
+def compile_program(
+    source: str,
+    code_generator_class: type[CodeGenerator] = CodeGenerator,
+    **options: Any,  # noqa: ANN401
+) -> CodeGenerator:
+    return generate(*analyze(source), code_generator_class, **options)
+
+
+def load(
+    program: CodeGenerator | TMEmitter,
+    outputs: list[int],
+    dmem_size: int = 10000,
+    *,
+    inputs: Iterable[int] = (),
+) -> TMMachine:
+    # A TM machine reading the program's IN commands from inputs and writing
+    # its output to outputs
+    return TMMachine(
+        assemble(program.lines),
+        dmem_size=dmem_size,
+        read_input=iter(inputs).__next__,
+        write_output=outputs.append,
+    )
+
+
+def profile(
+    program: CodeGenerator | TMEmitter,
+    arguments: list[int],
+    dmem_size: int = 10000,
+) -> tuple[list[int], TMProfile]:
+    outputs: list[int] = []
+    return outputs, load(program, outputs, dmem_size).profile(arguments)
+
+
+def run(
+    program: CodeGenerator | TMEmitter,
+    arguments: Iterable[int] = (),
+    dmem_size: int = 10000,
+    *,
+    inputs: Iterable[int] = (),
+) -> list[int]:
+    outputs: list[int] = []
+    _ = load(program, outputs, dmem_size, inputs=inputs).run(arguments)
+    return outputs
@@ -0,0 +1,372 @@
+import pytest
+
+from compiler.ast_nodes import (
+    AndExpression,
+    BinaryExpression,
+    BooleanLiteral,
+    DivideExpression,
+    EqualsExpression,
+    Expression,
+    FunctionCallExpression,
+    Identifier,
+    IfExpression,
+    IntegerLiteral,
+    LessThanExpression,
+    MinusExpression,
+    NotExpression,
+    OrExpression,
+    PlusExpression,
+    Program,
+    TimesExpression,
+    UnaryMinusExpression,
+)
+from compiler.klein_errors import TMError
+from compiler.tm import FUNCTION_MARKER
+from tests.harness import (
+    PROGRAM_RUNS,
+    PROGRAMS_DIR,
+    analyze,
+    compile_program,
+    generate,
+    load,
+    run,
+)
+
+
+def evaluate(program: Program, arguments: list[int]) -> list[int]:
+    # Interprets the ast directly, with booleans as 0 and 1 like the generated
+    # code. Returns everything printed followed by main's return value.
+    definitions = {
+        definition.name.value: definition for definition in program.definition_list
+    }
+    outputs: list[int] = []
+
+    def call(name: str, values: list[int]) -> int:
+        definition = definitions[name]
+        parameters = {
+            parameter.name.value: value
+            for parameter, value in zip(definition.parameters, values, strict=True)
+        }
+        for print_expression in definition.body.print_expressions:
+            outputs.append(
+                evaluate_expression(
+                    print_expression.argument_list.arguments[0].value,
+                    parameters,
+                ),
+            )
+        return evaluate_expression(definition.body.body, parameters)
+
+    def evaluate_expression(
+        expression: Expression,
+        parameters: dict[str, int],
+    ) -> int:
+        if isinstance(expression, IntegerLiteral):
+            return int(expression.value)
+        if isinstance(expression, BooleanLiteral):
+            return int(expression.value == "true")
+        if isinstance(expression, Identifier):
+            return parameters[expression.value]
+        if isinstance(expression, UnaryMinusExpression):
+            return -evaluate_expression(expression.value, parameters)
+        if isinstance(expression, NotExpression):
+            return 1 - evaluate_expression(expression.value, parameters)
+        if isinstance(expression, IfExpression):
+            if evaluate_expression(expression.condition, parameters):
+                return evaluate_expression(expression.consequent, parameters)
+            return evaluate_expression(expression.alternative, parameters)
+        if isinstance(expression, FunctionCallExpression):
+            return call(
+                expression.function_name.value,
+                [
+                    evaluate_expression(argument.value, parameters)
+                    for argument in expression.argument_list.arguments
+                ],
+            )
+        assert isinstance(expression, BinaryExpression)
+        left = evaluate_expression(expression.left_side, parameters)
+        if isinstance(expression, AndExpression):
+            return evaluate_expression(expression.right_side, parameters) if left else 0
+        if isinstance(expression, OrExpression):
+            return 1 if left else evaluate_expression(expression.right_side, parameters)
+        right = evaluate_expression(expression.right_side, parameters)
+        if isinstance(expression, DivideExpression):
+            quotient = abs(left) // abs(right)
+            return -quotient if (left < 0) != (right < 0) else quotient
+        operations = {
+            PlusExpression: lambda: left + right,
+            MinusExpression: lambda: left - right,
+            TimesExpression: lambda: left * right,
+            LessThanExpression: lambda: int(left < right),
+            EqualsExpression: lambda: int(left == right),
+        }
+        return operations[type(expression)]()
+
+    outputs.append(call("main", arguments))
+    return outputs
+
+
+@pytest.mark.parametrize(("filename", "arguments"), PROGRAM_RUNS)
+def test_programs(filename: str, arguments: list[int]):
+    ast, symbol_table = analyze((PROGRAMS_DIR / filename).read_text())
+    code_generator = generate(ast, symbol_table)
+    assert run(code_generator, arguments) == evaluate(ast, arguments)
+
+
+def test_main_arguments_keep_their_order():
+    code_generator = compile_program(
+        """
+        function main(a: integer, b: integer, c: integer, d: integer): integer
+          print(a)
+          print(b)
+          print(c)
+          d
+        """,
+    )
+    assert run(code_generator, [1, 2, 3, 4]) == [1, 2, 3, 4]
+
+
+def test_operands_keep_their_order():
+    # The right side needs more registers, but both sides print
+    ast, symbol_table = analyze(
+        """
+        function main(a: integer, b: integer, c: integer): integer
+          f(-b) / (c - f(a))
+        function f(x: integer): integer
+          print(x)
+          x
+        """,
+    )
+    code_generator = generate(ast, symbol_table)
+    assert run(code_generator, [-1, 5, 0]) == evaluate(ast, [-1, 5, 0])
+    assert run(code_generator, [-1, 5, 0]) == [-5, -1, -5]
+
+
+@pytest.mark.parametrize(
+    ("body", "expected"),
+    [
+        # The division fails before the call in the next argument prints
+        ("g(a / b, f(a))", []),
+        ("g(f(a) / b, f(b))", [3]),
+        # The call in a tail call's first argument prints before the division in
+        # the second, even though only the second reads a parameter
+        ("if a = 0 then b else main(f(5), a / b)", [5]),
+    ],
+)
+def test_arguments_keep_their_order(body: str, expected: list[int]):
+    code_generator = compile_program(
+        f"""
+        function main(a: integer, b: integer): integer
+          {body}
+        function f(x: integer): integer
+          print(x)
+          x
+        function g(x: integer, y: integer): integer
+          x + y
+        """,
+    )
+    outputs: list[int] = []
+    with pytest.raises(TMError, match="Division by zero"):
+        _ = load(code_generator, outputs).run([3, 0])
+    assert outputs == expected
+
+
+def test_spilling():
+    # Needs more registers than there are general purpose registers
+    source = """
+        function main(a: integer, b: integer, c: integer, d: integer): integer
+          ((((a + b) * (c - d)) - ((a * c) + (b - d)))
+            * (((a - c) * (b + d)) + ((d * b) - (c + a))))
+          - f((a + b) * (c - d), f(a, b) + f(c, d) * ((a + c) * (b + d)))
+        function f(x: integer, y: integer): integer
+          x - y
+    """
+    ast, symbol_table = analyze(source)
+    code_generator = generate(ast, symbol_table)
+    assert "Spill left side" in code_generator.render()
+    assert run(code_generator, [3, 5, 7, 11]) == evaluate(ast, [3, 5, 7, 11])
+
+
+def test_no_spilling_for_simple_expressions():
+    code_generator = compile_program(
+        """
+        function main(a: integer, b: integer): boolean
+          ((a + 1) * (b - 2) < a / b + -a) or not (a = b)
+        """,
+    )
+    code = code_generator.render()
+    assert "Spill" not in code
+    assert "temporaries" not in code
+
+
+@pytest.mark.parametrize(
+    "condition",
+    [
+        "a < b",
+        "a = 0",
+        "0 < b",
+        "not (a < b)",
+        "(a < b) and (b < c)",
+        "(a < b) or (c < b)",
+        "not ((a < b) and (b < c)) or (a = c)",
+        "((a < b) or (b < c)) and not (a = c)",
+        "(b = 0) or (a / b < 2)",
+        "not ((b = 0) or not (a / b < 2))",
+        "positive(a) and positive(b)",
+        "(a = b) = (b = c)",
+    ],
+)
+def test_conditions(condition: str):
+    ast, symbol_table = analyze(
+        f"""
+        function main(a: integer, b: integer, c: integer): integer
+          if {condition} then 10 * a + b else c
+        function positive(n: integer): boolean
+          0 < n
+        """,
+    )
+    code_generator = generate(ast, symbol_table)
+    for arguments in ([1, 2, 3], [3, 2, 1], [0, 0, 0], [2, 0, 2], [-1, 1, -1]):
+        assert run(code_generator, arguments) == evaluate(ast, arguments)
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        "(a < b) and (b < c)",
+        "(a < b) or (b < c)",
+        "not (a < b)",
+        "not (a < b) and (c = 0)",
+        "(a < b) or (b < c) or (c = 0)",
+    ],
+)
+def test_boolean_values(value: str):
+    ast, symbol_table = analyze(
+        f"""
+        function main(a: integer, b: integer, c: integer): boolean
+          {value}
+        """,
+    )
+    code_generator = generate(ast, symbol_table)
+    for arguments in ([1, 2, 3], [3, 2, 1], [0, 0, 0], [2, 0, 2], [-1, 1, -1]):
+        assert run(code_generator, arguments) == evaluate(ast, arguments)
+
+
+def test_conditions_jump_on_comparisons():
+    source = """
+        function main(a: integer, b: integer): integer
+          if (a < b) and not (a = 0) then a else b
+    """
+    code_generator = compile_program(source)
+    # No boolean is computed, the jumps test the difference and a directly
+    code = code_generator.render()
+    assert "True" not in code
+    assert "False" not in code
+    assert "JGE  1," in code
+    assert "JEQ  1," in code
+    assert run(code_generator, [1, 2]) == [1]
+    assert run(code_generator, [0, 2]) == [2]
+
+
+def test_tail_calls_reuse_the_frame():
+    source = """
+        function main(n: integer): integer
+          count(n, 0, 1)
+        function count(n: integer, total: integer, step: integer): integer
+          if n = 0 then
+            total
+          else
+            count(n - step, step + total, identity(step))
+        function identity(x: integer): integer
+          x
+    """
+    ast, symbol_table = analyze(source)
+    profiles = []
+    for tail_calls in (False, True):
+        code_generator = generate(ast, symbol_table, tail_calls=tail_calls)
+        outputs: list[int] = []
+        # Without tail calls, the recursion needs a larger DMEM
+        machine = load(code_generator, outputs, dmem_size=100000)
+        profiles.append(machine.profile([5000]))
+        assert outputs == [5000]
+    without_tail_calls, with_tail_calls = profiles
+    assert without_tail_calls.max_call_depth == 5002
+    assert with_tail_calls.max_call_depth == 3
+    assert with_tail_calls.max_stored_address < 100
+    assert (
+        with_tail_calls.instructions_executed < without_tail_calls.instructions_executed
+    )
+
+
+def test_tail_call_swapping_arguments():
+    code_generator = compile_program(
+        """
+        function main(a: integer, b: integer): integer
+          swap(a, b, 3)
+        function swap(a: integer, b: integer, times: integer): integer
+          print(a)
+          if times = 0 then a - b else swap(b, a, times - 1)
+        """,
+    )
+    assert run(code_generator, [1, 2]) == [1, 2, 1, 2, 1]
+
+
+def test_only_registers_held_by_callers_are_saved():
+    source = """
+        function main(n: integer): integer
+          n + answer()
+        function answer(): integer
+          compute()
+        function compute(): integer
+          print(6)
+          6 * 7
+    """
+    code_generator = compile_program(source, peephole=False)
+    functions = code_generator.render().split(FUNCTION_MARKER)[1:]
+    saves = {
+        function.split("\n", 1)[0]: [
+            register
+            for register in (1, 2, 3)
+            if f"ST   {register},{register}(5)" in function
+        ]
+        for function in functions
+    }
+    # main holds n in R1 while calling answer, which doesn't write R1 but calls
+    # compute and print, which do
+    assert saves == {"print": [1], "main": [], "answer": [], "compute": [1]}
+    assert run(code_generator, [5]) == [6, 47]
+
+
+def test_unreachable_functions_are_left_out():
+    source = """
+        function main(n: integer): integer
+          double(n)
+        function double(n: integer): integer
+          n + n
+        function unused(n: integer): integer
+          print(n)
+          ping(n)
+        function ping(n: integer): integer
+          if n < 1 then 0 else pong(n - 1)
+        function pong(n: integer): integer
+          ping(n)
+    """
+    ast, symbol_table = analyze(source)
+    generated: list[list[str]] = []
+    for dead_function_elimination in (False, True):
+        code_generator = generate(
+            ast,
+            symbol_table,
+            dead_function_elimination=dead_function_elimination,
+        )
+        generated.append(
+            [
+                function.split("\n", 1)[0]
+                for function in code_generator.render().split(FUNCTION_MARKER)[1:]
+            ],
+        )
+        assert run(code_generator, [21]) == [42]
+    # print is only called by a function main never calls
+    assert generated == [
+        ["print", "main", "double", "unused", "ping", "pong"],
+        ["main", "double"],
+    ]
@@ -0,0 +1,141 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from compiler.programs import compile as compile_module
+from compiler.programs.compile import compile_batch, compile_program
+
+PROGRAMS_DIR = Path(__file__).parent / "programs"
+
+
+def test_compile_program(capsys: pytest.CaptureFixture[str]):
+    assert compile_program((PROGRAMS_DIR / "print-one.kln").read_text())
+    assert "HALT" in capsys.readouterr().out
+    assert not compile_program("function main(): integer")
+    assert "Parse Error" in capsys.readouterr().out
+
+
+def test_compile_batch(tmp_path: Path, capsys: pytest.CaptureFixture[str]):
+    program = (PROGRAMS_DIR / "print-one.kln").read_text()
+    assert compile_program(program)
+    expected = capsys.readouterr().out
+
+    for name in ["first.kln", "second.kln"]:
+        _ = (tmp_path / name).write_text(program)
+    assert compile_batch([tmp_path])
+    assert (tmp_path / "first.tm").read_text() == expected
+    assert (tmp_path / "second.tm").read_text() == expected, (
+        "Compiling a program should not affect the next one"
+    )
+    assert "2 of 2 programs compiled" in capsys.readouterr().out
+
+
+def test_compile_batch_failures(tmp_path: Path, capsys: pytest.CaptureFixture[str]):
+    _ = (tmp_path / "invalid.kln").write_text("function main(): integer")
+    assert not compile_batch([tmp_path, tmp_path / "missing.kln"])
+    assert not (tmp_path / "invalid.tm").exists()
+    output = capsys.readouterr().out
+    assert "Parse Error" in output
+    assert "Unable to read" in output
+    assert "0 of 2 programs compiled" in output
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_compile_batch_unwritable_output(
+    tmp_path: Path,
+    capsys: pytest.CaptureFixture[str],
+    jobs: int,
+):
+    program = (PROGRAMS_DIR / "print-one.kln").read_text()
+    for name in ["blocked.kln", "first.kln", "second.kln"]:
+        _ = (tmp_path / name).write_text(program)
+    # A directory is in the way of the tm code
+    (tmp_path / "blocked.tm").mkdir()
+    assert not compile_batch([tmp_path], jobs=jobs)
+    assert (tmp_path / "first.tm").is_file()
+    assert (tmp_path / "second.tm").is_file()
+    output = capsys.readouterr().out
+    assert f"Unable to write {tmp_path / 'blocked.tm'}" in output
+    assert "2 of 3 programs compiled" in output
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_compile_batch_undecodable_source(
+    tmp_path: Path,
+    capsys: pytest.CaptureFixture[str],
+    jobs: int,
+):
+    _ = (tmp_path / "bad.kln").write_bytes(b"\xff\xfe")
+    _ = (tmp_path / "good.kln").write_text((PROGRAMS_DIR / "print-one.kln").read_text())
+    assert not compile_batch([tmp_path], jobs=jobs)
+    assert (tmp_path / "good.tm").is_file()
+    output = capsys.readouterr().out
+    assert f"Unable to read {tmp_path / 'bad.kln'}" in output
+    assert "1 of 2 programs compiled" in output
+
+
+def crash(*_args: object, **_kwargs: object):
+    os._exit(1)
+
+
+def test_compile_batch_worker_crash(
+    tmp_path: Path,
+    capsys: pytest.CaptureFixture[str],
+    monkeypatch: pytest.MonkeyPatch,
+):
+    for name in ["first.kln", "second.kln"]:
+        _ = (tmp_path / name).write_text((PROGRAMS_DIR / "print-one.kln").read_text())
+    # Every worker dies, which breaks the pool
+    monkeypatch.setattr(compile_module, "compile_source", crash)
+    assert not compile_batch([tmp_path], jobs=2)
+    output = capsys.readouterr().out
+    assert "Worker process failed" in output
+    assert "0 of 2 programs compiled" in output
+
+
+def test_compile_batch_in_parallel(tmp_path: Path, capsys: pytest.CaptureFixture[str]):
+    sources = sorted(PROGRAMS_DIR.glob("*.kln"))
+    for source in sources:
+        _ = (tmp_path / source.name).write_text(source.read_text())
+    expected: dict[str, str] = {}
+    _ = compile_batch([tmp_path])
+    for output in sorted(tmp_path.glob("*.tm")):
+        expected[output.name] = output.read_text()
+        output.unlink()
+    sequential_report = capsys.readouterr().out
+
+    _ = compile_batch([tmp_path], jobs=4)
+    assert {
+        output.name: output.read_text() for output in tmp_path.glob("*.tm")
+    } == expected, "Compiling in parallel should write the same files"
+    parallel_report = capsys.readouterr().out
+    for source in sources:
+        assert str(tmp_path / source.name) in parallel_report
+    assert (
+        sequential_report.splitlines()[-1].split(" in ")[0]
+        == (parallel_report.splitlines()[-1].split(" in ")[0])
+    )
+
+
+def test_compile_program_to_output(tmp_path: Path, capsys: pytest.CaptureFixture[str]):
+    program = (PROGRAMS_DIR / "print-one.kln").read_text()
+    assert compile_program(program)
+    expected = capsys.readouterr().out
+
+    output = tmp_path / "print-one.tm"
+    assert compile_program(program, output=output)
+    assert output.read_text() == expected
+    assert capsys.readouterr().out == ""
+
+    assert not compile_program(program, output=tmp_path / "missing" / "out.tm")
+    assert "Unable to write" in capsys.readouterr().out
+
+
+def test_compile_program_with_ir_backend(capsys: pytest.CaptureFixture[str]):
+    program = (PROGRAMS_DIR / "fibonacci.kln").read_text()
+    assert compile_program(program, code_generator_backend="ir")
+    output = capsys.readouterr().out
+    assert "HALT" in output
+    # Each ir instruction is commented above the code generated for it
+    assert "* v1 = param elementWanted" in output
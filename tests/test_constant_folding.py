@@ -0,0 +1,93 @@
+import pytest
+
+from compiler.ast_nodes import (
+    DivideExpression,
+    Expression,
+    FunctionCallExpression,
+    Identifier,
+    NotExpression,
+    PlusExpression,
+    TimesExpression,
+)
+from compiler.constant_folding import boolean_value, fold_constants, integer_value
+from tests.harness import analyze, compile_program, run
+
+
+def fold_main(body: str, return_type: str = "integer") -> Expression:
+    ast, _ = analyze(
+        f"""
+        function main(x: integer, b: boolean): {return_type}
+          {body}
+        function f(x: integer): integer
+          x
+        """,
+    )
+    main = fold_constants(ast).definition_list.definitions[0]
+    return main.body.body
+
+
+@pytest.mark.parametrize(
+    ("body", "value"),
+    [
+        ("1 + 2 * 3", 7),
+        ("(10 - 20) * 3", -30),
+        ("-(2 - 7)", 5),
+        ("- -4", 4),
+        ("-7 / 2", -3),
+        ("7 / -2", -3),
+        ("if 1 < 2 then 3 else f(4)", 3),
+        ("if not (1 = 1) then f(3) else 4 + 0", 4),
+        ("2147483647 - 2147483647 - 1", -1),
+        ("0 - 2147483647 - 1", -2147483648),
+    ],
+)
+def test_folds_integers(body: str, value: int):
+    assert integer_value(fold_main(body)) == value
+
+
+@pytest.mark.parametrize(
+    ("body", "value"),
+    [
+        ("(1 < 2) and not false", True),
+        ("(3 = 4) or (true = false)", False),
+        ("(x < 1) and false", False),
+        ("true or (f(x) < 1)", True),
+        ("b or true", True),
+    ],
+)
+def test_folds_booleans(body: str, value: bool):  # noqa: FBT001
+    assert boolean_value(fold_main(body, "boolean")) is value
+
+
+def test_keeps_runtime_failures_and_overflow():
+    assert isinstance(fold_main("1 / 0"), DivideExpression)
+    assert isinstance(fold_main("2147483647 + 1"), PlusExpression)
+    assert isinstance(fold_main("65536 * 65536"), TimesExpression)
+    # The call has to happen even though its value doesn't matter
+    assert isinstance(fold_main("f(x) * 0"), TimesExpression)
+    assert isinstance(fold_main("(x / 0) * 0"), TimesExpression)
+
+
+def test_simplifies_identities():
+    assert isinstance(fold_main("(x + 0) * 1 - 0"), Identifier)
+    assert isinstance(fold_main("1 * f(x) / 1"), FunctionCallExpression)
+    assert integer_value(fold_main("x * 0")) == 0
+    assert isinstance(
+        fold_main("if b then false else true", "boolean"),
+        NotExpression,
+    )
+
+
+def test_folded_program_runs():
+    program = """
+        function main(n: integer): integer
+          print(2 * 3 - 10)
+          if (n < 10 - 2 * 4) or false then -(1 - 2) else n * (4 / 2 - 1) + 0
+    """
+    outputs: list[tuple[list[int], int]] = []
+    for constant_folding in (False, True):
+        code_generator = compile_program(program, constant_folding=constant_folding)
+        outputs.append((run(code_generator, [5]), len(code_generator.lines)))
+    (unfolded, unfolded_size), (folded, folded_size) = outputs
+    assert unfolded == folded == [-4, 5]
+    assert folded_size < unfolded_size
@@ -0,0 +1,118 @@
+import pytest
+
+from compiler.ast_nodes import SemanticAction
+from compiler.grammar import Grammar, NonTerminal, parse_grammar, read_grammar
+from compiler.klein_errors import GrammarError
+from compiler.parse_table import generate_parse_table
+from compiler.tokens import TokenType
+
+
+def test_parse_grammar():
+    productions = parse_grammar(
+        """
+        // Comments are ignored
+        <PROGRAM> ::= <DEFINITION-LIST> <MAKE-PROGRAM>
+        <DEFINITION-LIST> ::= ε
+                            | "function" <IDENTIFIER>
+                              <DEFINITION-LIST>
+        """,
+    )
+    assert productions == {
+        NonTerminal.PROGRAM: [
+            [NonTerminal.DEFINITION_LIST, SemanticAction.MAKE_PROGRAM],
+        ],
+        NonTerminal.DEFINITION_LIST: [
+            [],
+            [
+                TokenType.KEYWORD_FUNCTION,
+                TokenType.IDENTIFIER,
+                NonTerminal.DEFINITION_LIST,
+            ],
+        ],
+    }, "Alternatives should be able to span multiple lines"
+
+
+@pytest.mark.parametrize(
+    "grammar",
+    [
+        '<PROGRAM> ::= "function" <NOT-A-SYMBOL>',
+        '<PROGRAM> ::= "while"',
+        '<PROGRAM> ::= "function" ?',
+        '<IDENTIFIER> ::= "function"',
+        '"function" <PROGRAM> ::= "function"',
+        '<PROGRAM> ::= "function"\n<PROGRAM> ::= "if"',
+    ],
+)
+def test_parse_invalid_grammar(grammar: str):
+    with pytest.raises(GrammarError):
+        _ = parse_grammar(grammar)
+
+
+def test_first_and_follow_sets():
+    grammar = Grammar(
+        parse_grammar(
+            """
+            <PROGRAM> ::= <TERM> <TERM-REST>
+            <TERM-REST> ::= "+" <TERM> <MAKE-PLUS-EXPRESSION> <TERM-REST>
+                          | ε
+            <TERM> ::= <INTEGER-LITERAL> | "(" <PROGRAM> ")"
+            """,
+        ),
+    )
+    assert grammar.nullable == {NonTerminal.TERM_REST}
+    assert grammar.first == {
+        NonTerminal.PROGRAM: {TokenType.INTEGER, TokenType.LEFT_PAREN},
+        NonTerminal.TERM_REST: {TokenType.PLUS},
+        NonTerminal.TERM: {TokenType.INTEGER, TokenType.LEFT_PAREN},
+    }
+    assert grammar.follow == {
+        NonTerminal.PROGRAM: {TokenType.END_OF_FILE, TokenType.RIGHT_PAREN},
+        NonTerminal.TERM_REST: {TokenType.END_OF_FILE, TokenType.RIGHT_PAREN},
+        NonTerminal.TERM: {
+            TokenType.PLUS,
+            TokenType.END_OF_FILE,
+            TokenType.RIGHT_PAREN,
+        },
+    }
+
+
+def test_undefined_nonterminal():
+    with pytest.raises(GrammarError):
+        _ = Grammar(parse_grammar("<PROGRAM> ::= <TERM>"))
+
+
+def test_conflicts_are_detected():
+    grammar = Grammar(
+        parse_grammar(
+            """
+            <PROGRAM> ::= <TERM> | <FACTOR>
+            <TERM> ::= <INTEGER-LITERAL>
+            <FACTOR> ::= <INTEGER-LITERAL> "+"
+            """,
+        ),
+    )
+    with pytest.raises(GrammarError):
+        _ = grammar.build_parse_table()
+
+
+def test_klein_grammar_matches_hand_made_table():
+    generated = read_grammar("refactored-grammar.txt").build_parse_table()
+    hand_made = generate_parse_table("parse-table.csv")
+    for key, rule in hand_made.items():
+        assert generated[key] == rule, f"Disagreement on {key}"
+    # The hand made follow sets missed a few operators that can follow an if
+    # expression, those are empty rules which the parser never reaches since the
+    # operators are consumed before that point
+    for key in generated.keys() - hand_made.keys():
+        assert generated[key] == []
+
+
+def test_resolved_conflicts():
+    grammar = read_grammar("refactored-grammar.txt")
+    assert grammar.resolved_conflicts == []
+    _ = grammar.build_parse_table()
+    resolved = list(grammar.resolved_conflicts)
+    assert resolved
+    # Building the table again reports the same conflicts, not twice as many
+    _ = grammar.build_parse_table()
+    assert grammar.resolved_conflicts == resolved
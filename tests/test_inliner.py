@@ -0,0 +1,211 @@
+import pytest
+
+from compiler.ast_nodes import Expression, FunctionCallExpression, Program
+from compiler.ast_utils import walk
+from compiler.code_generator import command_count
+from compiler.inliner import InliningDecision, inline_functions
+from compiler.tm_vm import IMEM_SIZE
+from tests.harness import PROGRAMS_DIR, analyze, compile_program, run
+
+
+def inline(source: str) -> tuple[Program, list[InliningDecision]]:
+    ast, symbol_table = analyze(source)
+    return ast, inline_functions(ast, symbol_table)
+
+
+def calls(expression: Expression) -> list[str]:
+    return [
+        subexpression.function_name.value
+        for subexpression in walk(expression)
+        if isinstance(subexpression, FunctionCallExpression)
+    ]
+
+
+def main_body(ast: Program) -> Expression:
+    return ast.definition_list.definitions[0].body.body
+
+
+def test_inlines_small_functions():
+    ast, decisions = inline(
+        """
+        function main(a: integer, b: integer): boolean
+          greater(a, 1)
+        function greater(x: integer, y: integer): boolean
+          not ((x < y) or (x = y))
+        """,
+    )
+    assert calls(main_body(ast)) == []
+    assert decisions == [InliningDecision("main", "greater", inlined=True)]
+
+
+def test_inlines_nested_calls():
+    ast, symbol_table = analyze(
+        """
+        function main(a: integer): integer
+          add_two(a)
+        function add_two(x: integer): integer
+          increment(increment(x))
+        function increment(x: integer): integer
+          x + 1
+        """,
+    )
+    _ = inline_functions(ast, symbol_table)
+    assert calls(main_body(ast)) == []
+    main = symbol_table.scope_lookup("main")
+    increment = symbol_table.scope_lookup("increment")
+    assert main is not None
+    assert increment is not None
+    # add_two inlined both calls to increment before being inlined into main
+    assert main.forward_references == set()
+    assert increment.backward_references == set()
+
+
+@pytest.mark.parametrize(
+    ("source", "reason"),
+    [
+        (
+            """
+            function main(a: integer): integer
+              count(a)
+            function count(n: integer): integer
+              if n < 1 then 0 else 1 + count(n - 1)
+            """,
+            "recursive",
+        ),
+        (
+            """
+            function main(a: integer): integer
+              show(a)
+            function show(n: integer): integer
+              print(n)
+              n
+            """,
+            "prints",
+        ),
+        (
+            """
+            function main(a: integer): integer
+              double(show(a))
+            function double(x: integer): integer
+              x + x
+            function show(n: integer): integer
+              print(n)
+              n
+            """,
+            "x may print or fail and is not used exactly once",
+        ),
+        (
+            """
+            function main(a: integer): integer
+              choose(a < 0, a / 0)
+            function choose(b: boolean, x: integer): integer
+              if b then x else 0
+            """,
+            "x may print or fail and is not used exactly once",
+        ),
+        (
+            """
+            function main(a: integer, b: integer): boolean
+              greater(a * b, b)
+            function greater(x: integer, y: integer): boolean
+              not ((x < y) or (x = y))
+            """,
+            "x is used 2 times and its argument is not a literal or parameter",
+        ),
+    ],
+)
+def test_keeps_calls(source: str, reason: str):
+    ast, decisions = inline(source)
+    # The call in main made last (arguments are processed first)
+    decision = [decision for decision in decisions if decision.caller == "main"][-1]
+    assert decision.callee in calls(main_body(ast))
+    assert decision == InliningDecision(
+        "main", decision.callee, inlined=False, reason=reason
+    )
+
+
+def test_keeps_large_functions():
+    _, decisions = inline(
+        """
+        function main(a: integer): integer
+          polynomial(a)
+        function polynomial(x: integer): integer
+          x * x * x * x + 2 * x * x * x + 3 * x * x + 4 * x + 5
+        """,
+    )
+    assert decisions == [
+        InliningDecision(
+            "main", "polynomial", inlined=False, reason="too large (27 expressions)"
+        ),
+    ]
+
+
+def test_keeps_large_functions_once_inlined():
+    _, decisions = inline(
+        """
+        function main(a: integer): integer
+          increment(a * a * a * a * a * a * a * a)
+        function increment(x: integer): integer
+          x + 1
+        """,
+    )
+    assert decisions == [
+        InliningDecision(
+            "main",
+            "increment",
+            inlined=False,
+            reason="too large once inlined (17 expressions)",
+        ),
+    ]
+
+
+def test_nested_calls_fit_in_imem():
+    # Copying the argument into every use of x would double the code with each
+    # call
+    source = """
+        function main(n: integer): integer
+          sq(sq(sq(sq(sq(sq(n + 1))))))
+        function sq(x: integer): integer
+          x * x + x * x
+    """
+    code_generator = compile_program(source, inlining=True)
+    assert command_count(code_generator.lines) < IMEM_SIZE
+    assert run(code_generator, [-1]) == run(
+        compile_program(source),
+        [-1],
+    )
+
+
+def test_argument_with_calls_used_once():
+    source = """
+        function main(a: integer): integer
+          increment(show(a))
+        function increment(x: integer): integer
+          x + 1
+        function show(n: integer): integer
+          print(n)
+          n
+    """
+    ast, _ = inline(source)
+    assert calls(main_body(ast)) == ["show"]
+    assert run(compile_program(source, inlining=True), [4]) == [4, 5]
+
+
+@pytest.mark.parametrize(
+    ("filename", "arguments"),
+    [
+        ("circular-prime.kln", [50]),
+        ("farey.kln", [3, 7, 10]),
+        ("horner-parameters.kln", [1, 2, 3, 4, 5]),
+        ("is-excellent.kln", [3468]),
+        ("lib.kln", [5]),
+        ("palindrome.kln", [12321]),
+        ("sqrt-newton.kln", [100, 1]),
+    ],
+)
+def test_programs(filename: str, arguments: list[int]):
+    source = (PROGRAMS_DIR / filename).read_text()
+    assert run(compile_program(source, inlining=True), arguments) == run(
+        compile_program(source),
+        arguments,
+    )
@@ -0,0 +1,259 @@
+import pytest
+
+from compiler.code_generator import command_count
+from compiler.ir import (
+    BasicBlock,
+    BinaryOperation,
+    Copy,
+    IRFunction,
+    LoadParameter,
+    Return,
+    VirtualRegister,
+    eliminate_dead_code,
+    instruction_count,
+    lower_function,
+    optimize_function,
+)
+from compiler.ir_backend import IRCodeGenerator
+from tests.harness import (
+    PROGRAM_RUNS,
+    PROGRAMS_DIR,
+    analyze,
+    compile_program,
+    profile,
+    run,
+)
+
+
+def lower_program(source: str, *, optimized: bool = True) -> dict[str, IRFunction]:
+    ast, _ = analyze(source)
+    functions: dict[str, IRFunction] = {}
+    for definition in ast.definition_list:
+        function = lower_function(definition)
+        functions[function.name] = (
+            optimize_function(function) if optimized else function
+        )
+    return functions
+
+
+def lower(source: str, *, optimized: bool = True) -> IRFunction:
+    return lower_program(source, optimized=optimized)["main"]
+
+
+def test_lowering():
+    function = lower_program(
+        """
+        function main(n: integer): integer
+          fib(n)
+        function fib(n: integer): integer
+          if n < 2 then n else fib(n - 1) + fib(n - 2)
+        """,
+        optimized=False,
+    )["fib"]
+    assert str(function) == (
+        "function fib(n)\n"
+        "entry:\n"
+        "    v1 = param n\n"
+        "    if v1 < 2 goto then1 else else2\n"
+        "then1:\n"
+        "    v2 = param n\n"
+        "    return v2\n"
+        "else2:\n"
+        "    v3 = param n\n"
+        "    v4 = v3 - 1\n"
+        "    v5 = call fib(v4)\n"
+        "    v6 = param n\n"
+        "    v7 = v6 - 2\n"
+        "    v8 = call fib(v7)\n"
+        "    v9 = v5 + v8\n"
+        "    return v9"
+    )
+
+
+def test_values_of_conditions_join_in_one_register():
+    function = lower(
+        """
+        function main(a: integer, b: integer): integer
+          1 + (if (a < b) and not (a = 0) then a else if b < 0 then 0 else b)
+        """,
+        optimized=False,
+    )
+    # The nested if writes the same register as the outer one
+    copies = [
+        instruction
+        for instruction in function.instructions()
+        if isinstance(instruction, Copy)
+    ]
+    assert len(copies) == 3
+    assert {copy.dest for copy in copies} == {VirtualRegister(1)}
+
+
+def test_optimizations():
+    function = lower(
+        """
+        function main(a: integer, b: integer): integer
+          if a < b then (a + b) * (b + a) else f(a + b) + (a + b)
+        function f(x: integer): integer
+          x
+        """,
+    )
+    assert str(function) == (
+        "function main(a, b)\n"
+        "entry:\n"
+        "    v1 = param a\n"
+        "    v2 = param b\n"
+        "    if v1 < v2 goto then1 else else2\n"
+        "then1:\n"
+        # b + a is a + b, and both parameters were already loaded
+        "    v5 = v1 + v2\n"
+        "    v9 = v5 * v5\n"
+        "    return v9\n"
+        "else2:\n"
+        # Nothing is kept in a register across the call
+        "    v12 = v1 + v2\n"
+        "    v13 = call f(v12)\n"
+        "    v14 = param a\n"
+        "    v15 = param b\n"
+        "    v16 = v14 + v15\n"
+        "    v17 = v13 + v16\n"
+        "    return v17"
+    )
+
+
+def test_unreachable_blocks_are_removed():
+    function = lower(
+        """
+        function main(a: integer): integer
+          if true or (a = 0) then a else a / 0
+        """,
+    )
+    assert str(function) == (
+        "function main(a)\n"
+        "entry:\n"
+        "    goto then1\n"
+        "then1:\n"
+        "    v2 = param a\n"
+        "    return v2"
+    )
+
+
+def test_dead_code_keeps_divisions():
+    a, b, c, d = (VirtualRegister(number) for number in range(1, 5))
+    function = IRFunction(
+        "main",
+        ["x"],
+        [
+            BasicBlock(
+                "entry",
+                [
+                    LoadParameter(a, 0, "x"),
+                    BinaryOperation("+", b, a, 1),
+                    BinaryOperation("/", c, 1, a),
+                    Copy(d, b),
+                ],
+                Return(a),
+            ),
+        ],
+    )
+    assert eliminate_dead_code(function)
+    assert [str(instruction) for instruction in function.instructions()] == [
+        "v1 = param x",
+        "v3 = 1 / v1",
+        "return v1",
+    ]
+
+
+@pytest.mark.parametrize(("filename", "arguments"), PROGRAM_RUNS)
+def test_programs(filename: str, arguments: list[int]):
+    source = (PROGRAMS_DIR / filename).read_text()
+    direct = compile_program(source)
+    ir = compile_program(source, IRCodeGenerator)
+    expected, direct_profile = profile(direct, arguments)
+    outputs, ir_profile = profile(ir, arguments)
+    assert outputs == expected
+    assert command_count(ir.lines) <= command_count(direct.lines)
+    assert ir_profile.instructions_executed <= direct_profile.instructions_executed
+
+
+def test_optimizations_shrink_the_code():
+    source = (PROGRAMS_DIR / "farey.kln").read_text()
+    unoptimized = compile_program(source, IRCodeGenerator, ir_optimizations=False)
+    optimized = compile_program(source, IRCodeGenerator)
+    assert sum(map(instruction_count, lower_program(source).values())) < sum(
+        map(instruction_count, lower_program(source, optimized=False).values()),
+    )
+    assert command_count(optimized.lines) < command_count(unoptimized.lines)
+    assert run(optimized, [3, 7, 10]) == run(unoptimized, [3, 7, 10])
+
+
+@pytest.mark.parametrize(
+    ("expression", "return_type"),
+    [
+        ("(a < b) and (b < c)", "boolean"),
+        ("not ((a < b) and (b < c)) or (a = c)", "boolean"),
+        ("(a = b) = (b = c)", "boolean"),
+        ("if (b = 0) or (a / b < 2) then 10 * a + b else c", "integer"),
+        ("if 0 < a then a - 1 else 1 - a", "integer"),
+        ("if positive(a) and positive(b) then a else 0 - b", "integer"),
+        (
+            (
+                "((((a + b) * (c - d)) - ((a * c) + (b - d)))"
+                " * (((a - c) * (b + d)) + ((d * b) - (c + a))))"
+                " - f((a + b) * (c - d), f(a, b) + f(c, d) * ((a + c) * (b + d)))"
+            ),
+            "integer",
+        ),
+    ],
+)
+def test_expressions(expression: str, return_type: str):
+    source = f"""
+        function main(a: integer, b: integer, c: integer, d: integer): {return_type}
+          {expression}
+        function positive(n: integer): boolean
+          0 < n
+        function f(x: integer, y: integer): integer
+          x - y
+    """
+    direct = compile_program(source)
+    ir = compile_program(source, IRCodeGenerator)
+    for arguments in ([1, 2, 3, 4], [3, 2, 1, 0], [0, 0, 0, 0], [-1, 1, -1, 5]):
+        assert run(ir, arguments) == run(direct, arguments)
+
+
+def test_spilling():
+    # More values are live at once than there are general purpose registers
+    source = """
+        function main(a: integer, b: integer, c: integer, d: integer): integer
+          (a * b) + ((c * d) + ((a * c) + ((b * d) + (a * d))))
+    """
+    code_generator = compile_program(source, IRCodeGenerator)
+    assert "Spill" in code_generator.render()
+    assert run(code_generator, [3, 5, 7, 11]) == [15 + 77 + 21 + 55 + 33]
+
+
+def test_tail_calls():
+    source = """
+        function main(a: integer, b: integer): integer
+          swap(a, b, 3) + count(5000, 0)
+        function swap(a: integer, b: integer, times: integer): integer
+          print(a)
+          if times = 0 then a - b else swap(b, a, times - 1)
+        function count(n: integer, total: integer): integer
+          if n = 0 then total else count(n - 1, total + 1)
+    """
+    outputs, tail_calls = profile(compile_program(source, IRCodeGenerator), [1, 2])
+    assert outputs == [1, 2, 1, 2, 5001]
+    assert tail_calls.max_call_depth == 3
+
+
+def test_memoization():
+    source = """
+        function main(n: integer): integer
+          fib(n)
+        function fib(n: integer): integer
+          if n < 2 then n else fib(n - 1) + fib(n - 2)
+    """
+    code_generator = compile_program(source, IRCodeGenerator, memoization=True)
+    outputs, memoized = profile(code_generator, [40])
+    assert outputs == [102334155]
+    assert memoized.instructions_executed < 10000
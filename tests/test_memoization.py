@@ -0,0 +1,158 @@
+import pytest
+
+from compiler.code_generator import CodeGenerator
+from compiler.klein_errors import CodeGenerationError
+from compiler.memoization import memoized_functions, pure_functions
+from compiler.tm_vm import DMEM_SIZE
+from tests.harness import PROGRAMS_DIR, analyze, compile_program, profile, run
+
+FIBONACCI = """
+    function main(n: integer): integer
+      fib(n)
+    function fib(n: integer): integer
+      if n < 2 then n else fib(n - 1) + fib(n - 2)
+"""
+
+
+def test_pure_functions():
+    _, symbol_table = analyze(
+        """
+        function main(n: integer): integer
+          report(n) + square(n)
+        function report(n: integer): integer
+          print(n)
+          n
+        function twice(n: integer): integer
+          report(n) + report(n)
+        function square(n: integer): integer
+          n * n
+        """,
+    )
+    assert pure_functions(symbol_table) == {"square"}
+
+
+def test_memoized_functions():
+    ast, symbol_table = analyze(
+        """
+        function main(n: integer): integer
+          fib(n) + loop(n, 0) + isEven(n) + noisy(n)
+        function fib(n: integer): integer
+          if n < 2 then n else fib(n - 1) + fib(n - 2)
+        function loop(n: integer, total: integer): integer
+          if n = 0 then total else loop(n - 1, total + n)
+        function isEven(n: integer): integer
+          if n = 0 then 1 else isOdd(n - 1)
+        function isOdd(n: integer): integer
+          if n = 0 then 0 else isEven(n - 1)
+        function noisy(n: integer): integer
+          if n = 0 then report(0) else noisy(n - 1) + 1
+        function report(n: integer): integer
+          print(n)
+          n
+        """,
+    )
+    # loop only calls itself through tail calls and noisy ends up printing
+    assert memoized_functions(ast, symbol_table) == {"fib", "isEven", "isOdd"}
+
+
+def test_exponential_recursion_becomes_linear():
+    outputs, memoized = profile(
+        compile_program(FIBONACCI, memoization=True),
+        [25],
+        DMEM_SIZE,
+    )
+    assert outputs == [75025]
+    expected, unmemoized = profile(compile_program(FIBONACCI), [20], DMEM_SIZE)
+    assert expected == [6765]
+    assert memoized.instructions_executed * 100 < unmemoized.instructions_executed
+
+
+@pytest.mark.parametrize("cache_size", [1, 2, 7, 64])
+def test_evicted_results(cache_size: int):
+    source = """
+        function main(n: integer, k: integer): integer
+          choose(n, k) + choose(n, 0 - k)
+        function choose(n: integer, k: integer): integer
+          if (k < 0) or (n < k) then 0
+          else if (k = 0) or (k = n) then 1
+          else choose(n - 1, k - 1) + choose(n - 1, k)
+    """
+    memoized = compile_program(source, memoization=True, cache_size=cache_size)
+    unmemoized = compile_program(source)
+    for arguments in ([10, 4], [12, 6], [5, -3]):
+        assert run(memoized, arguments, DMEM_SIZE) == run(
+            unmemoized,
+            arguments,
+            DMEM_SIZE,
+        )
+
+
+def test_caches_start_out_empty():
+    # The first entry of f's cache is where main's arguments start out, which
+    # would look like f(0) returning 7
+    source = """
+        function main(a: integer, b: integer, c: integer): integer
+          f(b)
+        function f(x: integer): integer
+          if x < 1 then 100 else f(x - 1) + f(x - 2)
+    """
+    code_generator = compile_program(source, memoization=True)
+    assert run(code_generator, [7, 0, 1], DMEM_SIZE) == [100]
+
+
+def test_cache_size_has_to_be_positive():
+    ast, symbol_table = analyze(FIBONACCI)
+    code_generator = CodeGenerator(
+        ast,
+        symbol_table,
+        memoized_functions={"fib"},
+        cache_size=0,
+    )
+    with pytest.raises(CodeGenerationError):
+        code_generator.generate()
+
+
+@pytest.mark.parametrize("cache_size", [338, 339])
+def test_caches_have_to_leave_room_for_main(cache_size: int):
+    # Each of fib's entries takes 3 cells after DMEM[0], and main's frame 8 after
+    # the caches
+    ast, symbol_table = analyze(FIBONACCI)
+    code_generator = CodeGenerator(
+        ast,
+        symbol_table,
+        memoized_functions={"fib"},
+        cache_size=cache_size,
+    )
+    if 1 + cache_size * 3 + 8 <= DMEM_SIZE:
+        code_generator.generate()
+    else:
+        with pytest.raises(CodeGenerationError, match="no room for main's frame"):
+            code_generator.generate()
+
+
+@pytest.mark.parametrize(
+    ("filename", "arguments"),
+    [
+        ("circular-prime.kln", [50]),
+        ("generate-excellent.kln", [2]),
+        ("is-cantor-number.kln", [20]),
+        ("is-excellent.kln", [3468]),
+        ("is-special.kln", [145]),
+        ("lib.kln", [5]),
+        ("sieve.kln", [30]),
+        ("two-primes.kln", [10, 1]),
+    ],
+)
+@pytest.mark.parametrize("cache_size", [16, 4])
+def test_programs(filename: str, arguments: list[int], cache_size: int):
+    # The default caches of the programs with several memoized functions leave
+    # too little of DMEM for their recursion. The smaller caches also evict
+    # results.
+    source = (PROGRAMS_DIR / filename).read_text()
+    memoized = compile_program(source, memoization=True, cache_size=cache_size)
+    unmemoized = compile_program(source)
+    assert run(memoized, arguments, DMEM_SIZE) == run(
+        unmemoized,
+        arguments,
+        DMEM_SIZE,
+    )
@@ -31,7 +31,10 @@ from compiler.ast_nodes import (
     UnaryMinusExpression,
 )
 from compiler.klein_errors import ParseError
+from compiler import parse_table
 from compiler.parser import Parser
+from compiler.recursive_descent import PARSER_BACKENDS, RecursiveDescentParser
+from compiler.regex_scanner import SCANNER_BACKENDS
 from compiler.scanner import Scanner
 
 
@@ -40,9 +43,10 @@ def blueprint(*definitions: Definition) -> Program:
 
 
 def success_case(program: str, expected_result: ASTNode, error_message: str):
-    s = Scanner(program)
-    p = Parser(s)
-    assert p.parse() == expected_result, error_message
+    for backend, parser_type in PARSER_BACKENDS.items():
+        s = Scanner(program)
+        p = parser_type(s)
+        assert p.parse() == expected_result, f"{error_message} ({backend} parser)"
 
 
 def error_case(
@@ -50,10 +54,14 @@ def error_case(
     expected_message: str | None,
     error_message: str,
 ):
-    s = Scanner(program)
-    p = Parser(s)
-    with pytest.raises(ParseError) as excinfo:
-        _ = p.parse()
+    messages: set[str] = set()
+    for parser_type in PARSER_BACKENDS.values():
+        s = Scanner(program)
+        p = parser_type(s)
+        with pytest.raises(ParseError) as excinfo:
+            _ = p.parse()
+        messages.add(str(excinfo.value))
+    assert len(messages) == 1, "Every parser should report the same error"
     # TODO: In theory this should actually test it against a specific error message
     # but for now just erroring is acceptable.
     # assert str(excinfo.value) == expected_message, error_message
@@ -1159,3 +1167,88 @@ def test_all_programs():
         s = Scanner(path.open().read())
         p = Parser(s)
         _ = p.parse()
+
+
+@pytest.mark.parametrize(
+    "path",
+    [
+        path
+        for path in sorted(Path(__file__).parent.glob("programs/*.kln"))
+        # This program is currently invalid
+        if path.name != "egyptian-fractions.kln"
+    ],
+    ids=lambda path: path.name,
+)
+@pytest.mark.parametrize("scanner_backend", SCANNER_BACKENDS)
+def test_parse_scans_each_character_once(path: Path, scanner_backend: str):
+    program = path.read_text()
+    s = SCANNER_BACKENDS[scanner_backend](program)
+    _ = Parser(s).parse()
+    assert s.characters_scanned == len(program), (
+        "Peeking during parsing shouldn't cause any character to be scanned again"
+    )
+
+
+def test_parse_table_is_cached(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    expected = parse_table.generate_parse_table("parse-table.csv")
+    first = parse_table.load_parse_table("parse-table.csv")
+    second = parse_table.load_parse_table("parse-table.csv")
+    assert first is second, "The parse table should only be loaded once per process"
+
+    cache_path = tmp_path / "parse-table.pickle"
+    monkeypatch.setattr(
+        parse_table,
+        "parse_table_cache_path",
+        lambda _filename: str(cache_path),
+    )
+    # Bypass the process wide cache to exercise the on-disk one
+    uncached_load = parse_table.load_parse_table.__wrapped__
+    assert uncached_load("parse-table.csv") == expected
+    assert cache_path.exists(), "The parse table should be stored between runs"
+    assert uncached_load("parse-table.csv") == expected
+
+    _ = cache_path.write_bytes(b"not a pickle")
+    assert uncached_load("parse-table.csv") == expected, (
+        "A corrupted cache should be regenerated from the CSV"
+    )
+
+
+def test_dense_parse_table_matches_parse_table():
+    table = parse_table.load_parse_table("parse-table.csv")
+    dense_table = parse_table.load_dense_parse_table("parse-table.csv")
+    for nonterminal in parse_table.NonTerminal:
+        row = dense_table[
+            parse_table.intern_symbol(nonterminal) - parse_table.NONTERMINAL_BASE
+        ]
+        for terminal, code in parse_table.TERMINAL_CODES.items():
+            rule = table.get((nonterminal, terminal))
+            if rule is None:
+                assert row[code] is None
+            else:
+                assert row[code] == tuple(
+                    parse_table.intern_symbol(symbol) for symbol in reversed(rule)
+                )
+
+
+@pytest.mark.parametrize(
+    "path",
+    sorted(Path(__file__).parent.glob("programs/*.kln")),
+    ids=lambda path: path.name,
+)
+def test_recursive_descent_matches_table_parser(path: Path):
+    program = path.read_text()
+    try:
+        expected: Program | str = Parser(Scanner(program)).parse()
+    except ParseError as e:
+        expected = str(e)
+    try:
+        result: Program | str = RecursiveDescentParser(Scanner(program)).parse()
+    except ParseError as e:
+        result = str(e)
+    assert result == expected
+
+
+def test_recursive_descent_long_expressions():
+    # Lists and operator chains are parsed with loops rather than recursion
+    program = "function main(): integer " + " + ".join(["1"] * 5000)
+    assert isinstance(RecursiveDescentParser(Scanner(program)).parse(), Program)
@@ -0,0 +1,177 @@
+import pytest
+
+from compiler.peephole import optimize
+from compiler.tm import (
+    FUNCTION_MARKER,
+    Comment,
+    HaltCommand,
+    InCommand,
+    JeqCommand,
+    LdaCommand,
+    LdcCommand,
+    LdCommand,
+    OutCommand,
+    StCommand,
+    TMCommand,
+    TMLine,
+)
+from tests.harness import PROGRAMS_DIR, compile_program, run
+
+
+def commands(lines: list[TMLine]) -> list[tuple[str, tuple[int, int, int]]]:
+    return [
+        (line.command, line.operands) for line in lines if isinstance(line, TMCommand)
+    ]
+
+
+def test_jump_to_next_command():
+    lines = optimize(
+        [
+            InCommand(1),
+            JeqCommand(1, 0, 7),
+            OutCommand(1),
+            HaltCommand(),
+        ],
+    )
+    assert commands(lines) == [
+        ("IN", (1, 0, 0)),
+        ("OUT", (1, 0, 0)),
+        ("HALT", (0, 0, 0)),
+    ]
+
+
+def test_overwritten_register():
+    lines = optimize(
+        [
+            LdcCommand(1, 5, 0),
+            LdcCommand(1, 6, 0),
+            OutCommand(1),
+            HaltCommand(),
+        ],
+    )
+    assert commands(lines) == [
+        ("LDC", (1, 6, 0)),
+        ("OUT", (1, 0, 0)),
+        ("HALT", (0, 0, 0)),
+    ]
+
+
+def test_load_after_store():
+    # The store is kept, the value is read from the register it was stored from
+    lines = optimize(
+        [
+            InCommand(1),
+            StCommand(1, 1, 6),
+            LdCommand(2, 1, 6),
+            OutCommand(2),
+            HaltCommand(),
+        ],
+    )
+    assert commands(lines) == [
+        ("IN", (1, 0, 0)),
+        ("ST", (1, 1, 6)),
+        ("OUT", (1, 0, 0)),
+        ("HALT", (0, 0, 0)),
+    ]
+
+
+def test_moves():
+    lines = optimize(
+        [
+            InCommand(1),
+            LdaCommand(2, 0, 1),
+            LdcCommand(3, 0, 0),
+            StCommand(3, 0, 2),
+            HaltCommand(),
+        ],
+    )
+    assert commands(lines) == [
+        ("IN", (2, 0, 0)),
+        ("ST", (0, 0, 2)),
+        ("HALT", (0, 0, 0)),
+    ]
+
+
+def test_jumps_over_removed_commands():
+    lines = optimize(
+        [
+            InCommand(1),
+            JeqCommand(1, 4, 7),
+            LdcCommand(2, 5, 0),
+            LdcCommand(2, 6, 0),
+            OutCommand(2),
+            HaltCommand(),
+            # Skipped by the jump
+            LdcCommand(2, 7, 0),
+            LdaCommand(7, -4, 7),
+        ],
+    )
+    assert commands(lines) == [
+        ("IN", (1, 0, 0)),
+        ("JEQ", (1, 3, 7)),
+        ("LDC", (2, 6, 0)),
+        ("OUT", (2, 0, 0)),
+        ("HALT", (0, 0, 0)),
+        ("LDC", (2, 7, 0)),
+        ("LDA", (7, -4, 7)),
+    ]
+
+
+def test_unreachable_commands():
+    lines = optimize(
+        [
+            LdaCommand(7, 1, 7),
+            OutCommand(0),
+            HaltCommand(),
+            Comment(f"{FUNCTION_MARKER}unused"),
+            OutCommand(0),
+            LdCommand(7, 0, 6),
+        ],
+    )
+    # Functions are always kept
+    assert commands(lines) == [
+        ("HALT", (0, 0, 0)),
+        ("OUT", (0, 0, 0)),
+        ("LD", (7, 0, 6)),
+    ]
+
+
+def test_unused_saved_registers():
+    lines = optimize(
+        [
+            HaltCommand(),
+            Comment(f"{FUNCTION_MARKER}identity"),
+            StCommand(1, 1, 5),
+            StCommand(2, 2, 5),
+            LdCommand(1, -1, 5),
+            LdaCommand(4, 0, 1),
+            LdCommand(1, 1, 5),
+            LdCommand(2, 2, 5),
+            LdCommand(7, 2, 6),
+        ],
+    )
+    assert commands(lines) == [
+        ("HALT", (0, 0, 0)),
+        ("LD", (4, -1, 5)),
+        ("LD", (7, 2, 6)),
+    ]
+
+
+@pytest.mark.parametrize(
+    ("filename", "arguments"),
+    [
+        ("circular-prime.kln", [50]),
+        ("euclid.kln", [48, 18]),
+        ("farey.kln", [3, 7, 10]),
+        ("fibonacci.kln", [10]),
+        ("is-excellent.kln", [3468]),
+        ("sieve.kln", [30]),
+        ("sqrt-newton.kln", [100, 1]),
+    ],
+)
+def test_programs(filename: str, arguments: list[int]):
+    source = (PROGRAMS_DIR / filename).read_text()
+    unoptimized = compile_program(source, peephole=False)
+    optimized = compile_program(source, peephole=True)
+    assert len(commands(optimized.lines)) < len(commands(unoptimized.lines))
+    assert run(optimized, arguments) == run(unoptimized, arguments)
@@ -1,6 +1,6 @@
 import pytest
 
-from compiler.position import Position
+from compiler.position import LineIndex, Position
 
 
 @pytest.fixture
@@ -61,3 +61,31 @@ class TestPosition:
         position.add_newline()
         alt.add_newline()
         assert position == alt, "Positions should be equal after both adding newlines"
+
+
+class TestLineIndex:
+    def test_position_of(self):
+        line_index = LineIndex("ab\n\ncd\r\ne")
+        assert line_index.position_of(0) == Position(1, 1, 0)
+        assert line_index.position_of(1) == Position(1, 2, 1)
+        assert line_index.position_of(3) == Position(2, 1, 3), (
+            "Position right after a newline should start the next line"
+        )
+        assert line_index.position_of(5) == Position(3, 2, 5)
+        assert line_index.position_of(8) == Position(4, 1, 8), (
+            "Carriage returns are not newlines"
+        )
+        assert line_index.position_of(9) == Position(4, 2, 9), (
+            "The end of the program should have a position"
+        )
+
+    def test_get_line(self):
+        program = "ab\n\ncd\r\ne"
+        line_index = LineIndex(program)
+        assert line_index.line_count() == 4
+        for idx, line in enumerate(program.split("\n")):
+            assert line_index.get_line(idx) == line
+        with pytest.raises(IndexError):
+            _ = line_index.get_line(4)
+        with pytest.raises(IndexError):
+            _ = line_index.get_line(-1)
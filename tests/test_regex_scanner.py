@@ -0,0 +1,96 @@
+from pathlib import Path
+
+import pytest
+
+from compiler.klein_errors import KleinError, LexicalError
+from compiler.position import Position
+from compiler.regex_scanner import RegexScanner
+from compiler.scanner import Scanner
+from compiler.tokens import Token, TokenType
+
+PROGRAM_PATHS = sorted(
+    [
+        *Path(__file__).parent.glob("programs/*.kln"),
+        *Path(__file__).parent.parent.glob("programs/*.kln"),
+    ],
+)
+
+
+def scan_all(scanner: Scanner) -> list[tuple[str, str]]:
+    out: list[tuple[str, str]] = []
+    try:
+        for token in scanner:
+            out.append((str(token), str(token.position)))  # noqa: PERF401
+    except LexicalError as e:
+        out.append(("error", str(e)))
+    return out
+
+
+@pytest.mark.parametrize("path", PROGRAM_PATHS, ids=lambda path: path.name)
+def test_matches_reference_on_programs(path: Path):
+    program = path.read_text()
+    assert scan_all(RegexScanner(program)) == scan_all(Scanner(program))
+
+
+@pytest.mark.parametrize(
+    "program",
+    [
+        "_hi",
+        "ab@",
+        "ab" + chr(11),
+        "01",
+        "0k",
+        "100k",
+        "2147483648",
+        "a" * 257,
+        "(* test",
+        "(* test*",
+        "(* a **) b",
+        "hi (* \n *)\n there\r @",
+    ],
+)
+def test_errors_match_reference(program: str):
+    assert scan_all(RegexScanner(program)) == scan_all(Scanner(program))
+
+
+def test_positions():
+    s = RegexScanner("abc\nabc\rabc (* \n *) 12")
+    assert s.next() == Token(Position(1, 1, 0), TokenType.IDENTIFIER, "abc")
+    assert s.next() == Token(Position(2, 1, 4), TokenType.IDENTIFIER, "abc")
+    assert s.next() == Token(Position(2, 5, 8), TokenType.IDENTIFIER, "abc")
+    assert s.next() == Token(Position(3, 5, 20), TokenType.INTEGER, "12")
+    assert s.position == Position(3, 7, 22)
+    assert s.next() == Token(Position(3, 7, 22), TokenType.END_OF_FILE)
+
+
+def test_peek_doesnt_move_ahead():
+    s = RegexScanner("a b")
+    assert s.peek() == Token(Position(1, 1, 0), TokenType.IDENTIFIER, "a")
+    assert s.peek() == Token(Position(1, 1, 0), TokenType.IDENTIFIER, "a")
+    assert s.next() == Token(Position(1, 1, 0), TokenType.IDENTIFIER, "a")
+    assert s.next() == Token(Position(1, 3, 2), TokenType.IDENTIFIER, "b")
+
+
+def test_scan_after_termination_raises():
+    s = RegexScanner("")
+    assert s.next() == TokenType.END_OF_FILE
+    with pytest.raises(KleinError) as excinfo:
+        _ = s.next()
+    assert str(excinfo.value) == "Cannot call next on a terminated scanner"
+
+
+def test_characters_scanned():
+    s = RegexScanner("abc  def (* x *)\n@")
+    assert s.peek() == Token(Position(1, 1, 0), TokenType.IDENTIFIER, "abc")
+    assert s.characters_scanned == 3
+    assert s.next() == Token(Position(1, 1, 0), TokenType.IDENTIFIER, "abc")
+    assert s.characters_scanned == 3, "Consuming a peeked token shouldn't rescan it"
+    assert s.next() == Token(Position(1, 6, 5), TokenType.IDENTIFIER, "def")
+    assert s.characters_scanned == 8
+    reference = Scanner("abc  def (* x *)\n@")
+    _ = reference.next(), reference.next()
+    # The reference scanner counts the illegal character the fast path hands it
+    for scanner in (s, reference):
+        with pytest.raises(LexicalError):
+            _ = scanner.next()
+    assert s.characters_scanned == reference.characters_scanned
@@ -321,3 +321,39 @@ def test_scanner_iter():
     for token in s:
         assert token == tokens[0]
         _ = tokens.pop(0)
+
+
+def test_long_literals_do_not_recurse():
+    s = Scanner("9" * 5000)
+    with pytest.raises(LexicalError) as excinfo:
+        _ = s.next()
+    assert (
+        str(excinfo.value)
+        == "Klein Lexical Error at Line 1 Position 5001: Integer literal must be bounded\nbetween 0 (incl) and 2147483647 (incl)."
+    )
+    s = Scanner("a" * 5000)
+    with pytest.raises(LexicalError) as excinfo:
+        _ = s.next()
+    assert (
+        str(excinfo.value)
+        == "Klein Lexical Error at Line 1 Position 5001: Identifiers cannot be longer than\n256 characters"
+    )
+
+
+def test_comment_star_before_close():
+    # Matches full-fsm.jff: a star inside of a comment consumes the following
+    # character, so "**)" does not close the comment
+    s = Scanner("(* a **) b *)c")
+    assert s.next() == Token(Position(1, 14, 13), TokenType.IDENTIFIER, "c")
+
+
+def test_peek_is_cached():
+    s = Scanner("abc  def")
+    assert s.peek() == Token(Position(1, 1, 0), TokenType.IDENTIFIER, "abc")
+    assert s.characters_scanned == 3
+    assert s.peek() == Token(Position(1, 1, 0), TokenType.IDENTIFIER, "abc")
+    assert s.next() == Token(Position(1, 1, 0), TokenType.IDENTIFIER, "abc")
+    assert s.characters_scanned == 3, "Consuming a peeked token shouldn't rescan it"
+    assert s.position == Position(1, 4, 3)
+    assert s.next() == Token(Position(1, 6, 5), TokenType.IDENTIFIER, "def")
+    assert s.characters_scanned == 8
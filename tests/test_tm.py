@@ -0,0 +1,84 @@
+import pytest
+
+from compiler.klein_errors import TMError
+from compiler.tm import (
+    REG_PC,
+    Comment,
+    HaltCommand,
+    Label,
+    LabelReference,
+    LdaCommand,
+    LdcCommand,
+    OutCommand,
+    TMCommand,
+    TMEmitter,
+    resolve_labels,
+)
+
+
+def test_emitter_assigns_line_numbers():
+    emitter = TMEmitter()
+    emitter.extend(
+        [
+            Comment("Setup"),
+            *(LdcCommand(1, value) for value in range(10)),
+            OutCommand(1, "Print value"),
+            HaltCommand(),
+        ],
+    )
+    assert emitter.next_line_num == 12
+    lines = emitter.render().splitlines()
+    assert lines[0] == "* Setup"
+    assert lines[1] == " 0: LDC  1,0(0)"
+    assert lines[11] == "10: OUT  1,0,0  ; Print value"
+    assert lines[12] == "11: HALT 0,0,0"
+
+
+def test_emitters_are_independent():
+    first = TMEmitter()
+    first.extend(LdcCommand(1, value) for value in range(100))
+    second = TMEmitter()
+    second.emit(HaltCommand())
+    assert second.render() == "0: HALT 0,0,0\n"
+
+
+def test_emitter_rejects_duplicate_line_numbers():
+    emitter = TMEmitter()
+    emitter.emit(HaltCommand())
+    with pytest.raises(IndexError):
+        emitter.emit(HaltCommand(line_num=0))
+
+
+def test_resolve_labels():
+    lines = resolve_labels(
+        [
+            Label("start"),
+            LdcCommand(1, 3),
+            LabelReference("JEQ", 1, "end", REG_PC),
+            Comment("Loop"),
+            LdaCommand(1, -1, 1),
+            LabelReference("LDA", REG_PC, "start", REG_PC),
+            Label("end"),
+            LabelReference("LDC", REG_PC, "start"),
+        ],
+    )
+    commands = [line for line in lines if isinstance(line, TMCommand)]
+    assert [command.operands for command in commands] == [
+        (1, 3, 0),
+        (1, 2, 7),
+        (1, -1, 1),
+        (7, -4, 7),
+        (7, 0, 0),
+    ]
+    assert not any(isinstance(line, Label) for line in lines)
+    assert isinstance(lines[2], Comment)
+
+
+def test_undefined_label():
+    with pytest.raises(TMError):
+        _ = resolve_labels([LabelReference("LDC", REG_PC, "missing")])
+
+
+def test_duplicate_label():
+    with pytest.raises(TMError):
+        _ = resolve_labels([Label("twice"), HaltCommand(), Label("twice")])
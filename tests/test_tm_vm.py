@@ -0,0 +1,127 @@
+import pytest
+
+from compiler.code_generator import REG_PC, REG_ZERO
+from compiler.klein_errors import TMError
+from compiler.tm import (
+    DivCommand,
+    HaltCommand,
+    InCommand,
+    JgtCommand,
+    LdcCommand,
+    LdCommand,
+    MulCommand,
+    OutCommand,
+    StCommand,
+    SubCommand,
+    TMEmitter,
+)
+from compiler.tm_vm import TMMachine, assemble, parse_tm
+from tests.harness import PROGRAMS_DIR, compile_program, load, run
+
+
+def test_run_generated_code():
+    code_generator = compile_program((PROGRAMS_DIR / "print-one.kln").read_text())
+    outputs: list[int] = []
+    machine = load(code_generator, outputs)
+    executed = machine.run()
+    assert outputs == [1, 1]
+    assert executed == machine.instructions_executed > 0
+
+    # The rendered code runs the same way once it is parsed back in
+    outputs.clear()
+    machine = TMMachine(parse_tm(code_generator.render()), write_output=outputs.append)
+    assert machine.run() == executed
+    assert outputs == [1, 1]
+
+
+def test_loop():
+    emitter = TMEmitter()
+    emitter.extend(
+        [
+            InCommand(1),
+            LdcCommand(2, 1),
+            LdcCommand(3, 1),
+            MulCommand(3, 3, 1),
+            StCommand(3, 1, REG_ZERO),
+            LdCommand(3, 1, REG_ZERO),
+            SubCommand(1, 1, 2),
+            JgtCommand(1, -5, REG_PC),
+            OutCommand(3),
+            HaltCommand(),
+        ],
+    )
+    assert run(emitter, inputs=[5]) == [120]
+
+
+@pytest.mark.parametrize(
+    ("dividend", "divisor", "quotient"),
+    [(7, 2, 3), (-7, 2, -3), (7, -2, -3), (-7, -2, 3)],
+)
+def test_division_truncates(dividend: int, divisor: int, quotient: int):
+    emitter = TMEmitter()
+    emitter.extend(
+        [
+            LdcCommand(1, dividend),
+            LdcCommand(2, divisor),
+            DivCommand(3, 1, 2),
+            OutCommand(3),
+            HaltCommand(),
+        ],
+    )
+    assert run(emitter) == [quotient]
+
+
+def test_runtime_errors():
+    emitter = TMEmitter()
+    emitter.extend([LdcCommand(1, 1), DivCommand(1, 1, 0), HaltCommand()])
+    with pytest.raises(TMError, match="Division by zero"):
+        _ = run(emitter)
+
+    emitter = TMEmitter()
+    emitter.extend([LdCommand(1, -1, REG_ZERO), HaltCommand()])
+    with pytest.raises(TMError, match="outside of data memory"):
+        _ = run(emitter)
+
+    emitter = TMEmitter()
+    emitter.extend([LdcCommand(REG_PC, 5000)])
+    with pytest.raises(TMError, match="outside of instruction memory"):
+        _ = run(emitter)
+
+
+def test_parse_tm_errors():
+    assert parse_tm("* comment\n\n0: HALT 0,0,0 ignored text\n").opcodes[0] == 0
+    with pytest.raises(TMError, match="Unknown opcode"):
+        _ = parse_tm("0: JMP 0,0,0")
+    with pytest.raises(TMError, match="Wrong operand format"):
+        _ = parse_tm("0: LD 0,0,0")
+    with pytest.raises(TMError, match="uses register 8"):
+        _ = parse_tm("0: ADD 8,0,0")
+    with pytest.raises(TMError, match="Unable to parse line 2"):
+        _ = parse_tm("0: HALT 0,0,0\nHALT")
+
+
+def test_profile():
+    code_generator = compile_program((PROGRAMS_DIR / "print-one.kln").read_text())
+    for program in [assemble(code_generator.lines), parse_tm(code_generator.render())]:
+        outputs: list[int] = []
+        machine = TMMachine(program, write_output=outputs.append)
+        profile = machine.profile()
+        assert outputs == [1, 1]
+        assert profile.instructions_executed == machine.run()
+        assert sum(profile.address_counts) == profile.instructions_executed
+        assert {
+            name: function.calls for name, function in profile.functions.items()
+        } == {
+            "<setup>": 0,
+            "print": 1,
+            "main": 1,
+        }
+        assert (
+            sum(function.instructions for function in profile.functions.values())
+            == profile.instructions_executed
+        )
+        assert profile.max_call_depth == 2
+
+        report = profile.report(program, hot_spots=3)
+        assert "instructions executed" in report
+        assert report.index("main") < report.index("print")